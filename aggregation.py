@@ -0,0 +1,263 @@
+import bisect
+import heapq
+from collections import Counter
+
+from archive import epoch_to_date_play, iter_play_columns, month_bounds
+from names import canonical_spellings, normalize_name
+
+
+def _ranked(counter, limit=None):
+    """Sort (key, count) pairs by count descending, then key, optionally truncated."""
+    if limit is not None:
+        # Keeps only the top limit items instead of sorting all of them
+        return heapq.nsmallest(limit, counter.items(), key=lambda x: (-x[1], x[0]))
+    return sorted(counter.items(), key=lambda x: (-x[1], x[0]))
+
+
+class PlayAggregates:
+    """Play counters per (year, month) and per (year, song), built in one pass over the plays.
+
+    Every play section of statistics.json is derived from these counters in memory,
+    instead of running a separate GROUP BY over the playlists table for each one.
+    Years and months are kept as the zero-padded strings used in the export.
+    Artist spellings that only differ in case, diacritics or whitespace ("Björk"
+    and "Bjork") are counted as one artist under their most played spelling.
+    """
+
+    def __init__(self):
+        self.month_counts = {}  # year -> Counter(month -> plays)
+        self.song_counts = {}  # year -> Counter((artist, title) -> plays)
+        self.min_date = None
+        self.max_date = None
+        self._artist_counts = {}
+        self._rank_counts = {}
+        self._canonical_artists = None
+        self._artist_keys = {}  # artist -> normalize_name(artist)
+
+    def add(self, year, month, artist, title, play_count):
+        """Add play_count plays of a song in the given year and month."""
+        self.month_counts.setdefault(year, Counter())[month] += play_count
+        self.song_counts.setdefault(year, Counter())[(artist, title)] += play_count
+        self._invalidate(year)
+
+    def _invalidate(self, year):
+        """Drop the derived counters affected by new plays in a year."""
+        self._artist_counts.pop(year, None)
+        self._rank_counts.pop(year, None)
+        if self._canonical_artists is not None:
+            self._canonical_artists = None
+            self._artist_counts.clear()
+            self._rank_counts.clear()
+
+    def add_partial(self, year, partial):
+        """Add the plays of a whole year from a dict returned by year_partial."""
+        self.month_counts.setdefault(year, Counter()).update(partial['months'])
+        self.song_counts.setdefault(year, Counter()).update(
+            {(artist, title): play_count for artist, title, play_count in partial['songs']}
+        )
+        self._artist_keys.update(partial['artist_keys'])
+        self._invalidate(year)
+
+    def year_partial(self, year):
+        """Return the counters of a year as a JSON-serialisable dict, for add_partial."""
+        artists = {artist for artist, _ in self.song_counts[year]}
+        return {
+            'months': dict(self.month_counts[year]),
+            'songs': [[artist, title, play_count] for (artist, title), play_count in self.song_counts[year].items()],
+            'artist_keys': {artist: self._artist_key(artist) for artist in artists},
+        }
+
+    @classmethod
+    def from_database(cls, conn, years=None):
+        """Build the counters from the monthly_song_plays rollup.
+        
+        Falls back to a single aggregation query over playlists on databases
+        without rollup tables.
+        
+        Args:
+            conn: Database connection
+            years: Only read the plays of these years ('YYYY'), default all
+        """
+        aggregates = cls()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'monthly_song_plays'"
+        )
+        if cursor.fetchone():
+            query = """
+                SELECT substr(r.month, 1, 4) as year,
+                       substr(r.month, 6, 2) as month,
+                       s.artist, s.title, r.play_count
+                FROM monthly_song_plays r
+                JOIN songs s ON r.song_id = s.id
+                {period_filter}
+            """
+            period_filter = "WHERE r.month >= ? AND r.month < ?"
+        else:
+            query = """
+                SELECT substr(p.date_play, 1, 4) as year,
+                       substr(p.date_play, 6, 2) as month,
+                       s.artist, s.title, COUNT(*) as play_count
+                FROM playlists p
+                JOIN songs s ON p.song_id = s.id
+                {period_filter}
+                GROUP BY year, month, p.song_id
+            """
+            period_filter = "WHERE p.date_play >= ? AND p.date_play < ?"
+        
+        if years is None:
+            batches = [(query.format(period_filter=""), ())]
+        else:
+            # A range on the leading key column for every year, so only its rows are read
+            query = query.format(period_filter=period_filter)
+            batches = [(query, (year, str(int(year) + 1))) for year in years]
+        for batch_query, params in batches:
+            cursor.execute(batch_query, params)
+            for year, month, artist, title, play_count in cursor.fetchall():
+                aggregates.add(year, month, artist, title, play_count)
+
+        # Both use the date_play index instead of scanning the table
+        cursor.execute("SELECT MIN(date_play) FROM playlists")
+        aggregates.min_date = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(date_play) FROM playlists")
+        aggregates.max_date = cursor.fetchone()[0]
+        return aggregates
+
+    @classmethod
+    def from_archives(cls, archive_dir):
+        """Build the counters from the memory-mapped play columns of the yearly archives."""
+        aggregates = cls()
+        for year, columns in iter_play_columns(archive_dir):
+            if not len(columns):
+                continue
+            for month in range(1, 13):
+                counts = columns.song_counts(*month_bounds(int(year), month))
+                for song_id, play_count in counts.items():
+                    artist, title = columns.song(song_id)
+                    aggregates.add(year, f"{month:02d}", artist, title, play_count)
+
+            first_play = epoch_to_date_play(columns.epochs[0])
+            last_play = epoch_to_date_play(columns.epochs[-1])
+            if aggregates.min_date is None or first_play < aggregates.min_date:
+                aggregates.min_date = first_play
+            if aggregates.max_date is None or last_play > aggregates.max_date:
+                aggregates.max_date = last_play
+        return aggregates
+
+    @property
+    def years(self):
+        return sorted(self.song_counts)
+
+    @property
+    def total_plays(self):
+        return sum(sum(counts.values()) for counts in self.month_counts.values())
+
+    def canonical_artists(self):
+        """Map every artist spelling to the most played spelling with the same normalize_name key."""
+        if self._canonical_artists is None:
+            plays_by_spelling = Counter()
+            for counts in self.song_counts.values():
+                for (artist, _), play_count in counts.items():
+                    plays_by_spelling[artist] += play_count
+            
+            self._canonical_artists = canonical_spellings(plays_by_spelling, key=self._artist_key)
+        return self._canonical_artists
+
+    def _artist_key(self, artist):
+        key = self._artist_keys.get(artist)
+        if key is None:
+            key = self._artist_keys[artist] = normalize_name(artist)
+        return key
+
+    def artist_counts(self, year):
+        """Plays per artist in a year, with spelling variants merged."""
+        if year not in self._artist_counts:
+            canonical_artists = self.canonical_artists()
+            counts = Counter()
+            for (artist, _), play_count in self.song_counts[year].items():
+                counts[canonical_artists[artist]] += play_count
+            self._artist_counts[year] = counts
+        return self._artist_counts[year]
+
+    def total_artist_counts(self):
+        counts = Counter()
+        for year in self.years:
+            counts.update(self.artist_counts(year))
+        return counts
+
+    def total_song_counts(self):
+        counts = Counter()
+        for year in self.years:
+            counts.update(self.song_counts[year])
+        return counts
+
+    def years_data(self):
+        return [
+            {'year': year, 'song_count': sum(self.month_counts[year].values())}
+            for year in self.years
+        ]
+
+    def monthly_data(self, year):
+        return [
+            {'month': month, 'song_count': song_count}
+            for month, song_count in sorted(self.month_counts[year].items())
+        ]
+
+    def monthly_data_by_year(self):
+        return {year: self.monthly_data(year) for year in self.years}
+
+    def top_artists(self, limit, year=None):
+        counts = self.total_artist_counts() if year is None else self.artist_counts(year)
+        return [{'artist': artist, 'play_count': play_count} for artist, play_count in _ranked(counts, limit)]
+
+    def top_songs(self, limit, year=None):
+        counts = self.total_song_counts() if year is None else self.song_counts[year]
+        return [
+            {'artist': artist, 'title': title, 'play_count': play_count}
+            for (artist, title), play_count in _ranked(counts, limit)
+        ]
+
+    def artist_rank(self, year, artist):
+        """Return (rank, play_count) of an artist in a year with SQL RANK() semantics.
+
+        Tied artists share a rank. Returns None if the artist has no plays that year.
+        """
+        play_count = self.artist_counts(year).get(artist)
+        if not play_count:
+            return None
+        if year not in self._rank_counts:
+            self._rank_counts[year] = sorted(self.artist_counts(year).values())
+        ascending = self._rank_counts[year]
+        # Number of artists with strictly more plays, plus one
+        return len(ascending) - bisect.bisect_right(ascending, play_count) + 1, play_count
+
+    def search_index(self, min_plays=1):
+        """Compact index of all artists and songs with at least min_plays plays, for searching.
+        
+        Returns:
+            A dict with 'artists', a list of [artist, plays], and 'songs', a list of
+            [artist position in 'artists', title, plays], both most played first.
+        """
+        artist_counts = self.total_artist_counts()
+        artists = [(artist, plays) for artist, plays in _ranked(artist_counts) if plays >= min_plays]
+        positions = {artist: i for i, (artist, _) in enumerate(artists)}
+        canonical_artists = self.canonical_artists()
+        songs = [
+            [positions[canonical_artists[artist]], title, plays]
+            for (artist, title), plays in _ranked(self.total_song_counts())
+            if plays >= min_plays
+        ]
+        return {'artists': [list(artist) for artist in artists], 'songs': songs}
+
+    def year_language_counts(self, year, song_languages):
+        """Plays per language in a year, given a (artist, title) -> language map."""
+        counts = Counter()
+        for song, play_count in self.song_counts[year].items():
+            language = song_languages.get(song)
+            if language is not None:
+                counts[language] += play_count
+        return dict(_ranked(counts))
+
+    def language_by_year(self, song_languages):
+        """Plays per language in every year, given a (artist, title) -> language map."""
+        return {year: self.year_language_counts(year, song_languages) for year in self.years}
@@ -0,0 +1,209 @@
+from array import array
+
+from names import canonical_spellings
+
+ABSENT_RANK = 999  # Timeline rank of a year without plays of the artist
+TIMELINE_MAX_POSITION = 100  # Years an artist is listed in, by position in the year's top list
+
+
+def _zeros(length):
+    return array('q', bytes(8 * length))
+
+
+class RankMatrix:
+    """Plays, positions and ranks of every artist in every year, in integer arrays.
+
+    Artists get integer ids in name order and every year is an array of play
+    counts indexed by artist id, filled by a single counting pass over the song
+    plays. Each year's artists are then sorted once by plays, which gives every
+    artist both its position in the year's top list (ties broken by name, as in
+    the exported lists) and its rank with SQL RANK() semantics (tied artists
+    share a rank). Top lists, ranks and timelines are array lookups afterwards.
+    """
+
+    def __init__(self, years, artists, plays):
+        """
+        Args:
+            years: The years ('YYYY'), in order
+            artists: Artist names, sorted; an artist's id is its index
+            plays: One array of plays per artist id for every year
+        """
+        self.years = list(years)
+        self.artists = list(artists)
+        self.artist_ids = {artist: artist_id for artist_id, artist in enumerate(self.artists)}
+        self.plays = plays
+        self.total_plays = _zeros(len(self.artists))
+        for year_plays in plays:
+            for artist_id, play_count in enumerate(year_plays):
+                self.total_plays[artist_id] += play_count
+
+        self.orders = [self._order(year_plays) for year_plays in plays]
+        self.total_order = self._order(self.total_plays)
+        self.positions = []  # Year index -> array of 1-based positions, 0 without plays
+        self.ranks = []  # Year index -> array of RANK()s, 0 without plays
+        for year_plays, order in zip(plays, self.orders):
+            positions = _zeros(len(self.artists))
+            ranks = _zeros(len(self.artists))
+            rank = previous_plays = 0
+            for position, artist_id in enumerate(order, 1):
+                if year_plays[artist_id] != previous_plays:
+                    rank = position
+                    previous_plays = year_plays[artist_id]
+                positions[artist_id] = position
+                ranks[artist_id] = rank
+            self.positions.append(positions)
+            self.ranks.append(ranks)
+
+    @staticmethod
+    def _order(plays):
+        """Ids of the artists with plays, most played first; the sort is stable, so ties stay in name order."""
+        order = sorted(range(len(plays)), key=plays.__getitem__, reverse=True)
+        while order and not plays[order[-1]]:
+            order.pop()
+        return order
+
+    @classmethod
+    def from_song_plays(cls, years, spellings, song_artists, song_years, song_play_counts, canonical=None):
+        """Build the matrix from plays given as parallel integer arrays.
+
+        Args:
+            years: The years ('YYYY'), in order
+            spellings: Artist names as written on the songs
+            song_artists: Index into spellings of the artist of each row
+            song_years: Index into years of each row
+            song_play_counts: Plays of each row
+            canonical: Spelling -> artist map, if already known
+
+        Artist spellings that only differ in case, diacritics or whitespace are
+        merged under their most played spelling, as in PlayAggregates.
+        """
+        if canonical is None:
+            plays_by_spelling = _zeros(len(spellings))
+            for spelling_id, play_count in zip(song_artists, song_play_counts):
+                plays_by_spelling[spelling_id] += play_count
+            canonical = canonical_spellings(dict(zip(spellings, plays_by_spelling)))
+
+        artists = sorted(set(canonical.values()))
+        artist_ids = {artist: artist_id for artist_id, artist in enumerate(artists)}
+        artist_of_spelling = array('q', (artist_ids[canonical[spelling]] for spelling in spellings))
+
+        plays = [_zeros(len(artists)) for _ in years]
+        for spelling_id, year_index, play_count in zip(song_artists, song_years, song_play_counts):
+            plays[year_index][artist_of_spelling[spelling_id]] += play_count
+        return cls(years, artists, plays)
+
+    @classmethod
+    def from_aggregates(cls, aggregates):
+        """Build the matrix from the song counters of a PlayAggregates."""
+        years = aggregates.years
+        spelling_ids = {}
+        song_artists = array('q')
+        song_years = array('q')
+        song_play_counts = array('q')
+        for year_index, year in enumerate(years):
+            for (artist, _), play_count in aggregates.song_counts[year].items():
+                song_artists.append(spelling_ids.setdefault(artist, len(spelling_ids)))
+                song_years.append(year_index)
+                song_play_counts.append(play_count)
+        return cls.from_song_plays(
+            years, list(spelling_ids), song_artists, song_years, song_play_counts,
+            canonical=aggregates.canonical_artists()
+        )
+
+    @classmethod
+    def from_database(cls, conn):
+        """Build the matrix from the monthly_song_plays rollup, read as integer columns."""
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, artist FROM songs")
+        spelling_ids = {}
+        artist_of_song = {}
+        for song_id, artist in cursor.fetchall():
+            artist_of_song[song_id] = spelling_ids.setdefault(artist, len(spelling_ids))
+
+        cursor.execute("SELECT song_id, CAST(substr(month, 1, 4) AS INTEGER), play_count FROM monthly_song_plays")
+        rows = cursor.fetchall()
+        first_year = min((row[1] for row in rows), default=0)
+        last_year = max((row[1] for row in rows), default=-1)
+        years = [f"{year:04d}" for year in range(first_year, last_year + 1)]
+        song_artists = array('q', (artist_of_song[row[0]] for row in rows))
+        song_years = array('q', (row[1] - first_year for row in rows))
+        song_play_counts = array('q', (row[2] for row in rows))
+        matrix = cls.from_song_plays(years, list(spelling_ids), song_artists, song_years, song_play_counts)
+        # Years without plays aren't part of the export
+        played = [year_index for year_index, order in enumerate(matrix.orders) if order]
+        if len(played) < len(years):
+            matrix = cls([years[i] for i in played], matrix.artists, [matrix.plays[i] for i in played])
+        return matrix
+
+    def top_artists(self, limit, year=None):
+        """Most played artists overall or in a year, in the format of PlayAggregates.top_artists."""
+        if year is None:
+            order, plays = self.total_order, self.total_plays
+        else:
+            year_index = self.years.index(year)
+            order, plays = self.orders[year_index], self.plays[year_index]
+        return [
+            {'artist': self.artists[artist_id], 'play_count': plays[artist_id]}
+            for artist_id in order[:limit]
+        ]
+
+    def artist_rank(self, year, artist):
+        """Return (rank, play_count) of an artist in a year with SQL RANK() semantics, or None without plays."""
+        year_index = self.years.index(year)
+        artist_id = self.artist_ids.get(artist)
+        if artist_id is None or not self.ranks[year_index][artist_id]:
+            return None
+        return self.ranks[year_index][artist_id], self.plays[year_index][artist_id]
+
+    def top_ranked_artists(self, max_rank):
+        """Artists ranked max_rank or better (ties included) in any year, sorted by name."""
+        return sorted({
+            self.artists[artist_id]
+            for ranks, order in zip(self.ranks, self.orders)
+            for artist_id in order
+            if ranks[artist_id] <= max_rank
+        })
+
+    def timeline(self, artists, max_position=TIMELINE_MAX_POSITION):
+        """Rank timeline of the given artists, for the bump chart of the website.
+
+        Each artist gets an entry for every year it is in the top max_position,
+        ranked by position. Artists listed in at least 2 years also get an entry
+        for the year after each of their listed years and for one-year gaps,
+        ranked with RANK() semantics, or ABSENT_RANK with 0 plays if they
+        weren't played that year.
+
+        Returns:
+            A dict of artist -> list of {'year', 'rank', 'play_count'}, by year.
+        """
+        timeline = {}
+        for artist in artists:
+            artist_id = self.artist_ids.get(artist)
+            listed = [
+                artist_id is not None and 0 < self.positions[year_index][artist_id] <= max_position
+                for year_index in range(len(self.years))
+            ]
+
+            extra = set()
+            if sum(listed) >= 2:
+                for year_index in range(len(self.years) - 1):
+                    # The year after a listed year
+                    if listed[year_index] and not listed[year_index + 1]:
+                        extra.add(year_index + 1)
+                    # A one-year gap between listed years
+                    elif (not listed[year_index] and listed[year_index + 1]
+                          and year_index > 0 and listed[year_index - 1]):
+                        extra.add(year_index)
+
+            entries = []
+            for year_index, year in enumerate(self.years):
+                if listed[year_index]:
+                    rank = self.positions[year_index][artist_id]
+                elif year_index in extra:
+                    rank = self.ranks[year_index][artist_id] if artist_id is not None else 0
+                else:
+                    continue
+                play_count = self.plays[year_index][artist_id] if rank else 0
+                entries.append({'year': year, 'rank': rank or ABSENT_RANK, 'play_count': play_count})
+            timeline[artist] = entries
+        return timeline
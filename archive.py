@@ -0,0 +1,468 @@
+import bisect
+import calendar
+import json
+import mmap
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from ingest import hash_content, playlist_rows
+
+# Yearly archive layout:
+#   header:   magic, format version, section count
+#   sections: table of (name, codec, offset, length, raw length) entries
+#   payloads: one per section, 8-byte aligned, raw or zlib-compressed
+#
+# Plays are stored as columns: original id and epoch seconds as int64, artist,
+# title, image prefix and image name as uint32 indexes into string dictionaries.
+# Day documents keep all fields except the playlist in a JSON "days" section.
+#
+# A second, time-sorted copy of every play with an artist and title is kept in
+# uncompressed fixed-width columns (play_epoch int64, play_song uint32 indexing
+# the (artist, title) pairs of the "songs" section), so that PlayColumns can
+# memory-map them for scans without decoding the whole archive.
+MAGIC = b"RNSA"
+FORMAT_VERSION = 2
+ARCHIVE_SUFFIX = ".rnsa"
+HEADER = struct.Struct("<4sHxxI")
+SECTION = struct.Struct("<16sIQQQ")
+ALIGNMENT = 8
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+ROW_KEYS = ("id", "date_play", "artist", "title", "img")
+DATE_PLAY_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_PLAY_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+# Column name -> array typecode
+COLUMNS = {
+    "id": "q",
+    "epoch": "q",
+    "artist": "I",
+    "title": "I",
+    "img_prefix": "I",
+    "img_name": "I",
+}
+DICTIONARIES = ("artists", "titles", "img_prefixes", "img_names")
+
+
+class ArchiveError(Exception):
+    """Raised when an archive file is malformed or has an unsupported version."""
+
+
+def date_play_to_epoch(date_play):
+    """Convert a 'YYYY-MM-DD HH:MM:SS' timestamp to epoch seconds (treated as UTC)."""
+    return calendar.timegm(time.strptime(date_play, DATE_PLAY_FORMAT))
+
+
+def epoch_to_date_play(epoch):
+    """Convert epoch seconds back to a 'YYYY-MM-DD HH:MM:SS' timestamp."""
+    return time.strftime(DATE_PLAY_FORMAT, time.gmtime(epoch))
+
+
+def _is_columnar_row(song):
+    """Check whether a play can be stored in the columns without losing anything."""
+    if not (
+        isinstance(song, dict)
+        and tuple(song) == ROW_KEYS
+        and type(song["id"]) is int
+        and -2 ** 63 <= song["id"] < 2 ** 63
+        and isinstance(song["date_play"], str)
+        and DATE_PLAY_PATTERN.fullmatch(song["date_play"]) is not None
+        and isinstance(song["artist"], str)
+        and isinstance(song["title"], str)
+        and isinstance(song["img"], str)
+    ):
+        return False
+    try:
+        return epoch_to_date_play(date_play_to_epoch(song["date_play"])) == song["date_play"]
+    except ValueError:
+        return False
+
+
+def _split_img(img):
+    """Split an image URL into a (prefix, name) pair at the last slash."""
+    prefix, slash, name = img.rpartition("/")
+    return prefix + slash, name
+
+
+class _Dictionary:
+    """Assigns consecutive indexes to distinct strings."""
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def add(self, value):
+        idx = self.index.get(value)
+        if idx is None:
+            idx = self.index[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+
+def _column_bytes(values):
+    """Serialise an array column as little-endian bytes."""
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _column_from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def pack_days(days):
+    """Encode (date, document) pairs of one year into archive bytes.
+
+    Days whose plays don't fit the column layout (unexpected keys or value types)
+    are stored verbatim as JSON, so that packing is always loss-free.
+    """
+    dictionaries = {name: _Dictionary() for name in DICTIONARIES}
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+    songs = _Dictionary()
+    plays = []  # (epoch, song index) pairs for the time-sorted play index
+    day_headers = []
+
+    def index_play(artist, title, epoch):
+        if artist and title:
+            song = songs.add((dictionaries["artists"].add(artist), dictionaries["titles"].add(title)))
+            plays.append((epoch, song))
+
+    for day, document in days:
+        playlist = document.get("playlist") if isinstance(document, dict) else None
+        if not isinstance(playlist, list) or not all(_is_columnar_row(song) for song in playlist):
+            day_headers.append({"date": day, "raw": json.dumps(document, ensure_ascii=False)})
+            for song in playlist if isinstance(playlist, list) else []:
+                try:
+                    index_play(song.get("artist"), song.get("title"), date_play_to_epoch(song["date_play"]))
+                except (AttributeError, KeyError, TypeError, ValueError):
+                    continue
+            continue
+
+        for song in playlist:
+            img_prefix, img_name = _split_img(song["img"])
+            epoch = date_play_to_epoch(song["date_play"])
+            columns["id"].append(song["id"])
+            columns["epoch"].append(epoch)
+            columns["artist"].append(dictionaries["artists"].add(song["artist"]))
+            columns["title"].append(dictionaries["titles"].add(song["title"]))
+            columns["img_prefix"].append(dictionaries["img_prefixes"].add(img_prefix))
+            columns["img_name"].append(dictionaries["img_names"].add(img_name))
+            index_play(song["artist"], song["title"], epoch)
+
+        # Keep every other field (and the key order) of the day document
+        fields = {key: (len(playlist) if key == "playlist" else value) for key, value in document.items()}
+        day_headers.append({"date": day, "fields": fields})
+
+    # Repeated plays of a song at the same time are stored once, as in the database
+    plays = sorted(set(plays))
+    song_pairs = array("I")
+    for artist_idx, title_idx in songs.values:
+        song_pairs.extend((artist_idx, title_idx))
+
+    sections = [("days", CODEC_ZLIB, json.dumps(day_headers, ensure_ascii=False).encode("utf-8"))]
+    for name in DICTIONARIES:
+        payload = json.dumps(dictionaries[name].values, ensure_ascii=False).encode("utf-8")
+        sections.append((name, CODEC_ZLIB, payload))
+    for name, values in columns.items():
+        sections.append((name, CODEC_ZLIB, _column_bytes(values)))
+    sections.append(("songs", CODEC_ZLIB, _column_bytes(song_pairs)))
+    sections.append(("play_epoch", CODEC_RAW, _column_bytes(array("q", [epoch for epoch, _ in plays]))))
+    sections.append(("play_song", CODEC_RAW, _column_bytes(array("I", [song for _, song in plays]))))
+    return _write_sections(sections)
+
+
+def _write_sections(sections):
+    """Lay out sections after the header and section table."""
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    payloads = []
+    for name, codec, raw in sections:
+        payload = zlib.compress(raw, 9) if codec == CODEC_ZLIB else raw
+        padding = -offset % ALIGNMENT
+        offset += padding
+        table.append(SECTION.pack(name.encode("ascii"), codec, offset, len(payload), len(raw)))
+        payloads.append(b"\0" * padding + payload)
+        offset += len(payload)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)) + b"".join(table) + b"".join(payloads)
+
+
+def read_section_table(buffer):
+    """Parse the header and return {name: (codec, offset, length, raw_length)}."""
+    if len(buffer) < HEADER.size:
+        raise ArchiveError("File is too short to be an archive")
+    magic, version, section_count = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ArchiveError("Not a playlist archive")
+    if version != FORMAT_VERSION:
+        raise ArchiveError(f"Unsupported archive version {version}, re-pack it with --pack-archive")
+
+    if HEADER.size + section_count * SECTION.size > len(buffer):
+        raise ArchiveError("Section table is truncated")
+    table = {}
+    for i in range(section_count):
+        name, codec, offset, length, raw_length = SECTION.unpack_from(buffer, HEADER.size + i * SECTION.size)
+        name = name.rstrip(b"\0").decode("ascii")
+        if offset + length > len(buffer):
+            raise ArchiveError(f"Section {name} is truncated")
+        table[name] = (codec, offset, length, raw_length)
+    return table
+
+
+def _section_bytes(buffer, entry):
+    codec, offset, length, raw_length = entry
+    payload = bytes(buffer[offset:offset + length])
+    if codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    if len(payload) != raw_length:
+        raise ArchiveError(f"Section has {len(payload)} bytes instead of {raw_length}")
+    return payload
+
+
+class YearArchive:
+    """Decoded contents of a yearly archive."""
+
+    def __init__(self, buffer):
+        table = read_section_table(buffer)
+        self.days = json.loads(_section_bytes(buffer, table["days"]))
+        self.dictionaries = {
+            name: json.loads(_section_bytes(buffer, table[name])) for name in DICTIONARIES
+        }
+        self.columns = {
+            name: _column_from_bytes(typecode, _section_bytes(buffer, table[name]))
+            for name, typecode in COLUMNS.items()
+        }
+        row_count = sum(count for _, _, count in self._iter_day_rows())
+        for name, values in self.columns.items():
+            if len(values) != row_count:
+                raise ArchiveError(f"Column {name} has {len(values)} rows instead of {row_count}")
+
+    @classmethod
+    def load(cls, path):
+        return cls(Path(path).read_bytes())
+
+    def _iter_day_rows(self):
+        """Yield (day header, first row, row count) for every day."""
+        row = 0
+        for header in self.days:
+            count = header["fields"]["playlist"] if "fields" in header else 0
+            yield header, row, count
+            row += count
+
+    def _song(self, row):
+        img_prefix = self.dictionaries["img_prefixes"][self.columns["img_prefix"][row]]
+        img_name = self.dictionaries["img_names"][self.columns["img_name"][row]]
+        return {
+            "id": self.columns["id"][row],
+            "date_play": epoch_to_date_play(self.columns["epoch"][row]),
+            "artist": self.dictionaries["artists"][self.columns["artist"][row]],
+            "title": self.dictionaries["titles"][self.columns["title"][row]],
+            "img": img_prefix + img_name,
+        }
+
+    def iter_documents(self):
+        """Yield (date, document) pairs in the API shape of the original JSON files."""
+        for header, first_row, count in self._iter_day_rows():
+            if "raw" in header:
+                yield header["date"], json.loads(header["raw"])
+                continue
+            playlist = [self._song(row) for row in range(first_row, first_row + count)]
+            document = {
+                key: (playlist if key == "playlist" else value)
+                for key, value in header["fields"].items()
+            }
+            yield header["date"], document
+
+    def rows(self):
+        """Return (artist, title, original_id, date_play, img) tuples for all plays.
+
+        Rows without an artist or title are skipped, as when loading JSON files.
+        """
+        artists = self.dictionaries["artists"]
+        titles = self.dictionaries["titles"]
+        img_prefixes = self.dictionaries["img_prefixes"]
+        img_names = self.dictionaries["img_names"]
+        columns = self.columns
+        rows = []
+        for header, first_row, count in self._iter_day_rows():
+            if "raw" in header:
+                rows.extend(playlist_rows(json.loads(header["raw"])))
+                continue
+            for row in range(first_row, first_row + count):
+                artist = artists[columns["artist"][row]]
+                title = titles[columns["title"][row]]
+                if not artist or not title:
+                    continue
+                rows.append((
+                    artist,
+                    title,
+                    columns["id"][row],
+                    epoch_to_date_play(columns["epoch"][row]),
+                    img_prefixes[columns["img_prefix"][row]] + img_names[columns["img_name"][row]],
+                ))
+        return rows
+
+
+class PlayColumns:
+    """Memory-mapped, time-sorted play columns of a yearly archive.
+
+    epochs and song_ids are memoryviews straight into the mapped file, so scans
+    and counts over a time range don't allocate per play. Song indexes are local
+    to the archive; song() resolves them to (artist, title).
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ArchiveError("Memory-mapped archives require a little-endian platform")
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            # An empty file can't be mapped
+            if self.path.stat().st_size < HEADER.size:
+                raise ArchiveError("File is too short to be an archive")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._table = read_section_table(self._mmap)
+            self._view = memoryview(self._mmap)
+            self.epochs = self._column("play_epoch", "q")
+            self.song_ids = self._column("play_song", "I")
+            if len(self.epochs) != len(self.song_ids):
+                raise ArchiveError("The play_epoch and play_song columns have different lengths")
+        except (ArchiveError, KeyError):
+            self.close()
+            raise
+        self._songs = None
+
+    def _column(self, name, fmt):
+        codec, offset, length, raw_length = self._table[name]
+        if codec != CODEC_RAW:
+            raise ArchiveError(f"Section {name} is compressed and cannot be memory-mapped")
+        if length != raw_length or length % struct.calcsize(fmt):
+            raise ArchiveError(f"Section {name} has a bad length")
+        return self._view[offset:offset + length].cast(fmt)
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the column views and unmap the file."""
+        for name in ("epochs", "song_ids", "_view"):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+
+    def bounds(self, start=None, end=None):
+        """Return the (lo, hi) row range of plays with start <= epoch < end."""
+        lo = 0 if start is None else bisect.bisect_left(self.epochs, start)
+        hi = len(self.epochs) if end is None else bisect.bisect_left(self.epochs, end)
+        return lo, max(lo, hi)
+
+    def count_between(self, start=None, end=None):
+        """Count plays with start <= epoch < end using binary search only."""
+        lo, hi = self.bounds(start, end)
+        return hi - lo
+
+    def song_counts(self, start=None, end=None):
+        """Count plays per archive song index with start <= epoch < end."""
+        lo, hi = self.bounds(start, end)
+        return Counter(self.song_ids[lo:hi])
+
+    def song(self, song_id):
+        """Resolve an archive song index to an (artist, title) pair."""
+        if self._songs is None:
+            artists = json.loads(_section_bytes(self._mmap, self._table["artists"]))
+            titles = json.loads(_section_bytes(self._mmap, self._table["titles"]))
+            pairs = _column_from_bytes("I", _section_bytes(self._mmap, self._table["songs"]))
+            self._songs = [(artists[pairs[i]], titles[pairs[i + 1]]) for i in range(0, len(pairs), 2)]
+        return self._songs[song_id]
+
+
+def month_bounds(year, month):
+    """Return the [start, end) epoch range of a calendar month."""
+    start = calendar.timegm((year, month, 1, 0, 0, 0))
+    end = calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+    return start, end
+
+
+def iter_play_columns(archive_dir):
+    """Yield (year, PlayColumns) for every archive in archive_dir, closing each after use."""
+    for archive_path in sorted(Path(archive_dir).glob(f"*{ARCHIVE_SUFFIX}")):
+        with PlayColumns(archive_path) as columns:
+            yield archive_path.stem, columns
+
+
+def pack_data_dir(data_dir, archive_dir):
+    """Pack every year directory of data_dir into archive_dir/YYYY.rnsa.
+
+    Returns:
+        A list of (archive path, day count) tuples.
+    """
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    packed = []
+    for year_dir in sorted(path for path in Path(data_dir).iterdir() if path.is_dir()):
+        json_files = sorted(year_dir.glob("*.json"))
+        if not json_files:
+            continue
+        days = []
+        for json_path in json_files:
+            with open(json_path, "r", encoding="utf-8") as f:
+                days.append((json_path.stem, json.load(f)))
+        archive_path = archive_dir / f"{year_dir.name}{ARCHIVE_SUFFIX}"
+        archive_path.write_bytes(pack_days(days))
+        packed.append((archive_path, len(days)))
+    return packed
+
+
+def unpack_archive(archive_path, data_dir):
+    """Regenerate the daily JSON files of one archive into data_dir/YYYY/.
+
+    Returns:
+        The number of files written.
+    """
+    year_archive = YearArchive.load(archive_path)
+    year_dir = Path(data_dir) / Path(archive_path).stem
+    year_dir.mkdir(parents=True, exist_ok=True)
+    written = 0
+    for day, document in year_archive.iter_documents():
+        with open(year_dir / f"{day}.json", "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=4, ensure_ascii=False)
+        written += 1
+    return written
+
+
+def parse_archive_file(archive_path, known_hash=None):
+    """Read, hash and decode a yearly archive into compact row tuples.
+
+    Mirrors ingest.parse_day_file, so archives can be loaded by save_to_database.
+
+    Returns:
+        A (content_hash, rows, error) tuple. rows is None when the content hash
+        equals known_hash or when the archive could not be decoded.
+    """
+    buffer = Path(archive_path).read_bytes()
+    content_hash = hash_content(buffer)
+    if content_hash == known_hash:
+        return content_hash, None, None
+    try:
+        return content_hash, YearArchive(buffer).rows(), None
+    except (ArchiveError, KeyError, ValueError, zlib.error) as e:
+        return content_hash, None, str(e)
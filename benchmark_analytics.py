@@ -0,0 +1,160 @@
+"""Compare the ways of building the artist rank timeline on a playlist database.
+
+- sql: RANK() window queries over the playlists table, a query per year and
+  per gap year, as the exporter used to do. Artist spellings aren't merged,
+  so its timeline isn't compared with the others.
+- counters: PlayAggregates built from the rollups, with a rank lookup in its
+  Counters for every artist and year, as the exporter did before RankMatrix.
+- matrix: analytics.RankMatrix built from the rollups as integer arrays.
+
+Usage:
+    python benchmark_analytics.py [--db playlist.db] [--runs 3]
+"""
+import argparse
+import time
+
+from aggregation import PlayAggregates
+from analytics import RankMatrix
+from database import DB_NAME, connect
+
+
+def sql_timeline(conn):
+    """Build the timeline with SQL ranking queries."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT substr(date_play, 1, 4) as year FROM playlists ORDER BY year")
+    all_years = [row[0] for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT s.artist, COUNT(*) as play_count
+        FROM playlists p
+        JOIN songs s ON p.song_id = s.id
+        GROUP BY s.artist
+        ORDER BY play_count DESC, s.artist
+        LIMIT 40
+    """)
+    top_overall_artists = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        WITH yearly_ranks AS (
+            SELECT substr(p.date_play, 1, 4) as year, s.artist,
+                   RANK() OVER (PARTITION BY substr(p.date_play, 1, 4) ORDER BY COUNT(*) DESC) as yearly_rank
+            FROM playlists p
+            JOIN songs s ON p.song_id = s.id
+            GROUP BY year, s.artist
+        )
+        SELECT DISTINCT artist FROM yearly_ranks WHERE yearly_rank <= 10
+    """)
+    artists_to_track = sorted(set(top_overall_artists) | {row[0] for row in cursor.fetchall()})
+
+    positions = {}
+    for year in all_years:
+        cursor.execute("""
+            SELECT s.artist, COUNT(*) as play_count
+            FROM playlists p
+            JOIN songs s ON p.song_id = s.id
+            WHERE p.date_play >= ? AND p.date_play < ?
+            GROUP BY s.artist
+            ORDER BY play_count DESC, s.artist
+            LIMIT 100
+        """, (year, str(int(year) + 1)))
+        positions[year] = {artist: (i, plays) for i, (artist, plays) in enumerate(cursor.fetchall(), 1)}
+
+    timeline = {}
+    for artist in artists_to_track:
+        listed = [artist in positions[year] for year in all_years]
+        entries = [
+            {'year': year, 'rank': positions[year][artist][0], 'play_count': positions[year][artist][1]}
+            for year in all_years if artist in positions[year]
+        ]
+        if sum(listed) >= 2:
+            # The years after listed years and one-year gaps between them
+            gap_years = sorted({
+                all_years[i + 1] if listed[i] else all_years[i]
+                for i in range(len(all_years) - 1)
+                if (listed[i] and not listed[i + 1]) or (not listed[i] and listed[i + 1] and i > 0 and listed[i - 1])
+            })
+            for year in gap_years:
+                cursor.execute("""
+                    WITH ranked AS (
+                        SELECT s.artist, COUNT(*) as play_count, RANK() OVER (ORDER BY COUNT(*) DESC) as rank
+                        FROM playlists p
+                        JOIN songs s ON p.song_id = s.id
+                        WHERE p.date_play >= ? AND p.date_play < ?
+                        GROUP BY s.artist
+                    )
+                    SELECT rank, play_count FROM ranked WHERE artist = ?
+                """, (year, str(int(year) + 1), artist))
+                row = cursor.fetchone()
+                entries.append({'year': year, 'rank': row[0] if row else 999, 'play_count': row[1] if row else 0})
+        timeline[artist] = sorted(entries, key=lambda entry: entry['year'])
+    return timeline
+
+
+def matrix_timeline(conn):
+    """Build the timeline from a RankMatrix."""
+    matrix = RankMatrix.from_database(conn)
+    artists = sorted({row['artist'] for row in matrix.top_artists(40)} | set(matrix.top_ranked_artists(10)))
+    return matrix.timeline(artists)
+
+
+def counters_timeline(conn):
+    """The timeline as the exporter built it before RankMatrix, with a rank lookup per artist and year."""
+    aggregates = PlayAggregates.from_database(conn)
+    years = aggregates.years
+    artists = sorted(
+        {row['artist'] for row in aggregates.top_artists(40)}
+        | {artist for year in years for artist in aggregates.artist_counts(year)
+           if aggregates.artist_rank(year, artist)[0] <= 10}
+    )
+    positions = {
+        year: {row['artist']: (i, row['play_count']) for i, row in enumerate(aggregates.top_artists(100, year=year), 1)}
+        for year in years
+    }
+    timeline = {}
+    for artist in artists:
+        listed = [artist in positions[year] for year in years]
+        entries = [
+            {'year': year, 'rank': positions[year][artist][0], 'play_count': positions[year][artist][1]}
+            for year in years if artist in positions[year]
+        ]
+        if sum(listed) >= 2:
+            # The years after listed years and one-year gaps between them
+            gap_years = sorted({
+                years[i + 1] if listed[i] else years[i]
+                for i in range(len(years) - 1)
+                if (listed[i] and not listed[i + 1]) or (not listed[i] and listed[i + 1] and i > 0 and listed[i - 1])
+            })
+            for year in gap_years:
+                rank = aggregates.artist_rank(year, artist)
+                entries.append({'year': year, 'rank': rank[0] if rank else 999, 'play_count': rank[1] if rank else 0})
+        timeline[artist] = sorted(entries, key=lambda entry: entry['year'])
+    return timeline
+
+
+def run(label, build, conn, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        timeline = build(conn)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<12} {best:8.2f}s  {len(timeline):>4} artists")
+    return best, timeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark building the artist rank timeline")
+    parser.add_argument("--db", default=DB_NAME, help="Playlist database")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs, the fastest one is reported")
+    args = parser.parse_args()
+
+    conn = connect('read', args.db)
+    sql_time, _ = run("sql", sql_timeline, conn, args.runs)
+    counters_time, counters = run("counters", counters_timeline, conn, args.runs)
+    matrix_time, matrix = run("matrix", matrix_timeline, conn, args.runs)
+    if matrix != counters:
+        raise SystemExit("FAIL: the matrix and counter timelines differ")
+    print(f"Speedup over sql: {sql_time / matrix_time:.1f}x, over counters: {counters_time / matrix_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure how long importing the CLI takes with python -X importtime.
+
+Exits with status 1 if importing main pulls in a module that only some
+commands need (see DEFERRED_MODULES), or takes longer than --budget-ms
+(DEFAULT_BUDGET_MS unless given, 0 disables it), so it can run as a
+regression check.
+
+Usage:
+    python benchmark_import_time.py [--module main] [--runs 5] [--top 10] [--budget-ms MS]
+"""
+import argparse
+import subprocess
+import sys
+
+# Modules main must only import inside the commands that use them
+DEFERRED_MODULES = [
+    "requests", "musicbrainzngs", "langdetect",
+    "fetcher", "ingest", "archive", "metadata", "musicbrainz_client", "mb_dump", "rolling",
+]
+# main imports in about 25 ms locally, leave room for slower CI runners
+DEFAULT_BUDGET_MS = 200
+
+
+def import_times(module):
+    """Import a module in a fresh interpreter.
+
+    Returns:
+        A dict mapping the module and every module it imported to their
+        cumulative import time in microseconds. Modules imported during
+        interpreter startup are left out.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            # A top-level import; the modules nested in it were listed just before it
+            if name.strip() == module:
+                times[module] = int(cumulative)
+                return times
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative)
+    raise RuntimeError(f"{module} not found in the -X importtime output")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the CLI")
+    parser.add_argument("--module", default="main", help="Module to import")
+    parser.add_argument("--runs", type=int, default=5, help="Number of imports, the fastest one is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to list")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"Fail if the import takes longer (default {DEFAULT_BUDGET_MS}, 0 disables the check)")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times[args.module])
+    total_ms = best[args.module] / 1000
+    print(f"import {args.module}: {total_ms:.1f} ms (fastest of {args.runs})")
+    for name, cumulative in sorted(best.items(), key=lambda x: -x[1])[1:args.top + 1]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    deferred = sorted(name for name in best if name in DEFERRED_MODULES)
+    if args.module == "main" and deferred:
+        print(f"FAIL: importing {args.module} imports {', '.join(deferred)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"FAIL: import took {total_ms:.1f} ms, budget is {args.budget_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Compare per-row and batch ingest of the data/ tree into a fresh database.
+
+Usage:
+    python benchmark_ingest.py [--data-dir data] [--limit N] [--skip-legacy]
+"""
+import argparse
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import database
+from database import get_or_create_song, add_song_play, add_playlist_batch, load_song_ids
+from ingest import read_playlist_file, playlist_rows
+
+
+def load_rows(json_files):
+    """Parse all files up front so that only database writes are timed."""
+    rows_by_file = []
+    for json_path in json_files:
+        _, data = read_playlist_file(json_path)
+        rows_by_file.append(playlist_rows(data))
+    return rows_by_file
+
+
+def ingest_per_row(db_path, rows_by_file):
+    """Load plays the old way: get_or_create_song and add_song_play for every row."""
+    with sqlite3.connect(db_path) as conn:
+        for rows in rows_by_file:
+            for artist, title, original_id, date_play, img in rows:
+                song_id = get_or_create_song(conn, artist, title, original_id)
+                add_song_play(conn, song_id, date_play, img)
+
+
+def ingest_batch(db_path, rows_by_file):
+    """Load plays with add_playlist_batch, one transaction per day file."""
+    with sqlite3.connect(db_path) as conn:
+        song_ids = load_song_ids(conn)
+        for rows in rows_by_file:
+            add_playlist_batch(conn, rows, song_ids)
+
+
+def count_plays(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM playlists").fetchone()[0]
+
+
+def run(label, ingest, db_path, rows_by_file):
+    database.DB_NAME = str(db_path)
+    database.setup_database()
+    start = time.perf_counter()
+    ingest(db_path, rows_by_file)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:9.2f}s  {count_plays(db_path):>8} plays")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark playlist ingest into SQLite")
+    parser.add_argument("--data-dir", default="data", help="Directory with daily JSON files")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N files")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the batch loader")
+    args = parser.parse_args()
+
+    json_files = sorted(Path(args.data_dir).rglob("*.json"))[:args.limit]
+    rows_by_file = load_rows(json_files)
+    total_rows = sum(len(rows) for rows in rows_by_file)
+    print(f"Loaded {total_rows} plays from {len(json_files)} files")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        batch_time = run("batch", ingest_batch, Path(tmp_dir) / "batch.db", rows_by_file)
+        if not args.skip_legacy:
+            legacy_time = run("per-row", ingest_per_row, Path(tmp_dir) / "per_row.db", rows_by_file)
+            print(f"Speedup: {legacy_time / batch_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
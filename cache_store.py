@@ -0,0 +1,149 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from logger_config import setup_logger
+
+# Configure logging
+logger = setup_logger(__name__, 'metadata_processing.log')
+
+DAY = 24 * 60 * 60
+DEFAULT_TTL = 180 * DAY  # Found entries
+DEFAULT_NEGATIVE_TTL = 30 * DAY  # Entries cached as not found (None)
+
+
+class CacheStore:
+    """Persistent key-value cache backed by a SQLite file.
+
+    Entries live in namespaces (e.g. 'artists' and 'details') and are read and
+    written one at a time through the primary key, so the cost of a lookup or an
+    update doesn't grow with the size of the cache. Values are stored as JSON;
+    None marks a negative entry (e.g. an artist that was not found), which
+    expires after negative_ttl seconds, while other entries expire after ttl
+    seconds. The file is only opened on first use. Safe to share between threads.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            # Autocommit, so that every set() is persisted on its own
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,  -- JSON, 'null' for negative entries
+                stored_at REAL NOT NULL,  -- Unix time
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+            """)
+        return self._conn
+
+    def _is_expired(self, value, stored_at, now):
+        ttl = self.negative_ttl if value is None else self.ttl
+        return ttl is not None and now - stored_at > ttl
+
+    def get(self, namespace, key):
+        """Look up an entry.
+
+        Returns:
+            A (found, value) tuple; found is False for missing and expired entries.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, stored_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, str(key))
+            ).fetchone()
+        if row is None:
+            return False, None
+        value = json.loads(row[0])
+        if self._is_expired(value, row[1], time.time()):
+            return False, None
+        return True, value
+
+    def set(self, namespace, key, value):
+        """Store or replace an entry; None stores a negative entry."""
+        with self._lock:
+            self._connect().execute(
+                """
+                INSERT INTO cache_entries (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    stored_at = excluded.stored_at
+                """,
+                (namespace, str(key), json.dumps(value), time.time())
+            )
+
+    def set_many(self, namespace, items):
+        """Store several (key, value) pairs in one transaction."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO cache_entries (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    stored_at = excluded.stored_at
+                """,
+                ((namespace, str(key), json.dumps(value), now) for key, value in items)
+            )
+            conn.execute("COMMIT")
+
+    def purge_expired(self):
+        """Delete expired entries.
+
+        Returns:
+            The number of deleted entries.
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                """
+                DELETE FROM cache_entries
+                WHERE (value = 'null' AND ? IS NOT NULL AND stored_at < ? - ?)
+                   OR (value != 'null' AND ? IS NOT NULL AND stored_at < ? - ?)
+                """,
+                (self.negative_ttl, now, self.negative_ttl, self.ttl, now, self.ttl)
+            )
+            return cursor.rowcount
+
+    def keys(self, namespace, include_negative=False):
+        """Return the keys of the unexpired entries in a namespace."""
+        now = time.time()
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, value = 'null', stored_at FROM cache_entries WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return [
+            key for key, is_negative, stored_at in rows
+            if (include_negative or not is_negative)
+            and not self._is_expired(None if is_negative else True, stored_at, now)
+        ]
+
+    def count(self, namespace):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def clear(self):
+        """Delete all entries."""
+        with self._lock:
+            self._connect().execute("DELETE FROM cache_entries")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
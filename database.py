@@ -1,18 +1,86 @@
+import atexit
 import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import json
 import os
+import secrets
 from logger_config import setup_logger
 
 # Configure logging
 logger = setup_logger(__name__, 'db_migration.log')
 
 DB_NAME = "playlist.db"
-NOT_FOUND_SONGS_FILE = "not_found_songs.txt"
+NOT_FOUND_SONGS_FILE = "not_found_songs.txt"  # Old log of failed lookups, imported once
+LOOKUP_RETRY_BASE = 24 * 60 * 60  # Seconds before retrying a failed metadata lookup
+LOOKUP_RETRY_MAX = 180 * 24 * 60 * 60  # Longest wait, reached after repeated failures
+
+# PRAGMAs applied to new connections, per connection profile:
+#   default: everyday reads and writes
+#   bulk: loads that can be redone if interrupted, e.g. --save-to-db and rollup rebuilds;
+#         commits don't wait for the disk
+#   read: read-only connections, e.g. for exports
+_BASE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers don't block the writer and commits append to the log
+    'synchronous': 'NORMAL',  # Safe with WAL, only the last commits can be lost on power failure
+    'cache_size': -64 * 1024,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # ms
+}
+CONNECTION_PROFILES = {
+    'default': _BASE_PRAGMAS,
+    'bulk': {**_BASE_PRAGMAS, 'synchronous': 'OFF', 'cache_size': -256 * 1024},
+    'read': {key: value for key, value in _BASE_PRAGMAS.items() if key not in ('journal_mode', 'synchronous')},
+}
+
+_connections = threading.local()
+
+def connect(profile='default', db_path=None):
+    """Open a new connection to the database with the PRAGMAs of a connection profile.
+    
+    Args:
+        profile: Key of CONNECTION_PROFILES; 'read' connections are opened read-only
+        db_path: Database file, DB_NAME by default
+    """
+    db_path = db_path or DB_NAME
+    pragmas = CONNECTION_PROFILES[profile]
+    if profile == 'read':
+        conn = sqlite3.connect(f"file:{Path(db_path).resolve()}?mode=ro", uri=True)
+    else:
+        conn = sqlite3.connect(db_path)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+def get_connection(profile='default', db_path=None):
+    """Return this thread's shared connection to the database for a connection profile.
+    
+    The connection is opened on first use and reused by later calls, so helpers
+    called in a loop don't reconnect every time. Use it as a context manager to
+    commit (or roll back) like a new connection; it stays open until
+    close_connections is called, which also happens at exit.
+    """
+    db_path = db_path or DB_NAME
+    if not hasattr(_connections, 'by_key'):
+        _connections.by_key = {}
+    key = (str(db_path), profile)
+    conn = _connections.by_key.get(key)
+    if conn is None:
+        conn = _connections.by_key[key] = connect(profile, db_path)
+    return conn
+
+@atexit.register
+def close_connections():
+    """Close this thread's shared connections, checkpointing the write-ahead log."""
+    for conn in getattr(_connections, 'by_key', {}).values():
+        conn.close()
+    _connections.by_key = {}
 
 def setup_database():
     """Create the database with the new schema."""
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         # Drop existing tables if they exist
@@ -60,9 +128,488 @@ def setup_database():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlists_date_play ON playlists(date_play)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_songs_artist_title ON songs(artist, title)")
         
+        migrate_database(conn)
+        
         conn.commit()
         logger.info("Database schema created successfully")
 
+def ensure_playlist_unique_constraint(conn):
+    """Add the unique (song_id, date_play) index to the playlists table.
+    
+    Older databases only relied on add_song_play checking for duplicates, so any
+    duplicate plays are removed (keeping the first one) before creating the index.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_playlists_song_date_play'"
+    )
+    if cursor.fetchone():
+        return
+    
+    cursor.execute("""
+        DELETE FROM playlists
+        WHERE id NOT IN (SELECT MIN(id) FROM playlists GROUP BY song_id, date_play)
+    """)
+    if cursor.rowcount > 0:
+        logger.info(f"Removed {cursor.rowcount} duplicate plays")
+    cursor.execute(
+        "CREATE UNIQUE INDEX idx_playlists_song_date_play ON playlists(song_id, date_play)"
+    )
+    conn.commit()
+
+def ensure_ingest_ledger(conn):
+    """Create the ingest ledger table if it doesn't exist.
+    
+    The ledger records every JSON file that was loaded into the database, so that
+    unchanged files can be skipped on the next run.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_ledger (
+        path TEXT PRIMARY KEY,  -- Path relative to the data directory
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,  -- SHA-256 of the file content
+        rows_ingested INTEGER NOT NULL,
+        ingested_at TEXT NOT NULL
+    )
+    """)
+
+def add_play_date_columns(conn):
+    """Add generated year, month and epoch columns to playlists, with indexes.
+    
+    date_play is TEXT, so filtering with strftime() or substr() over it can't use an
+    index. The generated columns are VIRTUAL, so adding them doesn't rewrite the table;
+    only the indexes store their values. play_epoch treats date_play as UTC, like the
+    yearly archives.
+    """
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_xinfo(playlists)")}
+    generated_columns = {
+        "play_year": "CAST(substr(date_play, 1, 4) AS INTEGER)",
+        "play_month": "CAST(substr(date_play, 6, 2) AS INTEGER)",
+        "play_epoch": "unixepoch(date_play)",
+    }
+    for column, expression in generated_columns.items():
+        if column not in columns:
+            cursor.execute(
+                f"ALTER TABLE playlists ADD COLUMN {column} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL"
+            )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_playlists_year_month_song ON playlists(play_year, play_month, song_id)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlists_year_song ON playlists(play_year, song_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlists_epoch ON playlists(play_epoch)")
+
+def import_not_found_songs(conn):
+    """Import the failed lookups logged to NOT_FOUND_SONGS_FILE into metadata_lookup_failures.
+    
+    Lines are "artist - title"; every line counts as one attempt made when the
+    file was last modified. Lines not matching a known song are ignored.
+    
+    Returns:
+        False while the songs table is empty (e.g. on --create-db, before the
+        first load), so the migration is applied again once songs are loaded.
+    """
+    if not os.path.exists(NOT_FOUND_SONGS_FILE):
+        return
+    if conn.execute("SELECT 1 FROM songs LIMIT 1").fetchone() is None:
+        logger.info(f"No songs loaded yet, importing {NOT_FOUND_SONGS_FILE} later")
+        return False
+    
+    with open(NOT_FOUND_SONGS_FILE, "r", encoding="utf-8") as f:
+        attempts_by_line = {}
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                attempts_by_line[line] = attempts_by_line.get(line, 0) + 1
+    
+    last_attempt = datetime.fromtimestamp(os.path.getmtime(NOT_FOUND_SONGS_FILE), timezone.utc)
+    rows = []
+    for song_id, artist, title in conn.execute("SELECT id, artist, title FROM songs"):
+        attempts = attempts_by_line.get(f"{artist} - {title}")
+        if attempts:
+            delay = min(LOOKUP_RETRY_BASE * 2 ** (attempts - 1), LOOKUP_RETRY_MAX)
+            rows.append((
+                song_id, attempts,
+                last_attempt.strftime("%Y-%m-%d %H:%M:%S"),
+                (last_attempt + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
+            ))
+    conn.executemany(
+        """
+        INSERT INTO metadata_lookup_failures (song_id, attempts, last_attempt, next_attempt)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(song_id) DO NOTHING
+        """,
+        rows
+    )
+    logger.info(f"Imported {len(rows)} of {len(attempts_by_line)} songs from {NOT_FOUND_SONGS_FILE}")
+
+# Schema migrations, applied in order; PRAGMA user_version holds the number applied so far.
+# A migration returning False can't be applied yet, it and the later ones are retried next time.
+MIGRATIONS = [
+    add_play_date_columns,
+    import_not_found_songs,
+]
+
+def migrate_database(conn):
+    """Bring an existing database up to the current schema in place, without re-ingesting.
+    
+    Returns:
+        The number of migrations applied.
+    """
+    ensure_playlist_unique_constraint(conn)
+    ensure_ingest_ledger(conn)
+    ensure_lookup_failures(conn)
+    ensure_stats_snapshot(conn)
+    
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    applied = 0
+    for target_version, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.info(f"Applying migration {target_version}: {migration.__name__}")
+        with conn:
+            if migration(conn) is False:
+                break
+            conn.execute(f"PRAGMA user_version = {target_version}")
+        applied += 1
+    
+    # The rollup queries use the migrated columns
+    ensure_rollups(conn)
+    ensure_export_changes(conn)
+    return applied
+
+def ensure_lookup_failures(conn):
+    """Create the table of failed metadata lookups if it doesn't exist.
+    
+    Songs whose lookup failed are retried with exponential backoff: after the
+    n-th failure a song is skipped until next_attempt, LOOKUP_RETRY_BASE * 2^(n-1)
+    seconds later (at most LOOKUP_RETRY_MAX).
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS metadata_lookup_failures (
+        song_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        last_attempt TEXT NOT NULL,
+        next_attempt TEXT NOT NULL,
+        FOREIGN KEY (song_id) REFERENCES songs(id)
+    )
+    """)
+
+def ensure_stats_snapshot(conn):
+    """Create the table holding the last result of get_song_stats if it doesn't exist.
+    
+    Triggers delete the snapshot whenever songs or song_metadata change, so a
+    snapshot that exists is always up to date.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS metadata_stats_snapshot (
+        id INTEGER PRIMARY KEY CHECK (id = 1),  -- A single row
+        computed_at TEXT NOT NULL,
+        stats TEXT NOT NULL  -- JSON of get_song_stats
+    )
+    """)
+    for table in ("songs", "song_metadata"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_snapshot_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                DELETE FROM metadata_stats_snapshot;
+            END
+            """)
+
+def ensure_export_changes(conn):
+    """Create the table of change versions read by the exporter if it doesn't exist.
+    
+    Triggers bump the version of a period whenever the data it is exported from
+    changes: a month ('YYYY-MM') when its monthly_song_plays rows change, 'songs'
+    when a song is renamed and 'song_metadata' when any metadata changes. The
+    exporter remembers the versions it last exported and only recomputes the
+    years whose versions moved on.
+    
+    Versions are counters local to a database, so a rebuilt database may reach
+    the same versions with different plays. The 'database' row holds a random
+    id drawn when the table is created, which the exporter compares as well.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS export_changes (
+        period TEXT PRIMARY KEY,  -- 'YYYY-MM', 'songs', 'song_metadata' or 'database'
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO export_changes (period, version) VALUES ('database', ?)",
+        (secrets.randbits(62),)
+    )
+    bump = """
+        INSERT INTO export_changes (period, version) VALUES ({period}, 1)
+        ON CONFLICT(period) DO UPDATE SET version = version + 1;
+    """
+    triggers = [
+        ("monthly_song_plays", "INSERT", bump.format(period="NEW.month")),
+        ("monthly_song_plays", "UPDATE", bump.format(period="OLD.month") + bump.format(period="NEW.month")),
+        ("monthly_song_plays", "DELETE", bump.format(period="OLD.month")),
+        ("songs", "UPDATE OF artist, title", bump.format(period="'songs'")),
+        ("song_metadata", "INSERT", bump.format(period="'song_metadata'")),
+        ("song_metadata", "UPDATE", bump.format(period="'song_metadata'")),
+        ("song_metadata", "DELETE", bump.format(period="'song_metadata'")),
+    ]
+    for table, event, statements in triggers:
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_export_changes_{event.split()[0].lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            {statements}
+        END
+        """)
+    conn.commit()
+
+def get_export_versions(conn):
+    """Return the change version of every period, see ensure_export_changes.
+    
+    Returns:
+        A dict of period -> version, or None on databases without change tracking.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'export_changes'")
+    if not cursor.fetchone():
+        return None
+    cursor.execute("SELECT period, version FROM export_changes")
+    return dict(cursor.fetchall())
+
+def get_month_checksums(conn):
+    """Return the number of rows and plays of every month in monthly_song_plays.
+    
+    Returns:
+        A dict of month ('YYYY-MM') -> [rows, plays].
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT month, COUNT(*), SUM(play_count) FROM monthly_song_plays GROUP BY month")
+    return {month: [rows, plays] for month, rows, plays in cursor.fetchall()}
+
+# Rollup table -> (key columns, query aggregating the playlists table into it)
+ROLLUPS = {
+    "daily_song_plays": (
+        ("day", "song_id"),
+        """
+        SELECT substr(date_play, 1, 10) as day, song_id, COUNT(*) as play_count
+        FROM playlists
+        GROUP BY day, song_id
+        """
+    ),
+    # Grouping by the indexed date columns reads idx_playlists_year_month_song only
+    "monthly_song_plays": (
+        ("month", "song_id"),
+        """
+        SELECT printf('%04d-%02d', play_year, play_month) as month, song_id, COUNT(*) as play_count
+        FROM playlists
+        GROUP BY play_year, play_month, song_id
+        """
+    ),
+    "monthly_artist_plays": (
+        ("month", "artist"),
+        """
+        SELECT printf('%04d-%02d', p.play_year, p.play_month) as month, s.artist, COUNT(*) as play_count
+        FROM playlists p
+        JOIN songs s ON p.song_id = s.id
+        GROUP BY p.play_year, p.play_month, s.artist
+        """
+    ),
+    "yearly_artist_plays": (
+        ("year", "artist"),
+        """
+        SELECT printf('%04d', p.play_year) as year, s.artist, COUNT(*) as play_count
+        FROM playlists p
+        JOIN songs s ON p.song_id = s.id
+        GROUP BY p.play_year, s.artist
+        """
+    ),
+}
+
+# Statements run by the playlists triggers for each play; :delta is +1 or -1 and
+# the period and song are taken from NEW (inserts) or OLD (deletes)
+_ROLLUP_UPSERTS = (
+    """
+    INSERT INTO daily_song_plays (day, song_id, play_count)
+    VALUES (substr({row}.date_play, 1, 10), {row}.song_id, {delta})
+    ON CONFLICT(day, song_id) DO UPDATE SET play_count = play_count + {delta};
+    """,
+    """
+    INSERT INTO monthly_song_plays (month, song_id, play_count)
+    VALUES (substr({row}.date_play, 1, 7), {row}.song_id, {delta})
+    ON CONFLICT(month, song_id) DO UPDATE SET play_count = play_count + {delta};
+    """,
+    """
+    INSERT INTO monthly_artist_plays (month, artist, play_count)
+    SELECT substr({row}.date_play, 1, 7), artist, {delta} FROM songs WHERE id = {row}.song_id
+    ON CONFLICT(month, artist) DO UPDATE SET play_count = play_count + {delta};
+    """,
+    """
+    INSERT INTO yearly_artist_plays (year, artist, play_count)
+    SELECT substr({row}.date_play, 1, 4), artist, {delta} FROM songs WHERE id = {row}.song_id
+    ON CONFLICT(year, artist) DO UPDATE SET play_count = play_count + {delta};
+    """,
+)
+
+# Statements removing rollup rows whose count dropped to zero after a delete
+_ROLLUP_CLEANUPS = (
+    """
+    DELETE FROM daily_song_plays
+    WHERE day = substr(OLD.date_play, 1, 10) AND song_id = OLD.song_id AND play_count = 0;
+    """,
+    """
+    DELETE FROM monthly_song_plays
+    WHERE month = substr(OLD.date_play, 1, 7) AND song_id = OLD.song_id AND play_count = 0;
+    """,
+    """
+    DELETE FROM monthly_artist_plays
+    WHERE month = substr(OLD.date_play, 1, 7)
+      AND artist = (SELECT artist FROM songs WHERE id = OLD.song_id) AND play_count = 0;
+    """,
+    """
+    DELETE FROM yearly_artist_plays
+    WHERE year = substr(OLD.date_play, 1, 4)
+      AND artist = (SELECT artist FROM songs WHERE id = OLD.song_id) AND play_count = 0;
+    """,
+)
+
+def ensure_rollups(conn):
+    """Create the rollup tables and the triggers keeping them up to date.
+    
+    The rollups hold play counts per day/month/year and song or artist. Triggers on
+    the playlists table update them for every inserted, updated or deleted play, so
+    every ingest path maintains them. When the tables are first created on an
+    existing database they are filled from the playlists table.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing_tables = {row[0] for row in cursor.fetchall()}
+    
+    for table, (key_columns, _) in ROLLUPS.items():
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            {key_columns[0]} TEXT NOT NULL,
+            {key_columns[1]} {'INTEGER' if key_columns[1] == 'song_id' else 'TEXT'} NOT NULL,
+            play_count INTEGER NOT NULL,
+            PRIMARY KEY ({key_columns[0]}, {key_columns[1]})
+        ) WITHOUT ROWID
+        """)
+    
+    remove_zero_counts = "".join(_ROLLUP_CLEANUPS)
+    inserted = "".join(statement.format(row="NEW", delta="1") for statement in _ROLLUP_UPSERTS)
+    deleted = "".join(statement.format(row="OLD", delta="-1") for statement in _ROLLUP_UPSERTS)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_playlists_rollups_insert AFTER INSERT ON playlists
+    BEGIN
+        {inserted}
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_playlists_rollups_delete AFTER DELETE ON playlists
+    BEGIN
+        {deleted}
+        {remove_zero_counts}
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_playlists_rollups_update AFTER UPDATE OF song_id, date_play ON playlists
+    BEGIN
+        {deleted}
+        {inserted}
+        {remove_zero_counts}
+    END
+    """)
+    
+    if not set(ROLLUPS) <= existing_tables:
+        rebuild_rollups(conn)
+    conn.commit()
+
+def drop_rollup_triggers(conn):
+    """Drop the rollup triggers, e.g. before a bulk load into an empty playlists table.
+    
+    ensure_rollups recreates them; call rebuild_rollups afterwards to catch up.
+    """
+    cursor = conn.cursor()
+    for action in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS trg_playlists_rollups_{action}")
+    conn.commit()
+
+def rebuild_rollups(conn):
+    """Recompute all rollup tables from the playlists table."""
+    cursor = conn.cursor()
+    for table, (key_columns, query) in ROLLUPS.items():
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"INSERT INTO {table} ({', '.join(key_columns)}, play_count) {query}")
+        logger.info(f"Rebuilt {table} with {cursor.rowcount} rows")
+    conn.commit()
+
+def check_rollups(conn):
+    """Verify the rollup tables against the playlists table.
+    
+    Returns:
+        A dict of rollup table -> number of rows that are missing, extra or have
+        a different play count. All values are 0 when the rollups are consistent.
+    """
+    cursor = conn.cursor()
+    mismatches = {}
+    for table, (key_columns, query) in ROLLUPS.items():
+        columns = f"{', '.join(key_columns)}, play_count"
+        cursor.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT * FROM ({query}) EXCEPT SELECT {columns} FROM {table}))
+                + (SELECT COUNT(*) FROM (SELECT {columns} FROM {table} EXCEPT SELECT * FROM ({query})))
+        """)
+        mismatches[table] = cursor.fetchone()[0]
+    return mismatches
+
+def get_ingest_ledger(conn):
+    """Get all ingest ledger entries keyed by file path."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT path, mtime_ns, size, content_hash, rows_ingested FROM ingest_ledger")
+    return {
+        row[0]: {
+            "mtime_ns": row[1],
+            "size": row[2],
+            "content_hash": row[3],
+            "rows_ingested": row[4]
+        }
+        for row in cursor.fetchall()
+    }
+
+def record_ingested_files(conn, entries):
+    """Record (or refresh) files in the ingest ledger.
+    
+    Args:
+        conn: Database connection
+        entries: Iterable of (path, mtime_ns, size, content_hash, rows_ingested) tuples
+    
+    The change is not committed here, so that the ledger can be written in the same
+    transaction as the plays loaded from these files.
+    """
+    conn.executemany(
+        """
+        INSERT INTO ingest_ledger (path, mtime_ns, size, content_hash, rows_ingested, ingested_at)
+        VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(path) DO UPDATE SET
+            mtime_ns = excluded.mtime_ns,
+            size = excluded.size,
+            content_hash = excluded.content_hash,
+            rows_ingested = excluded.rows_ingested,
+            ingested_at = excluded.ingested_at
+        """,
+        entries
+    )
+
+def touch_ingested_file(conn, path, mtime_ns, size):
+    """Update the stored mtime and size of a file whose content did not change.
+    
+    The change is not committed here; fresh checkouts touch every file, so the
+    caller commits once after the scan.
+    """
+    conn.execute(
+        "UPDATE ingest_ledger SET mtime_ns = ?, size = ? WHERE path = ?",
+        (mtime_ns, size, path)
+    )
+
 def get_or_create_song(conn, artist, title, original_id=None):
     """Get a song ID or create a new entry if it doesn't exist."""
     cursor = conn.cursor()
@@ -108,6 +655,61 @@ def add_song_play(conn, song_id, date_play, img=None):
     conn.commit()
     return cursor.lastrowid
 
+def load_song_ids(conn):
+    """Load a map of (artist, title) to song ID for all known songs."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT artist, title, id FROM songs")
+    return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+def add_playlist_batch(conn, plays, song_ids=None):
+    """Add a batch of song plays (e.g. a whole day or year) in a single transaction.
+    
+    Args:
+        conn: Database connection
+        plays: Iterable of (artist, title, original_id, date_play, img) tuples
+        song_ids: Map of (artist, title) to song ID, updated in place with newly
+                  created songs. Loaded from the database if not provided.
+    
+    Returns:
+        The number of plays inserted. Plays already in the database are skipped.
+    """
+    if song_ids is None:
+        song_ids = load_song_ids(conn)
+    
+    plays = list(plays)
+    
+    # Collect songs we haven't seen yet, keeping the first original ID
+    new_songs = {}
+    for artist, title, original_id, _, _ in plays:
+        key = (artist, title)
+        if key not in song_ids and key not in new_songs:
+            new_songs[key] = original_id
+    
+    with conn:
+        cursor = conn.cursor()
+        
+        if new_songs:
+            cursor.executemany(
+                """
+                INSERT INTO songs (artist, title, original_id) VALUES (?, ?, ?)
+                ON CONFLICT(artist, title) DO NOTHING
+                """,
+                [(artist, title, original_id) for (artist, title), original_id in new_songs.items()]
+            )
+            for key in new_songs:
+                cursor.execute("SELECT id FROM songs WHERE artist = ? AND title = ?", key)
+                song_ids[key] = cursor.fetchone()[0]
+        
+        cursor.executemany(
+            """
+            INSERT INTO playlists (song_id, date_play, img) VALUES (?, ?, ?)
+            ON CONFLICT(song_id, date_play) DO NOTHING
+            """,
+            [(song_ids[(artist, title)], date_play, img) for artist, title, _, date_play, img in plays]
+        )
+        # Unlike total_changes, rowcount leaves out the rows written by the rollup triggers
+        return cursor.rowcount
+
 def update_song_metadata(conn, song_id, language=None, genre=None, publish_date=None, source=None, raw_data=None):
     """Update or create metadata for a song."""
     cursor = conn.cursor()
@@ -161,16 +763,89 @@ def update_song_metadata(conn, song_id, language=None, genre=None, publish_date=
     
     conn.commit()
 
-def record_not_found_song(artist, title):
-    """Record songs that were not found in MusicBrainz to a text file."""
-    with open(NOT_FOUND_SONGS_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{artist} - {title}\n")
+def bulk_update_song_metadata(conn, rows):
+    """Update or create metadata for many songs in a single transaction.
+    
+    Args:
+        conn: Database connection
+        rows: Iterable of (song_id, language, genre, publish_date, source, raw_data)
+            tuples, with genre and raw_data already serialized to JSON
+    
+    Like update_song_metadata, existing values are kept for fields passed as None.
+    Earlier failed lookups of these songs are forgotten.
+    """
+    rows = list(rows)
+    with conn:
+        clear_lookup_failures(conn, [row[0] for row in rows])
+        conn.executemany(
+            """
+            INSERT INTO song_metadata (song_id, language, genre, publish_date, source, raw_data)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(song_id) DO UPDATE SET
+                language = COALESCE(excluded.language, language),
+                genre = COALESCE(excluded.genre, genre),
+                publish_date = COALESCE(excluded.publish_date, publish_date),
+                source = COALESCE(excluded.source, source),
+                raw_data = COALESCE(excluded.raw_data, raw_data)
+            """,
+            rows
+        )
+
+def store_detected_languages(conn, rows):
+    """Store languages detected from song titles in a single transaction.
+    
+    Args:
+        conn: Database connection
+        rows: Iterable of (song_id, language) tuples
+    
+    Songs without metadata get a row with source 'langdetect'. Songs that
+    already have metadata only get their language filled in if it is missing,
+    so a language found by MusicBrainz is never replaced.
+    """
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO song_metadata (song_id, language, source)
+            VALUES (?, ?, 'langdetect')
+            ON CONFLICT(song_id) DO UPDATE SET language = excluded.language
+            WHERE language IS NULL
+            """,
+            rows
+        )
+
+def record_lookup_failures(conn, song_ids):
+    """Record failed metadata lookups, pushing each song's next attempt back exponentially.
+    
+    The change is committed.
+    """
+    with conn:
+        conn.executemany(
+            f"""
+            INSERT INTO metadata_lookup_failures (song_id, attempts, last_attempt, next_attempt)
+            VALUES (?, 1, datetime('now'), datetime('now', '+{LOOKUP_RETRY_BASE} seconds'))
+            ON CONFLICT(song_id) DO UPDATE SET
+                attempts = attempts + 1,
+                last_attempt = excluded.last_attempt,
+                next_attempt = datetime('now', '+' || MIN({LOOKUP_RETRY_BASE} << attempts, {LOOKUP_RETRY_MAX}) || ' seconds')
+            """,
+            [(song_id,) for song_id in song_ids]
+        )
+
+def clear_lookup_failures(conn, song_ids):
+    """Forget earlier failed lookups of songs that now have metadata.
+    
+    The change is not committed here.
+    """
+    conn.executemany(
+        "DELETE FROM metadata_lookup_failures WHERE song_id = ?",
+        [(song_id,) for song_id in song_ids]
+    )
 
 def get_songs_by_criteria(language=None, artist_substring=None, title_substring=None, exact_artist=None, limit=100):
     """Get songs matching specific criteria for focused metadata processing."""
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection('read') as conn:
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         query_parts = ["SELECT s.id, s.artist, s.title FROM songs s"]
         where_clauses = []
@@ -211,15 +886,39 @@ def get_songs_by_criteria(language=None, artist_substring=None, title_substring=
 
 def get_songs_without_metadata(limit=None):
     """Get a list of songs that don't have metadata yet."""
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection('read') as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        
+        # Songs whose lookup failed recently are skipped until their next attempt,
+        # a language detected from the title doesn't count as metadata
+        query = """
+            SELECT s.id, s.artist, s.title 
+            FROM songs s
+            LEFT JOIN song_metadata sm ON s.id = sm.song_id
+            LEFT JOIN metadata_lookup_failures f ON s.id = f.song_id
+            WHERE (sm.song_id IS NULL OR sm.source = 'langdetect')
+              AND (f.song_id IS NULL OR f.next_attempt <= datetime('now'))
+        """
+        
+        if limit:
+            query += f" LIMIT {limit}"
+            
+        cursor.execute(query)
+        
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_songs_without_language(limit=None):
+    """Get a list of songs without a known language, with or without other metadata."""
+    with get_connection('read') as conn:
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         query = """
             SELECT s.id, s.artist, s.title 
             FROM songs s
             LEFT JOIN song_metadata sm ON s.id = sm.song_id
-            WHERE sm.song_id IS NULL
+            WHERE sm.language IS NULL
         """
         
         if limit:
@@ -229,17 +928,61 @@ def get_songs_without_metadata(limit=None):
         
         return [dict(row) for row in cursor.fetchall()]
 
+def get_metadata_coverage(conn, song_ids=()):
+    """Count songs with and without metadata.
+    
+    Songs whose only metadata is a detected language count as without, as in
+    get_songs_without_metadata.
+    
+    Returns:
+        A (total_songs, songs_with_metadata, missing_ids) tuple, where missing_ids
+        is the set of the given song IDs without metadata.
+    """
+    total_songs = conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+    with_metadata = {
+        row[0] for row in conn.execute("SELECT song_id FROM song_metadata WHERE source IS NOT 'langdetect'")
+    }
+    return total_songs, len(with_metadata), {song_id for song_id in song_ids if song_id not in with_metadata}
+
+def refresh_song_stats_snapshot():
+    """Compute get_song_stats and store the result in metadata_stats_snapshot.
+    
+    Returns:
+        The statistics.
+    """
+    stats = get_song_stats()
+    with get_connection() as conn:
+        ensure_stats_snapshot(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO metadata_stats_snapshot (id, computed_at, stats) VALUES (1, datetime('now'), ?)",
+            (json.dumps(stats),)
+        )
+    return stats
+
+def get_cached_song_stats():
+    """Get the statistics of get_song_stats from the snapshot table, refreshing it if outdated."""
+    with get_connection('read') as conn:
+        try:
+            row = conn.execute("SELECT stats FROM metadata_stats_snapshot").fetchone()
+        except sqlite3.OperationalError:
+            # No snapshot table yet
+            row = None
+    if row is not None:
+        return json.loads(row[0])
+    logger.info("Metadata statistics changed since the last snapshot, recomputing")
+    return refresh_song_stats_snapshot()
+
 def get_song_stats():
     """Get statistics about songs and metadata coverage."""
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection('read') as conn:
         cursor = conn.cursor()
         
         # Total songs
         cursor.execute("SELECT COUNT(*) FROM songs")
         total_songs = cursor.fetchone()[0]
         
-        # Songs with metadata
-        cursor.execute("SELECT COUNT(*) FROM song_metadata")
+        # Songs with metadata; a language detected from the title alone leaves a song pending
+        cursor.execute("SELECT COUNT(*) FROM song_metadata WHERE source IS NOT 'langdetect'")
         songs_with_metadata = cursor.fetchone()[0]
         
         # Songs by metadata source
@@ -1,34 +1,215 @@
 import sqlite3
+import gzip
+import hashlib
 import json
-import os
-from datetime import datetime
+import argparse
 from pathlib import Path
+from aggregation import PlayAggregates
+from analytics import RankMatrix
+from cache_store import CacheStore
+from database import connect, get_export_versions, get_month_checksums
 from logger_config import setup_logger
+from rolling import ROLLING_STATE, RollingCharts
+
+try:
+    import brotli
+except ImportError:  # Optional, only .gz siblings are written without it
+    brotli = None
 
 # Configure logging
 logger = setup_logger(__name__, 'export_stats.log')
 
-def export_data():
-    conn = sqlite3.connect('playlist.db')
+ARCHIVE_DIR = Path("archive")
+EXPORT_CACHE_DB = "export_cache.db"  # Per-year partials of the last export, see export_data
+EXPORT_DIR = Path("website/data")
+SEARCH_INDEX_MIN_PLAYS = 5  # Artists and songs played less often are left out of the search index
+MANIFEST_FILE = "manifest.json"  # The only export file whose name doesn't change
+HASH_LENGTH = 12  # Hex digits of the content hash in export file names
+COMPRESSED_SUFFIXES = (".gz", ".br")
+
+def write_if_changed(path, content):
+    """Write bytes to a file unless it already holds exactly them.
+    
+    Returns:
+        True if the file was written.
+    """
+    if path.exists() and path.read_bytes() == content:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return True
+
+def write_json(name, data, export_dir=EXPORT_DIR):
+    """Write minified JSON to a file named after its content hash, e.g. years/2024.<hash>.json.
+    
+    Along with it, pre-compressed .gz (and, if the brotli package is installed,
+    .br) siblings are written. Files that already exist are left untouched, so
+    unchanged content is never rewritten.
+    
+    Returns:
+        The path of the file relative to export_dir, for the manifest.
+    """
+    content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    relative_path = f"{name}.{digest}.json"
+    path = export_dir / relative_path
+    if write_if_changed(path, content):
+        logger.info(f"Wrote {relative_path} ({len(content)} bytes)")
+    # mtime=0 keeps the gzip output identical for identical content
+    write_if_changed(path.with_name(path.name + ".gz"), gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_if_changed(path.with_name(path.name + ".br"), brotli.compress(content))
+    return relative_path
+
+def remove_stale_files(export_dir, manifest):
+    """Delete the export files (and their compressed siblings) not listed in the manifest.
+    
+    Returns:
+        The number of deleted files.
+    """
+    referenced = {MANIFEST_FILE}
+    pending = [manifest]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            pending.extend(value.values())
+        else:
+            referenced.add(value)
+    
+    removed = 0
+    for path in sorted(export_dir.rglob("*")):
+        if not path.is_file():
+            continue
+        relative_path = path.relative_to(export_dir).as_posix()
+        if relative_path.endswith(COMPRESSED_SUFFIXES):
+            relative_path = relative_path.rsplit(".", 1)[0]
+        if relative_path not in referenced:
+            path.unlink()
+            removed += 1
+    return removed
+
+def year_versions(versions, checksums, year):
+    """Return the change versions the cached partial of a year depends on.
+    
+    Each month of the year is keyed by its version and its checksum (rows and
+    plays), along with the id of the database, so a rebuilt database whose
+    counters match the cached ones isn't taken for unchanged.
+    """
+    key = {
+        period: version for period, version in versions.items()
+        if period in ('songs', 'database')
+    }
+    for month, checksum in checksums.items():
+        if month.startswith(f"{year}-"):
+            key[month] = [versions.get(month, 0)] + checksum
+    return key
+
+def merged_spellings(aggregates, year):
+    """Return the artist spellings of a year counted under another spelling."""
+    canonical_artists = aggregates.canonical_artists()
+    return {
+        artist: canonical_artists[artist]
+        for artist, _ in aggregates.song_counts[year]
+        if canonical_artists[artist] != artist
+    }
+
+def load_song_languages(cursor):
+    """Return a (artist, title) -> language map of the songs with a known language."""
+    cursor.execute("""
+        SELECT s.artist, s.title, sm.language
+        FROM songs s
+        JOIN song_metadata sm ON s.id = sm.song_id
+        WHERE sm.language IS NOT NULL
+    """)
+    return {(row['artist'], row['title']): row['language'] for row in cursor.fetchall()}
+
+def load_rolling_charts(conn, last_play):
+    """Return the charts saved by the ingest, or build them if they don't end with the last play."""
+    rolling = RollingCharts.load(ROLLING_STATE)
+    if rolling is None or last_play is None or rolling.last_day != last_play[:10]:
+        logger.info(f"No rolling charts up to {last_play} in {ROLLING_STATE}, building them from the database")
+        rolling = RollingCharts.from_database(conn)
+    return rolling.charts
+
+def build_artist_rank_timeline(matrix):
+    """Build the rank timeline of the overall top artists and the top 10 of every year."""
+    # Track the overall top artists across all years
+    top_overall_artists = [row['artist'] for row in matrix.top_artists(40)]
+    
+    # Also track artists who have been in the top 10 in any year (ties share a rank)
+    top10_any_year_artists = matrix.top_ranked_artists(10)
+    
+    # Combine the lists to ensure we track both overall popular artists and those who were top 10 in any year;
+    # sorted, so that the export doesn't change between runs over the same data
+    artists_to_track = sorted(set(top_overall_artists + top10_any_year_artists))
+    return matrix.timeline(artists_to_track)
+
+def export_data(plays_source='db', full=False):
+    """Export statistics for the website as a set of JSON shards in EXPORT_DIR.
+    
+    The website loads the summary first and everything else on demand: the
+    shard of a year when the year filter changes, the rank timeline and the
+    search index when searching. song_metadata holds the metadata of every song
+    with a known language and rolling the charts of the last 7, 30 and 90 days;
+    neither is used by the website itself.
+    
+    Shards are named after a hash of their content and listed in
+    MANIFEST_FILE, so they can be cached forever; files of an unchanged export
+    aren't rewritten and shards no longer listed are deleted.
+    
+    All play sections are derived from PlayAggregates, which is built with a
+    single pass over the playlists table, or over the memory-mapped yearly
+    archives when plays_source='archive'.
+    
+    Exports from the database are incremental. The counters and sections of
+    every year are kept in EXPORT_CACHE_DB along with the export_changes
+    versions of its months; only the years whose versions moved on since are
+    read from the database again, the all-time sections are summed up from the
+    per-year counters. full=True ignores the cache.
+    """
+    # The export only reads, so it can run while the database is being updated
+    conn = connect('read')
     conn.row_factory = sqlite3.Row  # This enables column access by name
     cursor = conn.cursor()
 
-    # Create export directory if it doesn't exist
-    os.makedirs('website/data', exist_ok=True)
+    # Read the versions before the plays, so a change made during the export is picked up next time
+    versions = get_export_versions(conn) if plays_source == 'db' else None
+    checksums = get_month_checksums(conn) if versions is not None else None
+    cache = CacheStore(EXPORT_CACHE_DB, ttl=None, negative_ttl=None) if versions is not None else None
+    cached_years = {}
+    
+    if plays_source == 'archive':
+        aggregates = PlayAggregates.from_archives(ARCHIVE_DIR)
+    elif cache is None:
+        aggregates = PlayAggregates.from_database(conn)
+    else:
+        cursor.execute("SELECT substr(month, 1, 4) as year FROM monthly_song_plays GROUP BY year")
+        changed_years = []
+        for row in cursor.fetchall():
+            found, entry = cache.get('years', row['year']) if not full else (False, None)
+            if found and entry['versions'] == year_versions(versions, checksums, row['year']):
+                cached_years[row['year']] = entry
+            else:
+                changed_years.append(row['year'])
+        logger.info(f"Reading the plays of {len(changed_years)} changed years {changed_years}, "
+                    f"{len(cached_years)} years are unchanged since the last export")
+        aggregates = PlayAggregates.from_database(conn, years=changed_years)
+        for year, entry in cached_years.items():
+            aggregates.add_partial(year, entry['partial'])
 
     # Export metadata
-    cursor.execute("""
-        SELECT MIN(date_play) as min_date, MAX(date_play) as max_date, COUNT(*) as total_plays 
-        FROM playlists
-    """)
-    metadata = dict(cursor.fetchone())
+    metadata = {
+        'min_date': aggregates.min_date,
+        'max_date': aggregates.max_date,
+        'total_plays': aggregates.total_plays
+    }
     
     # Get total unique songs
     cursor.execute("SELECT COUNT(*) as total_songs FROM songs")
     metadata['total_songs'] = cursor.fetchone()['total_songs']
     
     # Get metadata coverage
-    cursor.execute("SELECT COUNT(*) as songs_with_metadata FROM song_metadata")
+    cursor.execute("SELECT COUNT(*) as songs_with_metadata FROM song_metadata WHERE source IS NOT 'langdetect'")
     metadata['songs_with_metadata'] = cursor.fetchone()['songs_with_metadata']
     metadata['metadata_coverage_percent'] = round(
         (metadata['songs_with_metadata'] / metadata['total_songs'] * 100) 
@@ -46,293 +227,132 @@ def export_data():
     """)
     metadata['languages'] = {row['language']: row['count'] for row in cursor.fetchall()}
     
-    # Export top artists overall
-    cursor.execute("""
-        SELECT s.artist, COUNT(*) as play_count 
-        FROM playlists p
-        JOIN songs s ON p.song_id = s.id
-        GROUP BY s.artist 
-        ORDER BY play_count DESC 
-        LIMIT 100
-    """)
-    top_artists = [dict(row) for row in cursor.fetchall()]
+    # Plays and ranks of every artist in every year, for the artist top lists and the timeline
+    matrix = RankMatrix.from_aggregates(aggregates)
     
-    # Export top songs overall
-    cursor.execute("""
-        SELECT s.artist, s.title, COUNT(*) as play_count 
-        FROM playlists p
-        JOIN songs s ON p.song_id = s.id
-        GROUP BY s.artist, s.title 
-        ORDER BY play_count DESC 
-        LIMIT 100
-    """)
-    top_songs = [dict(row) for row in cursor.fetchall()]
+    # Export top artists and songs overall
+    top_artists = matrix.top_artists(100)
+    top_songs = aggregates.top_songs(100)
     
     # Export data by year
-    cursor.execute("""
-        SELECT strftime('%Y', date_play) as year, COUNT(*) as song_count
-        FROM playlists
-        GROUP BY year
-        ORDER BY year
-    """)
-    years_data = []
-    for row in cursor.fetchall():
-        year_data = dict(row)
-        # Make sure year is included properly
-        years_data.append(year_data)
-    
-    # Export top artists by year starting from 2020
-    years = [row['year'] for row in years_data if row['year'] >= '2020']
-    top_artists_by_year = {}
-    
-    for year in years:
-        cursor.execute("""
-            SELECT s.artist, COUNT(*) as play_count 
-            FROM playlists p
-            JOIN songs s ON p.song_id = s.id
-            WHERE strftime('%Y', p.date_play) = ?
-            GROUP BY s.artist 
-            ORDER BY play_count DESC 
-            LIMIT 20
-        """, (year,))
-        top_artists_by_year[year] = [dict(row) for row in cursor.fetchall()]
-    
-    # Export top songs by year
-    top_songs_by_year = {}
-    
-    for year in years:
-        cursor.execute("""
-            SELECT s.artist, s.title, COUNT(*) as play_count 
-            FROM playlists p
-            JOIN songs s ON p.song_id = s.id
-            WHERE strftime('%Y', p.date_play) = ?
-            GROUP BY s.artist, s.title 
-            ORDER BY play_count DESC 
-            LIMIT 20
-        """, (year,))
-        top_songs_by_year[year] = [dict(row) for row in cursor.fetchall()]
+    years_data = aggregates.years_data()
+    all_years = aggregates.years
+    
+    # Sections of every year; a cached year keeps its sections unless the spellings
+    # its artists are merged into changed, and its languages unless the metadata did
+    # The database id is part of the version, the counter alone may repeat in a rebuilt database
+    metadata_version = [versions.get('database'), versions.get('song_metadata', 0)] if versions is not None else None
+    song_languages = None
+    year_entries = {}
+    changed_entries = []
+    for year in all_years:
+        spellings = merged_spellings(aggregates, year)
+        entry = cached_years.get(year)
+        if entry is None or entry['spellings'] != spellings:
+            entry = {
+                'versions': year_versions(versions, checksums, year) if versions is not None else None,
+                'partial': entry['partial'] if entry is not None else aggregates.year_partial(year),
+                'spellings': spellings,
+                'top_artists': matrix.top_artists(20, year=year),
+                'top_songs': aggregates.top_songs(20, year=year),
+                'monthly_data': aggregates.monthly_data(year),
+                'metadata_version': None,
+            }
+        if metadata_version is None or entry['metadata_version'] != metadata_version:
+            if song_languages is None:
+                song_languages = load_song_languages(cursor)
+            entry['language'] = aggregates.year_language_counts(year, song_languages)
+            entry['metadata_version'] = metadata_version
+            changed_entries.append((year, entry))
+        elif entry is not cached_years.get(year):
+            changed_entries.append((year, entry))
+        year_entries[year] = entry
+    
+    # Export top artists and songs by year starting from 2020
+    years = [year for year in all_years if year >= '2020']
+    top_artists_by_year = {year: year_entries[year]['top_artists'] for year in years}
+    top_songs_by_year = {year: year_entries[year]['top_songs'] for year in years}
     
     # Export monthly data for each year
-    cursor.execute("""
-        SELECT strftime('%Y', date_play) as year, 
-               strftime('%m', date_play) as month, 
-               COUNT(*) as song_count
-        FROM playlists
-        GROUP BY year, month
-        ORDER BY year, month
-    """)
-    monthly_data_rows = [dict(row) for row in cursor.fetchall()]
-    
-    # Reorganize monthly data by year
-    monthly_data_by_year = {}
-    for row in monthly_data_rows:
-        year = row['year']
-        if year not in monthly_data_by_year:
-            monthly_data_by_year[year] = []
-        monthly_data_by_year[year].append({
-            'month': row['month'],
-            'song_count': row['song_count']
-        })
-    
-    # Export top artists movement over years - focused on ranking changes
-    cursor.execute("""
-        SELECT DISTINCT strftime('%Y', date_play) as year
-        FROM playlists
-        ORDER BY year
-    """)
-    all_years = [row['year'] for row in cursor.fetchall()]
-    
-    # Track the overall top artists across all years
-    cursor.execute("""
-        SELECT s.artist, COUNT(*) as total_play_count 
-        FROM playlists p
-        JOIN songs s ON p.song_id = s.id
-        GROUP BY s.artist 
-        ORDER BY total_play_count DESC 
-        LIMIT 40
-    """)
-    top_overall_artists = [row['artist'] for row in cursor.fetchall()]
+    monthly_data_by_year = {year: year_entries[year]['monthly_data'] for year in all_years}
     
-    # Also track artists who have been in the top 10 in any year
-    cursor.execute("""
-        WITH yearly_top_artists AS (
-            SELECT 
-                strftime('%Y', p.date_play) as year, 
-                s.artist, 
-                COUNT(*) as play_count,
-                RANK() OVER (PARTITION BY strftime('%Y', p.date_play) ORDER BY COUNT(*) DESC) as yearly_rank
-            FROM playlists p
-            JOIN songs s ON p.song_id = s.id
-            GROUP BY year, s.artist
-        )
-        SELECT DISTINCT artist
-        FROM yearly_top_artists
-        WHERE yearly_rank <= 10
-        ORDER BY artist
-    """)
-    top10_any_year_artists = [row['artist'] for row in cursor.fetchall()]
+    # Get language statistics by year
+    language_by_year = {year: year_entries[year]['language'] for year in all_years}
     
-    # Combine the lists to ensure we track both overall popular artists and those who were top 10 in any year
-    artists_to_track = list(set(top_overall_artists + top10_any_year_artists))
+    # Export top artists movement over years - focused on ranking changes
+    artist_rank_timeline = build_artist_rank_timeline(matrix)
     
-    # Create a dictionary to track which years each artist appears in
-    artist_years = {artist: [] for artist in artists_to_track}
+    # Top artists and songs of the last 7, 30 and 90 days, kept up to date by the ingest
+    rolling_charts = load_rolling_charts(conn, aggregates.max_date)
     
-    # Get top 100 artists for each year
-    artist_rankings = {}
-    for year in all_years:
+    # The song metadata shard only changes with the metadata, reuse it while it does not
+    found, song_metadata_shard = cache.get('shards', 'song_metadata') if cache is not None else (False, None)
+    if (full or not found or song_metadata_shard['metadata_version'] != metadata_version
+            or not (EXPORT_DIR / song_metadata_shard['path']).exists()):
         cursor.execute("""
-            SELECT s.artist, COUNT(*) as play_count 
-            FROM playlists p
-            JOIN songs s ON p.song_id = s.id
-            WHERE strftime('%Y', p.date_play) = ?
-            GROUP BY s.artist 
-            ORDER BY play_count DESC 
-            LIMIT 100
-        """, (year,))
-        results = [dict(row) for row in cursor.fetchall()]
-        
-        # Add rank information
-        for i, artist_data in enumerate(results, 1):
-            artist_data['rank'] = i
-            # Record which years each tracked artist appears in
-            if artist_data['artist'] in artists_to_track:
-                artist_years[artist_data['artist']].append(year)
-        
-        artist_rankings[year] = results
-    
-    # Prepare a timeline dataset optimized for rank visualization
-    artist_rank_timeline = {}
-    
-    # First pass: add data for artists in their ranked years
-    for artist in artists_to_track:
-        artist_rank_timeline[artist] = []
-        
-        for year in all_years:
-            year_data = artist_rankings.get(year, [])
-            artist_data = next((data for data in year_data if data['artist'] == artist), None)
-            
-            if artist_data:
-                artist_rank_timeline[artist].append({
-                    'year': year,
-                    'rank': artist_data['rank'],
-                    'play_count': artist_data['play_count']
-                })
-    
-    # Second pass: fill in missing years for artists that appear in multiple years
-    for artist in artists_to_track:
-        # Only process artists that appear in at least 2 years
-        years_appeared = artist_years[artist]
-        if len(years_appeared) >= 2:
-            # Find years where the artist is missing but should be tracked
-            years_to_add = []
-            
-            for i in range(len(all_years) - 1):
-                current_year = all_years[i]
-                next_year = all_years[i+1]
-                
-                # If artist appears in current year but not in next year, add next year
-                if current_year in years_appeared and next_year not in years_appeared:
-                    years_to_add.append(next_year)
-                
-                # If artist appears in next year but not in current year (gap filling)
-                elif current_year not in years_appeared and next_year in years_appeared:
-                    # Check if there's a previous year they appeared in
-                    if i > 0 and all_years[i-1] in years_appeared:
-                        years_to_add.append(current_year)
-            
-            # Get exact rank and play count for missing years
-            for year in years_to_add:
-                # Skip if this year was already added in the first pass
-                if any(entry['year'] == year for entry in artist_rank_timeline[artist]):
-                    continue
-                    
-                cursor.execute("""
-                    WITH ranked_artists AS (
-                        SELECT 
-                            s.artist, 
-                            COUNT(*) as play_count,
-                            RANK() OVER (ORDER BY COUNT(*) DESC) as rank
-                        FROM playlists p
-                        JOIN songs s ON p.song_id = s.id
-                        WHERE strftime('%Y', p.date_play) = ?
-                        GROUP BY s.artist
-                    )
-                    SELECT artist, play_count, rank FROM ranked_artists
-                    WHERE artist = ?
-                """, (year, artist))
-                
-                extended_data = cursor.fetchone()
-                if extended_data:
-                    artist_rank_timeline[artist].append({
-                        'year': year,
-                        'rank': extended_data['rank'],
-                        'play_count': extended_data['play_count']
-                    })
-                else:
-                    # If artist has no plays in this year, add with rank 999 and play_count 0
-                    # This ensures the artist stays in the timeline but indicates absence
-                    artist_rank_timeline[artist].append({
-                        'year': year,
-                        'rank': 999,  # Special value to indicate absence
-                        'play_count': 0
-                    })
-    
-    # Sort each artist's timeline by year
-    for artist in artist_rank_timeline:
-        artist_rank_timeline[artist].sort(key=lambda x: x['year'])
-    
-    # Add language metadata
-    cursor.execute("""
-        SELECT s.artist, s.title, sm.language, json_extract(sm.genre, '$') as genres, sm.publish_date 
-        FROM songs s
-        JOIN song_metadata sm ON s.id = sm.song_id
-        WHERE sm.language IS NOT NULL
-    """)
-    song_metadata = {}
-    for row in cursor.fetchall():
-        key = f"{row['artist']} - {row['title']}"
-        song_metadata[key] = {
-            'language': row['language'],
-            'genres': json.loads(row['genres']) if row['genres'] else [],
-            'publish_date': row['publish_date']
+            SELECT s.artist, s.title, sm.language, json_extract(sm.genre, '$') as genres, sm.publish_date 
+            FROM songs s
+            JOIN song_metadata sm ON s.id = sm.song_id
+            WHERE sm.language IS NOT NULL
+        """)
+        song_metadata = {}
+        for row in cursor.fetchall():
+            key = f"{row['artist']} - {row['title']}"
+            song_metadata[key] = {
+                'language': row['language'],
+                'genres': json.loads(row['genres']) if row['genres'] else [],
+                'publish_date': row['publish_date']
+            }
+        song_metadata_shard = {
+            'metadata_version': metadata_version,
+            'path': write_json('song_metadata', song_metadata)
         }
+        if cache is not None:
+            cache.set('shards', 'song_metadata', song_metadata_shard)
     
-    # Get language statistics by year
-    language_by_year = {}
-    for year in all_years:
-        cursor.execute("""
-            SELECT sm.language, COUNT(*) as count
-            FROM playlists p
-            JOIN songs s ON p.song_id = s.id
-            JOIN song_metadata sm ON s.id = sm.song_id
-            WHERE strftime('%Y', p.date_play) = ? AND sm.language IS NOT NULL
-            GROUP BY sm.language
-            ORDER BY count DESC
-        """, (year,))
-        language_by_year[year] = {row['language']: row['count'] for row in cursor.fetchall()}
-    
-    # Combine all data
-    export_data = {
-        'metadata': metadata,
-        'top_artists': top_artists,
-        'top_songs': top_songs,
-        'years_data': years_data,
-        'top_artists_by_year': top_artists_by_year,
-        'top_songs_by_year': top_songs_by_year,
-        'monthly_data_by_year': monthly_data_by_year,
-        'artist_rank_timeline': artist_rank_timeline,
-        'years_timeline': all_years,
-        'song_metadata': song_metadata,
-        'language_by_year': language_by_year
+    conn.close()
+    
+    manifest = {
+        # Everything needed for the first render
+        'summary': write_json('summary', {
+            'metadata': metadata,
+            'top_artists': top_artists,
+            'top_songs': top_songs,
+            'years_data': years_data,
+            'monthly_data_by_year': monthly_data_by_year,
+            'language_by_year': language_by_year
+        }),
+        # Per-year shards, loaded when the year is selected
+        'years': {
+            year: write_json(f"years/{year}", {
+                'year': year,
+                'top_artists': top_artists_by_year[year],
+                'top_songs': top_songs_by_year[year]
+            })
+            for year in years
+        },
+        'timeline': write_json('timeline', {
+            'years_timeline': all_years,
+            'artist_rank_timeline': artist_rank_timeline
+        }),
+        'search_index': write_json('search-index', aggregates.search_index(SEARCH_INDEX_MIN_PLAYS)),
+        'rolling': write_json('rolling', rolling_charts),
+        'song_metadata': song_metadata_shard['path']
     }
+    manifest_content = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    if write_if_changed(EXPORT_DIR / MANIFEST_FILE, manifest_content):
+        logger.info(f"Data exported to {EXPORT_DIR}")
+    else:
+        logger.info(f"Export in {EXPORT_DIR} is unchanged")
     
-    # Write to JSON file
-    with open('website/data/statistics.json', 'w', encoding='utf-8') as f:
-        json.dump(export_data, f, ensure_ascii=False, indent=2)
+    removed = remove_stale_files(EXPORT_DIR, manifest)
+    if removed:
+        logger.info(f"Removed {removed} outdated files from {EXPORT_DIR}")
     
-    logger.info(f"Data exported to website/data/statistics.json")
-    conn.close()
+    # Remember the years for the next export, once the files built from them are written
+    if cache is not None and changed_entries:
+        cache.set_many('years', changed_entries)
+        logger.info(f"Cached the sections of {len(changed_entries)} years in {EXPORT_CACHE_DB}")
     
     # Update README with top artists and songs
     update_readme_with_stats(top_artists[:100], top_songs[:100], metadata)
@@ -348,8 +368,9 @@ def update_readme_with_stats(top_artists, top_songs, metadata):
         with open(readme_path, "r", encoding="utf-8") as f:
             readme_content = f.read()
     
-    # Create tables for top artists and songs
-    current_date = datetime.now().strftime("%Y-%m-%d")
+    # Create tables for top artists and songs, dated by the latest play so that
+    # the README only changes when the data does
+    current_date = metadata['max_date'][:10]
     
     # Create metadata section
     metadata_section = f"\n## Statistics (as of {current_date})\n\n"
@@ -405,17 +426,24 @@ def update_readme_with_stats(top_artists, top_songs, metadata):
             if next_section == float('inf'):
                 next_section = len(readme_content)
                 
-            # Replace content
-            readme_content = readme_content[:start] + content + readme_content[next_section:]
+            # Replace content; sections start with a newline of their own, so
+            # drop the ones before the marker instead of adding one every run
+            readme_content = readme_content[:start].rstrip("\n") + "\n" + content + readme_content[next_section:]
         else:
             # Append content
             readme_content += content
     
     # Write updated content back to README
-    with open(readme_path, "w", encoding="utf-8") as f:
-        f.write(readme_content)
-    
-    logger.info(f"README.md updated with statistics and top 100 artists and songs tables.")
+    if write_if_changed(readme_path, readme_content.encode("utf-8")):
+        logger.info("README.md updated with statistics and top 100 artists and songs tables.")
+    else:
+        logger.info("README.md statistics are unchanged.")
 
 if __name__ == "__main__":
-    export_data()
+    parser = argparse.ArgumentParser(description="Export Radio Nowy Świat statistics for the website")
+    parser.add_argument("--plays-source", choices=["db", "archive"], default="db",
+                        help="Read per-year play counts from the database or the yearly archives")
+    parser.add_argument("--full", action="store_true",
+                        help=f"Recompute every year instead of reusing the unchanged ones from {EXPORT_CACHE_DB}")
+    args = parser.parse_args()
+    export_data(plays_source=args.plays_source, full=args.full)
@@ -0,0 +1,195 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger_config import setup_logger
+from ratelimit import RateLimiter
+
+# Configure logging
+logger = setup_logger(__name__, 'fetch_data.log')
+
+PER_PAGE = 300  # Requested page size; the API may use a smaller one (it reports it as perpage)
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE_LIMIT = 5.0  # Requests per second
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # Seconds before the first retry, doubled for each next one
+REQUEST_TIMEOUT = 30
+
+# Responses worth retrying: rate limiting and server errors; other errors (e.g. 404) won't go away
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def create_session(api_key, pool_size=DEFAULT_CONCURRENCY):
+    """Create an HTTP session with a connection pool large enough for all workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["x-rns-api-key"] = api_key
+    return session
+
+
+def fetch_page(session, api_url, day, page, limiter, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Fetch a single playlist page of a day, retrying with exponential backoff.
+
+    Connection errors and RETRY_STATUS_CODES responses are retried, other error
+    responses fail right away. Every attempt waits for the rate limiter, so
+    retries count against the limit too.
+
+    Raises:
+        requests.exceptions.RequestException: If the last attempt failed.
+    """
+    params = {"date": day.isoformat(), "page": page, "perpage": PER_PAGE}
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(api_url, params=params, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            status_code = getattr(e.response, "status_code", None)
+            retryable = status_code is None or status_code in RETRY_STATUS_CODES
+            if attempt == retries or not retryable:
+                raise
+            delay = backoff * 2 ** attempt
+            logger.warning(f"Error fetching {day.isoformat()} page {page} (attempt {attempt + 1}/{retries + 1}): {e}, retrying in {delay}s")
+            time.sleep(delay)
+
+
+def merge_pages(pages):
+    """Merge playlist pages of one day into a single document shaped like page 1.
+
+    Plays that shifted between pages while they were fetched are only kept once.
+    """
+    merged = dict(pages[0])
+    playlist = []
+    seen = set()
+    for page in pages:
+        for song in page.get("playlist") or []:
+            key = (song.get("id"), song.get("date_play"))
+            if key not in seen:
+                seen.add(key)
+                playlist.append(song)
+    merged["playlist"] = playlist
+    return merged
+
+
+def fetch_day(session, api_url, day, limiter, page_executor):
+    """Fetch all playlist pages of a day and merge them.
+
+    The API may ignore the requested page size, so the number of pages is taken
+    from the response: if it reports last_page, the remaining pages are fetched
+    concurrently on page_executor; otherwise pages are fetched one by one until
+    a page is shorter than the reported perpage or total_elements plays were
+    collected.
+
+    Raises:
+        requests.exceptions.RequestException: If any page could not be fetched.
+    """
+    first_page = fetch_page(session, api_url, day, 1, limiter)
+    last_page = first_page.get("last_page")
+    if last_page is not None:
+        if last_page <= 1:
+            return first_page
+        futures = [
+            page_executor.submit(fetch_page, session, api_url, day, page, limiter)
+            for page in range(2, last_page + 1)
+        ]
+        return merge_pages([first_page] + [future.result() for future in futures])
+
+    # The page count is unknown, keep going until a page is not full
+    per_page = first_page.get("perpage") or PER_PAGE
+    total_elements = first_page.get("total_elements")
+    pages = [first_page]
+    collected = len(first_page.get("playlist") or [])
+    while len(pages[-1].get("playlist") or []) >= per_page and (total_elements is None or collected < total_elements):
+        pages.append(fetch_page(session, api_url, day, len(pages) + 1, limiter))
+        collected += len(pages[-1].get("playlist") or [])
+    return merge_pages(pages)
+
+
+def save_day_file(data_dir, day, data):
+    """Save a day's playlist as data/YYYY/YYYY-MM-DD.json."""
+    year_dir = Path(data_dir) / str(day.year)
+    year_dir.mkdir(parents=True, exist_ok=True)
+    json_path = year_dir / f"{day.isoformat()}.json"
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    return json_path
+
+
+def load_failed_days(queue_file):
+    """Load the days that failed in previous runs."""
+    queue_file = Path(queue_file)
+    if not queue_file.exists():
+        return set()
+    with open(queue_file, "r", encoding="utf-8") as f:
+        return {date.fromisoformat(line.strip()) for line in f if line.strip()}
+
+
+def save_failed_days(queue_file, failed_days):
+    """Persist the days that still need to be fetched, removing the file when empty."""
+    queue_file = Path(queue_file)
+    if not failed_days:
+        queue_file.unlink(missing_ok=True)
+        return
+    with open(queue_file, "w", encoding="utf-8") as f:
+        for day in sorted(failed_days):
+            f.write(f"{day.isoformat()}\n")
+
+
+def fetch_days(days, api_key, api_url, data_dir, queue_file,
+               concurrency=DEFAULT_CONCURRENCY, rate_limit=DEFAULT_RATE_LIMIT):
+    """Fetch several days concurrently and save each one as soon as it arrives.
+
+    Days that still fail after all retries are added to the persistent failed-days
+    queue, and days fetched successfully are removed from it.
+
+    Returns:
+        A (fetched, failed) tuple with the number of days in each group.
+    """
+    failed_days = load_failed_days(queue_file)
+    limiter = RateLimiter(rate_limit)
+    fetched = 0
+
+    try:
+        # Extra pages use their own pool, so day workers never wait on each other
+        with create_session(api_key, pool_size=2 * concurrency) as session, \
+                ThreadPoolExecutor(max_workers=concurrency) as executor, \
+                ThreadPoolExecutor(max_workers=concurrency) as page_executor:
+            futures = {
+                executor.submit(fetch_day, session, api_url, day, limiter, page_executor): day
+                for day in days
+            }
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    data = future.result()
+                except requests.exceptions.RequestException as e:
+                    logger.error(f"Giving up on {day.isoformat()}: {e}")
+                    failed_days.add(day)
+                    continue
+
+                # Saved even when incomplete, the plays it has are kept and the day is fetched again
+                save_day_file(data_dir, day, data)
+                play_count = len(data.get("playlist") or [])
+                total_elements = data.get("total_elements")
+                if total_elements is not None and play_count < total_elements:
+                    logger.error(f"{day.isoformat()} is incomplete: got {play_count} of {total_elements} plays, "
+                                 f"it will be fetched again")
+                    failed_days.add(day)
+                    continue
+
+                failed_days.discard(day)
+                fetched += 1
+                logger.info(f"Fetched {day.isoformat()}: {play_count} plays ({fetched}/{len(futures)})")
+    finally:
+        # Keep the queue up to date even if the run is interrupted
+        save_failed_days(queue_file, failed_days)
+
+    return fetched, len(failed_days)
@@ -0,0 +1,94 @@
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Files handed to each worker process at a time
+PARSE_CHUNK_SIZE = 16
+
+
+def file_fingerprint(json_path):
+    """Return the (mtime_ns, size) pair used to detect changed files cheaply."""
+    stat = Path(json_path).stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def hash_content(raw):
+    """Return the SHA-256 hex digest of raw file content."""
+    return hashlib.sha256(raw).hexdigest()
+
+
+def ledger_key(json_path, data_dir):
+    """Return the path under which a file is recorded in the ingest ledger."""
+    return Path(json_path).relative_to(data_dir).as_posix()
+
+
+def is_unchanged(entry, mtime_ns, size):
+    """Check whether a ledger entry still matches the file on disk by mtime and size."""
+    return entry is not None and entry['mtime_ns'] == mtime_ns and entry['size'] == size
+
+
+def read_playlist_file(json_path):
+    """Read a daily playlist file.
+
+    Returns:
+        A tuple of (content_hash, data) where data is the decoded JSON document.
+
+    Raises:
+        json.JSONDecodeError: If the file does not contain valid JSON.
+    """
+    raw = Path(json_path).read_bytes()
+    return hash_content(raw), json.loads(raw)
+
+
+def playlist_rows(data):
+    """Extract (artist, title, original_id, date_play, img) tuples from a playlist document.
+
+    Rows without an artist or title are skipped.
+    """
+    rows = []
+    for song in data.get("playlist") or []:
+        if not song.get("artist") or not song.get("title"):
+            continue
+        rows.append((song["artist"], song["title"], song.get("id"), song["date_play"], song.get("img")))
+    return rows
+
+
+def parse_day_file(json_path, known_hash=None):
+    """Read, hash and parse a daily playlist file into compact row tuples.
+
+    This runs in worker processes, so it only returns picklable values and
+    reports decoding errors instead of raising them.
+
+    Args:
+        json_path: Path to the daily JSON file
+        known_hash: Content hash recorded in the ingest ledger, if any
+
+    Returns:
+        A (content_hash, rows, error) tuple. rows is None when the content hash
+        equals known_hash (the file is not decoded) or when decoding failed, in
+        which case error holds the error message.
+    """
+    raw = Path(json_path).read_bytes()
+    content_hash = hash_content(raw)
+    if content_hash == known_hash:
+        return content_hash, None, None
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        return content_hash, None, str(e)
+    return content_hash, playlist_rows(data), None
+
+
+def iter_parsed_files(paths, known_hashes, workers=1, parse=parse_day_file):
+    """Parse files with parse (parse_day_file by default), yielding results in input order.
+
+    With more than one worker the files are decoded by a process pool while the
+    caller consumes (and writes) the results in the main process.
+    """
+    if workers <= 1:
+        yield from map(parse, paths, known_hashes)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(parse, paths, known_hashes, chunksize=PARSE_CHUNK_SIZE)
@@ -2,9 +2,7 @@ import logging
 import os
 from pathlib import Path
 
-# Create logs directory if it doesn't exist
 logs_dir = Path("logs")
-logs_dir.mkdir(exist_ok=True)
 
 def setup_logger(name, log_file):
     """
@@ -29,8 +27,10 @@ def setup_logger(name, log_file):
         
     logger.setLevel(logging.INFO)
     
-    # Create handlers
-    file_handler = logging.FileHandler(log_path)
+    # Create handlers; the log file is only opened when the first record is written,
+    # so importing a module doesn't open a file for every logger
+    logs_dir.mkdir(exist_ok=True)
+    file_handler = logging.FileHandler(log_path, delay=True)
     console_handler = logging.StreamHandler()
     
     # Create formatter and add it to the handlers
@@ -1,17 +1,21 @@
-from datetime import datetime, date, timedelta
-import json
-import sqlite3
+from datetime import date, timedelta
 from pathlib import Path
-import requests
 import argparse
 import os
+import sys
 from dotenv import load_dotenv
 from database import (
-    setup_database, get_or_create_song, add_song_play, 
-    get_songs_without_metadata, get_song_stats
+    setup_database, load_song_ids, add_playlist_batch,
+    get_songs_without_language,
+    get_cached_song_stats, refresh_song_stats_snapshot,
+    migrate_database, get_ingest_ledger,
+    record_ingested_files, touch_ingested_file,
+    ensure_rollups, drop_rollup_triggers, rebuild_rollups, check_rollups,
+    get_connection
 )
-from metadata import process_song_without_metadata
 from logger_config import setup_logger
+# fetcher, ingest, archive and metadata pull in requests, musicbrainzngs and langdetect,
+# they are imported by the commands that use them to keep the CLI quick to start
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,12 +23,14 @@ load_dotenv()
 # Configure logging
 logger = setup_logger(__name__, 'rns_main.log')
 
-DB_NAME = "playlist.db"
 DATA_DIR = Path("data")
+FAILED_DAYS_FILE = DATA_DIR / "failed_days.txt"  # Days to retry on the next fetch
 API_URL = "https://nowyswiat.online/api/Mobile/get_playlist_from_date"
 DEFAULT_API_KEY = os.environ.get("RNS_API_KEY", "")
 START_DATE = date(2020, 7, 10)  # Fixed: using date directly instead of datetime.date
 DOCS_DIR = Path("docs")
+ARCHIVE_DIR = Path("archive")
+INGEST_BATCH_SIZE = 50000  # Plays written per transaction
 
 
 def setup_database():
@@ -33,8 +39,18 @@ def setup_database():
     db_setup()
 
 
-def fetch_data(api_key):
-    """Fetch and process playlist data from the latest processed date (or START_DATE) to today."""
+def fetch_data(api_key, api_url=API_URL, concurrency=None, rate_limit=None):
+    """Fetch and process playlist data from the latest processed date (or START_DATE) to today.
+    
+    Days that failed in previous runs (see FAILED_DAYS_FILE) are retried as well.
+    concurrency and rate_limit default to those of fetcher.
+    """
+    from fetcher import fetch_days, load_failed_days, DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT
+    if concurrency is None:
+        concurrency = DEFAULT_CONCURRENCY
+    if rate_limit is None:
+        rate_limit = DEFAULT_RATE_LIMIT
+    
     DOCS_DIR.mkdir(exist_ok=True)
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -50,37 +66,28 @@ def fetch_data(api_key):
         print(f"Starting from the beginning: {START_DATE.isoformat()}")
     
     end_date = date.today()
-    api_headers = {"x-rns-api-key": api_key}
+
+    days = set(load_failed_days(FAILED_DAYS_FILE))
+    if days:
+        print(f"Retrying {len(days)} previously failed days")
+    while current_date <= end_date:
+        days.add(current_date)
+        current_date += timedelta(days=1)
 
     # If we're already up to date
-    if current_date > end_date:
+    if not days:
         print("Already up to date! No new data to fetch.")
         return
 
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        print(f"Fetching data for {date_str}...")
-
-        params = {"date": date_str, "page": 1, "perpage": 300}
-        try:
-            response = requests.get(API_URL, headers=api_headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data for {date_str}: {e}")
-            current_date += timedelta(days=1)  # Fixed: using timedelta directly
-            continue
-
-        # Save JSON to file
-        year_dir = DATA_DIR / str(current_date.year)
-        year_dir.mkdir(parents=True, exist_ok=True)
-        json_path = year_dir / f"{date_str}.json"
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+    print(f"Fetching {len(days)} days with {concurrency} concurrent requests...")
+    fetched, failed = fetch_days(
+        sorted(days), api_key, api_url, DATA_DIR, FAILED_DAYS_FILE,
+        concurrency=concurrency, rate_limit=rate_limit
+    )
+    if failed:
+        print(f"{failed} days failed and will be retried on the next run (see {FAILED_DAYS_FILE})")
 
-        current_date += timedelta(days=1)  # Fixed: using timedelta directly
-
-    print("Data fetching completed!")
+    print(f"Data fetching completed! Fetched {fetched} days.")
 
 
 def get_latest_processed_date():
@@ -107,49 +114,188 @@ def get_latest_processed_date():
     return latest_date
 
 
-def save_to_database():
-    """Process JSON files and save data to the database."""
-    with sqlite3.connect(DB_NAME) as conn:
-        json_files = sorted(DATA_DIR.rglob("*.json"))
-        total_files = len(json_files)
+def save_to_database(full_rebuild=False, workers=1, from_archive=False, rolling_sketch=None):
+    """Process JSON files (or yearly archives) and save data to the database.
+    
+    With from_archive, the packed yearly archives in ARCHIVE_DIR are loaded
+    instead of the daily JSON files. Files already recorded in the ingest
+    ledger with the same mtime and size (or, failing that, the same content
+    hash) are skipped unless full_rebuild is set.
+    With workers > 1, files are decoded by a process pool while this process
+    remains the only database writer. Plays are written in batches of up to
+    INGEST_BATCH_SIZE rows, each batch in a single transaction together with the
+    ledger entries of its files.
+    
+    When the playlists table is empty, the rollup triggers are dropped for the
+    load and the rollup tables are rebuilt in one pass at the end instead.
+    
+    Afterwards, the rolling charts are updated with the days of the loaded
+    plays; rolling_sketch keeps them in Space-Saving sketches of that many
+    songs and artists instead of exact counts.
+    """
+    from ingest import file_fingerprint, is_unchanged, ledger_key, iter_parsed_files, parse_day_file
+    from archive import ARCHIVE_SUFFIX, parse_archive_file
+    from rolling import update_rolling_charts
+    
+    with get_connection('bulk') as conn:
+        migrate_database(conn)
+        initial_load = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM playlists)").fetchone()[0]
+        if initial_load:
+            logger.info("Empty playlists table, rollups will be rebuilt after the load")
+            drop_rollup_triggers(conn)
+        try:
+            ledger = {} if full_rebuild else get_ingest_ledger(conn)
+            song_ids = load_song_ids(conn)
+        
+            if from_archive:
+                source_dir = ARCHIVE_DIR
+                source_files = sorted(ARCHIVE_DIR.glob(f"*{ARCHIVE_SUFFIX}"))
+                parse = parse_archive_file
+                file_kind = "archive"
+            else:
+                source_dir = DATA_DIR
+                source_files = sorted(DATA_DIR.rglob("*.json"))
+                parse = parse_day_file
+                file_kind = "JSON"
+            total_files = len(source_files)
+            skipped_files = 0
+            inserted_plays = 0
+            loaded_days = set()
+            pending_rows = []
+            pending_files = []
+        
+            def flush():
+                nonlocal inserted_plays
+                # The ledger entries are committed by the batch transaction below
+                record_ingested_files(conn, pending_files)
+                inserted_plays += add_playlist_batch(conn, pending_rows, song_ids)
+                pending_rows.clear()
+                pending_files.clear()
+        
+            if full_rebuild:
+                logger.info(f"Full rebuild requested, processing all {total_files} {file_kind} files...")
+            else:
+                logger.info(f"Checking {total_files} {file_kind} files against the ingest ledger...")
+        
+            # Only files whose mtime or size changed need to be read
+            candidates = []
+            for source_path in source_files:
+                path_key = ledger_key(source_path, source_dir)
+                entry = ledger.get(path_key)
+                mtime_ns, size = file_fingerprint(source_path)
+                if is_unchanged(entry, mtime_ns, size):
+                    skipped_files += 1
+                    continue
+                candidates.append((source_path, path_key, entry, mtime_ns, size))
+        
+            if workers > 1 and candidates:
+                logger.info(f"Parsing {len(candidates)} files with {workers} worker processes...")
         
-        logger.info(f"Processing {total_files} JSON files...")
-        for i, json_path in enumerate(json_files, 1):
-            logger.info(f"Processing file {i}/{total_files}: {json_path}")
+            parsed_files = iter_parsed_files(
+                [source_path for source_path, _, _, _, _ in candidates],
+                [entry['content_hash'] if entry else None for _, _, entry, _, _ in candidates],
+                workers=workers,
+                parse=parse
+            )
+            for i, ((source_path, path_key, entry, mtime_ns, size), (content_hash, rows, error)) in enumerate(
+                zip(candidates, parsed_files), 1
+            ):
+                if error:
+                    logger.error(f"Error decoding {source_path}: {error}")
+                    continue
             
-            with open(json_path, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from {json_path}")
+                # Same content with a new mtime (e.g. after a fresh checkout)
+                if rows is None:
+                    touch_ingested_file(conn, path_key, mtime_ns, size)
+                    skipped_files += 1
                     continue
+            
+                logger.info(f"Processing file {i}/{len(candidates)}: {source_path}")
+            
+                pending_rows.extend(rows)
+                loaded_days.update(row[3][:10] for row in rows)
+                pending_files.append((path_key, mtime_ns, size, content_hash, len(rows)))
+            
+                if len(pending_rows) >= INGEST_BATCH_SIZE:
+                    flush()
+        
+            if pending_files:
+                flush()
+            conn.commit()
+            logger.info(f"Processed {total_files - skipped_files} files, skipped {skipped_files} unchanged files")
+            logger.info(f"Inserted {inserted_plays} new plays")
+        finally:
+            if initial_load:
+                # Recreates the triggers; also runs if the load was interrupted
+                ensure_rollups(conn)
+                rebuild_rollups(conn)
+        
+        # Migrations waiting for songs (the not_found_songs.txt import) can run now
+        migrate_database(conn)
 
-            if "playlist" in data and data["playlist"]:
-                for song in data["playlist"]:
-                    if not song.get("artist") or not song.get("title"):
-                        continue
-                    
-                    # Get or create song
-                    song_id = get_or_create_song(
-                        conn, 
-                        song["artist"], 
-                        song["title"], 
-                        song.get("id")
-                    )
-                    
-                    # Add to playlist
-                    add_song_play(
-                        conn,
-                        song_id,
-                        song["date_play"],
-                        song.get("img")
-                    )
-
+    # Reads the daily rollup, so only once it is up to date
+    update_rolling_charts(get_connection(), loaded_days, sketch_capacity=rolling_sketch)
     logger.info("Database update completed!")
 
 
-def process_metadata(limit=None, artist_substring=None, title_substring=None, exact_artist=None):
-    """Process metadata for songs that don't have it yet."""
+def migrate_db():
+    """Upgrade the database schema in place."""
+    with get_connection() as conn:
+        applied = migrate_database(conn)
+    logger.info(f"Applied {applied} migrations")
+
+
+def rebuild_rollup_tables():
+    """Recompute the rollup tables from the playlists table."""
+    with get_connection('bulk') as conn:
+        migrate_database(conn)
+        rebuild_rollups(conn)
+
+
+def check_rollup_tables():
+    """Verify the rollup tables against the playlists table.
+    
+    Returns:
+        True if all rollups are consistent.
+    """
+    with get_connection() as conn:
+        migrate_database(conn)
+        mismatches = check_rollups(conn)
+    
+    for table, mismatch_count in mismatches.items():
+        if mismatch_count:
+            logger.error(f"{table}: {mismatch_count} rows differ from the playlists table")
+        else:
+            logger.info(f"{table}: consistent")
+    return not any(mismatches.values())
+
+
+def pack_archive():
+    """Pack the daily JSON files into one compact archive per year."""
+    from archive import pack_data_dir
+    for archive_path, day_count in pack_data_dir(DATA_DIR, ARCHIVE_DIR):
+        logger.info(f"Packed {day_count} days into {archive_path} ({archive_path.stat().st_size} bytes)")
+
+
+def unpack_archives():
+    """Regenerate the daily JSON files from the yearly archives."""
+    from archive import ARCHIVE_SUFFIX, unpack_archive
+    for archive_path in sorted(ARCHIVE_DIR.glob(f"*{ARCHIVE_SUFFIX}")):
+        written = unpack_archive(archive_path, DATA_DIR)
+        logger.info(f"Unpacked {written} days from {archive_path}")
+
+
+def process_metadata(limit=None, artist_substring=None, title_substring=None, exact_artist=None,
+                     workers=None, by_artist=True, offline=False):
+    """Process metadata for songs that don't have it yet, resolving them with a pool of workers."""
+    from metadata import enrich_songs, purge_expired_cache, MetadataProgress, DEFAULT_METADATA_WORKERS
+    if workers is None:
+        workers = DEFAULT_METADATA_WORKERS
+    
+    # The pending-songs query needs the metadata_lookup_failures table
+    with get_connection() as conn:
+        migrate_database(conn)
+    
     if artist_substring or title_substring or exact_artist:
         from database import get_songs_by_criteria
         songs_without_metadata = get_songs_by_criteria(
@@ -165,7 +311,7 @@ def process_metadata(limit=None, artist_substring=None, title_substring=None, ex
     else:
         from database import get_songs_without_metadata
         songs_without_metadata = get_songs_without_metadata(limit)
-        logger.info(f"Processing metadata for songs without existing metadata")
+        logger.info("Processing metadata for songs without existing metadata")
     
     total_songs = len(songs_without_metadata)
     
@@ -175,19 +321,18 @@ def process_metadata(limit=None, artist_substring=None, title_substring=None, ex
     
     logger.info(f"Processing metadata for {total_songs} songs...")
     
-    with sqlite3.connect(DB_NAME) as conn:
-        for i, song in enumerate(songs_without_metadata, 1):
-            logger.info(f"Processing metadata ({i}/{total_songs}): {song['artist']} - {song['title']}")
-            process_song_without_metadata(conn, song['id'], song['artist'], song['title'])
-            
-            # Print progress every 10 songs
-            if i % 10 == 0 or i == total_songs:
-                stats = get_song_stats()
-                logger.info(f"Progress: {i}/{total_songs} songs processed")
-                logger.info(f"Metadata coverage: {stats['metadata_coverage_percent']}%")
+    with get_connection() as conn:
+        # Coverage is tracked in memory, the full statistics are computed once at the end
+        progress = MetadataProgress.start(conn, songs_without_metadata)
+        found, not_found = enrich_songs(
+            conn, songs_without_metadata, workers=workers, on_progress=progress, by_artist=by_artist,
+            offline=offline
+        )
+    logger.info(f"Found metadata for {found} songs, {not_found} not found")
+    purge_expired_cache()
     
     # Print final statistics
-    stats = get_song_stats()
+    stats = refresh_song_stats_snapshot()
     logger.info("Metadata processing completed!")
     logger.info(f"Total songs: {stats['total_songs']}")
     logger.info(f"Songs with metadata: {stats['songs_with_metadata']}")
@@ -196,9 +341,27 @@ def process_metadata(limit=None, artist_substring=None, title_substring=None, ex
     if 'languages' in stats:
         logger.info(f"Languages: {stats['languages']}")
 
+def detect_languages(limit=None, workers=None):
+    """Detect the language of songs still without one from their artist and title."""
+    from metadata import detect_song_languages
+    
+    songs = get_songs_without_language(limit)
+    if not songs:
+        logger.info("No songs without language found.")
+        return
+    
+    logger.info(f"Detecting languages for {len(songs)} songs...")
+    with get_connection() as conn:
+        detected = detect_song_languages(conn, songs, workers=workers)
+    logger.info(f"Detected languages of {detected} songs, {len(songs) - detected} undetermined")
+    
+    stats = refresh_song_stats_snapshot()
+    if 'languages' in stats:
+        logger.info(f"Languages: {stats['languages']}")
+
 def show_metadata_stats():
-    """Display detailed statistics about metadata."""
-    stats = get_song_stats()
+    """Display detailed statistics about metadata, from the snapshot if it is up to date."""
+    stats = get_cached_song_stats()
     logger.info("Metadata Statistics:")
     logger.info("=" * 40)
     logger.info(f"Total songs: {stats['total_songs']}")
@@ -236,19 +399,42 @@ def parse_arguments():
 
     parser.add_argument("--fetch", action="store_true", help="Fetch data from API and save as JSON files")
     parser.add_argument("--create-db", action="store_true", help="Create or recreate the database")
+    parser.add_argument("--migrate-db", action="store_true", help="Upgrade the database schema in place")
     parser.add_argument("--save-to-db", action="store_true", help="Process JSON files and save to database")
+    parser.add_argument("--full-rebuild", action="store_true", help="Process all JSON files, ignoring the ingest ledger")
+    parser.add_argument("--workers", type=int, help="Number of processes used to parse JSON files (default 1)", default=None)
+    parser.add_argument("--from-archive", action="store_true", help="Load plays from the yearly archives instead of JSON files (implies --save-to-db)")
+    parser.add_argument("--rolling-sketch", type=int, metavar="CAPACITY", default=None,
+                        help="Keep the rolling charts in Space-Saving sketches of CAPACITY songs and artists per day instead of exact counts")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="Recompute the rollup tables from the playlists table")
+    parser.add_argument("--check-rollups", action="store_true", help="Verify the rollup tables against the playlists table")
+    parser.add_argument("--pack-archive", action="store_true", help="Pack JSON files into compact yearly archives")
+    parser.add_argument("--unpack-archive", action="store_true", help="Regenerate JSON files from the yearly archives")
     parser.add_argument("--process-metadata", action="store_true", help="Process metadata for songs")
+    parser.add_argument("--metadata-workers", type=int, help="Number of threads resolving song metadata (default 4)", default=None)
+    parser.add_argument("--metadata-per-song", action="store_true", help="Resolve metadata song by song instead of once per artist")
+    parser.add_argument("--metadata-offline", action="store_true", help="Only resolve metadata from the local MusicBrainz dump")
+    parser.add_argument("--import-mb-dump", metavar="PATH", help="Import a MusicBrainz artist dump (JSON lines) for local metadata lookups")
+    parser.add_argument("--detect-languages", action="store_true", help="Detect missing song languages from artist and title")
+    parser.add_argument("--language-workers", type=int, help="Number of processes detecting languages (default: one per CPU)", default=None)
     parser.add_argument("--metadata-stats", action="store_true", help="Show metadata statistics")
     parser.add_argument("--limit", type=int, help="Limit the number of songs to process for metadata", default=None)
     parser.add_argument("--artist", type=str, help="Filter songs by artist name substring", default=None)
     parser.add_argument("--exact-artist", type=str, help="Filter songs by exact artist name", default=None)
     parser.add_argument("--title", type=str, help="Filter songs by title substring", default=None)
     parser.add_argument("--api-key", help="API key for Radio Nowy Świat API", default=DEFAULT_API_KEY)
+    parser.add_argument("--api-url", help="Playlist API endpoint", default=API_URL)
+    parser.add_argument("--fetch-concurrency", type=int, help="Number of days fetched concurrently (default 4)", default=None)
+    parser.add_argument("--rate-limit", type=float, help="Maximum API requests per second (default 5, 0 disables the limit)", default=None)
     parser.add_argument("--clear-cache", action="store_true", help="Clear the artist cache before processing")
 
     # If no arguments provided, default to running all steps
     args = parser.parse_args()
-    if not (args.fetch or args.create_db or args.save_to_db or args.process_metadata or args.metadata_stats or args.clear_cache):
+    if args.full_rebuild or args.from_archive:
+        args.save_to_db = True
+    if not (args.fetch or args.create_db or args.save_to_db or args.process_metadata or args.metadata_stats or args.clear_cache
+            or args.pack_archive or args.unpack_archive or args.rebuild_rollups or args.check_rollups
+            or args.migrate_db or args.import_mb_dump or args.detect_languages):
         args.fetch = args.create_db = args.save_to_db = True
         
     # Validate API key if fetching data
@@ -271,13 +457,48 @@ def main():
             logger.info("Setting up database...")
             setup_database()
 
+        if args.migrate_db:
+            logger.info("Migrating database...")
+            migrate_db()
+
         if args.fetch:
             logger.info("Fetching data from API...")
-            fetch_data(args.api_key)
+            fetch_data(
+                args.api_key,
+                api_url=args.api_url,
+                concurrency=args.fetch_concurrency,
+                rate_limit=args.rate_limit
+            )
+
+        if args.unpack_archive:
+            logger.info("Unpacking yearly archives...")
+            unpack_archives()
+
+        if args.pack_archive:
+            logger.info("Packing JSON files into yearly archives...")
+            pack_archive()
 
         if args.save_to_db:
             logger.info("Saving data to database...")
-            save_to_database()
+            save_to_database(
+                full_rebuild=args.full_rebuild, workers=args.workers or 1, from_archive=args.from_archive,
+                rolling_sketch=args.rolling_sketch
+            )
+            
+        if args.rebuild_rollups:
+            logger.info("Rebuilding rollup tables...")
+            rebuild_rollup_tables()
+
+        if args.check_rollups:
+            logger.info("Checking rollup tables...")
+            if not check_rollup_tables():
+                logger.error("Rollup tables are inconsistent, run with --rebuild-rollups")
+                sys.exit(1)
+            
+        if args.import_mb_dump:
+            from mb_dump import import_dump
+            logger.info(f"Importing MusicBrainz dump {args.import_mb_dump}...")
+            import_dump(args.import_mb_dump)
             
         if args.process_metadata:
             logger.info("Processing metadata for songs...")
@@ -285,9 +506,16 @@ def main():
                 limit=args.limit,
                 artist_substring=args.artist,
                 title_substring=args.title,
-                exact_artist=args.exact_artist
+                exact_artist=args.exact_artist,
+                workers=args.metadata_workers,
+                by_artist=not args.metadata_per_song,
+                offline=args.metadata_offline
             )
             
+        if args.detect_languages:
+            logger.info("Detecting song languages...")
+            detect_languages(limit=args.limit, workers=args.language_workers)
+            
         if args.metadata_stats:
             show_metadata_stats()
     except KeyboardInterrupt:
@@ -0,0 +1,193 @@
+import gzip
+import json
+import lzma
+import sqlite3
+import tarfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from logger_config import setup_logger
+from names import normalize_name
+
+# Configure logging
+logger = setup_logger(__name__, 'metadata_processing.log')
+
+MB_DUMP_DB = "musicbrainz.db"
+IMPORT_BATCH_SIZE = 10000
+# Member holding the artists in the official MusicBrainz JSON dump (artist.tar.xz)
+DUMP_ARTIST_MEMBER = "mbdump/artist"
+
+
+@contextmanager
+def _open_lines(path):
+    """Open a JSON-lines dump as a binary stream, closed (with its archive) on exit.
+
+    Supports plain, .gz and .xz files and the official artist.tar.xz archive.
+    """
+    path = Path(path)
+    if path.name.endswith((".tar.xz", ".tar.gz", ".tar")):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.name == DUMP_ARTIST_MEMBER:
+                    with archive.extractfile(member) as f:
+                        yield f
+                    return
+        raise ValueError(f"{path} has no {DUMP_ARTIST_MEMBER} member")
+    if path.suffix == ".xz":
+        opener = lzma.open
+    elif path.suffix == ".gz":
+        opener = gzip.open
+    else:
+        opener = open
+    with opener(path, "rb") as f:
+        yield f
+
+
+def _artist_rows(artist):
+    """Convert a dump artist to an mb_artists row and its mb_artist_names rows."""
+    tags = [
+        {"name": tag["name"], "count": str(tag.get("count", 0))}
+        for tag in artist.get("tags") or []
+        if tag.get("name")
+    ]
+    # Artists with more tag votes are better known, prefer them for ambiguous names
+    popularity = sum(int(tag["count"]) for tag in tags)
+    area = artist.get("area") or {}
+    artist_row = (
+        artist["id"], artist["name"], artist.get("country"), area.get("name"),
+        json.dumps(tags, ensure_ascii=False), popularity
+    )
+
+    names = {normalize_name(artist["name"]): 1}
+    for alias in artist.get("aliases") or []:
+        for alias_name in (alias.get("name"), alias.get("sort-name")):
+            if alias_name:
+                names.setdefault(normalize_name(alias_name), 0)
+    name_rows = [(name_key, artist["id"], is_primary) for name_key, is_primary in names.items() if name_key]
+    return artist_row, name_rows
+
+
+def import_dump(dump_path, db_path=MB_DUMP_DB):
+    """Import a MusicBrainz artist dump (JSON lines, one artist per line) into a local database.
+
+    The official JSON dump and subsets of it in the same format are supported.
+    Artists already imported are replaced.
+
+    Returns:
+        The number of imported artists.
+    """
+    with sqlite3.connect(db_path) as conn:
+        _ensure_schema(conn)
+        artist_rows = []
+        name_rows = []
+        imported = 0
+
+        def flush():
+            conn.executemany("DELETE FROM mb_artist_names WHERE artist_id = ?", [(row[0],) for row in artist_rows])
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO mb_artists (id, name, country, area, tags, popularity)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                artist_rows
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO mb_artist_names (name_key, artist_id, is_primary) VALUES (?, ?, ?)",
+                name_rows
+            )
+            conn.commit()
+            artist_rows.clear()
+            name_rows.clear()
+
+        with _open_lines(dump_path) as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    artist_row, artist_names = _artist_rows(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Skipping line {line_number} of {dump_path}: {e}")
+                    continue
+                artist_rows.append(artist_row)
+                name_rows.extend(artist_names)
+                imported += 1
+                if len(artist_rows) >= IMPORT_BATCH_SIZE:
+                    flush()
+                    logger.info(f"Imported {imported} artists...")
+        flush()
+
+    logger.info(f"Imported {imported} artists from {dump_path} into {db_path}")
+    return imported
+
+
+def _ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mb_artists (
+        id TEXT PRIMARY KEY,  -- MusicBrainz artist ID
+        name TEXT NOT NULL,
+        country TEXT,
+        area TEXT,
+        tags TEXT NOT NULL,  -- JSON list of {"name", "count"}
+        popularity INTEGER NOT NULL  -- Total tag votes
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS mb_artist_names (
+        name_key TEXT NOT NULL,  -- names.normalize_name of the name, sort name or an alias
+        artist_id TEXT NOT NULL,
+        is_primary INTEGER NOT NULL,  -- 1 for the artist's own name, 0 for aliases
+        PRIMARY KEY (name_key, artist_id)
+    ) WITHOUT ROWID
+    """)
+
+
+class LocalResolver:
+    """Resolve artist names against a local MusicBrainz dump imported with import_dump.
+
+    Lookups are single index searches on the normalised name, so they take
+    microseconds instead of a rate-limited API round trip. Safe to share
+    between threads.
+    """
+
+    def __init__(self, db_path=MB_DUMP_DB):
+        # Read-only, the resolver never writes to the dump database
+        self._conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def lookup(self, artist):
+        """Find the best matching artist for a name.
+
+        Artists whose own name matches win over alias matches, then the artist
+        with the most tag votes wins.
+
+        Returns:
+            An (artist_data, artist_details) tuple shaped like the results of
+            musicbrainzngs.search_artists and get_artist_by_id, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT a.id, a.name, a.country, a.area, a.tags
+                FROM mb_artist_names n
+                JOIN mb_artists a ON a.id = n.artist_id
+                WHERE n.name_key = ?
+                ORDER BY n.is_primary DESC, a.popularity DESC
+                LIMIT 1
+                """,
+                (normalize_name(artist),)
+            ).fetchone()
+        if row is None:
+            return None
+
+        artist_id, name, country, area, tags = row
+        artist_data = {"id": artist_id, "name": name}
+        if country:
+            artist_data["country"] = country
+        if area:
+            artist_data["area"] = {"name": area}
+        artist_details = {"artist": {"id": artist_id, "name": name, "tag-list": json.loads(tags)}}
+        return artist_data, artist_details
+
+    def close(self):
+        self._conn.close()
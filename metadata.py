@@ -1,221 +1,293 @@
-import musicbrainzngs
-from langdetect import detect, LangDetectException
-import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import threading
+from langdetect import DetectorFactory, detect, detect_langs, LangDetectException
+from langdetect.detector_factory import init_factory
 import json
+import os
 import re
-from database import update_song_metadata, record_not_found_song
+from database import (
+    update_song_metadata, bulk_update_song_metadata, record_lookup_failures, clear_lookup_failures,
+    store_detected_languages, get_metadata_coverage
+)
 from logger_config import setup_logger
+from cache_store import CacheStore
+from names import artist_lookup_keys, normalize_name, similarity
+from mb_dump import LocalResolver, MB_DUMP_DB
+from musicbrainz_client import MusicBrainzClient, MUSICBRAINZ_RATE_LIMIT
 
 # Configure logging
 logger = setup_logger(__name__, 'metadata_processing.log')
 
-# Set up MusicBrainz API client
-musicbrainzngs.set_useragent(
-    "rns-stat", 
-    "0.2", 
-    "https://github.com/orestesgaolin/rns-statystyki"
-)
+DEFAULT_METADATA_WORKERS = 4
+METADATA_WRITE_BATCH = 500  # Songs per bulk song_metadata upsert
+MIN_CANDIDATE_SCORE = 0.5  # Search results less similar to the query are ignored
+LANGDETECT_SEED = 0  # Fixed seed, so the same text is always detected as the same language
+LANGDETECT_BATCH = 1000  # Texts per task sent to a detection process
+LANGDETECT_MIN_PROBABILITY = 0.9  # Less certain detections are discarded
 
-# Artist cache to avoid redundant API calls
-_artist_cache = {}
-_artist_details_cache = {}
-_CACHE_FILE = "artist_cache.json"
+# Artist cache to avoid redundant API calls, opened on first use
+ARTIST_CACHE_DB = "artist_cache.db"
+_LEGACY_CACHE_FILE = "artist_cache.json"
+_cache_store = None
+_cache_lock = threading.Lock()
+_lookups_in_flight = {}  # (namespace, key) -> Event set when the lookup finishes
 
-def _load_cache():
-    """Load artist cache from disk.
+# Client used when no other client is passed in, created on first use
+_default_client = None
+# Resolver for the local MusicBrainz dump, None until first use and False if there is no dump
+_local_resolver = None
+
+def _import_legacy_cache(store):
+    """Copy the entries of the old artist_cache.json file into a new cache store.
     
-    The artist cache contains found artists (with their data) and not-found artists (with None value).
-    This helps avoid redundant API calls for artists that were previously not found.
+    The file holds found artists (with their data) and not-found artists (with None value).
     """
-    global _artist_cache, _artist_details_cache
     try:
-        with open(_CACHE_FILE, 'r') as f:
+        with open(_LEGACY_CACHE_FILE, 'r') as f:
             cache_data = json.load(f)
-            _artist_cache = cache_data.get('artists', {})
-            _artist_details_cache = cache_data.get('details', {})
-        logger.info(f"Loaded artist cache with {len(_artist_cache)} artists and {len(_artist_details_cache)} artist details")
+        store.set_many('artists', ((normalize_name(artist), data) for artist, data in cache_data.get('artists', {}).items()))
+        store.set_many('details', cache_data.get('details', {}).items())
+        logger.info(f"Imported {len(cache_data.get('artists', {}))} artists and {len(cache_data.get('details', {}))} artist details from {_LEGACY_CACHE_FILE}")
     except FileNotFoundError:
-        logger.info("No cache file found, starting with empty cache")
+        pass
     except Exception as e:
-        logger.warning(f"Error loading artist cache: {str(e)}")
+        logger.warning(f"Error importing {_LEGACY_CACHE_FILE}: {str(e)}")
 
-def _save_cache():
-    """Save artist cache to disk."""
-    try:
-        # Convert non-serializable keys (like artist IDs) to strings
-        artists_serializable = {}
-        details_serializable = {}
-        
-        for artist, data in _artist_cache.items():
-            artists_serializable[artist] = data
-            
-        for artist_id, data in _artist_details_cache.items():
-            details_serializable[str(artist_id)] = data
-            
-        with open(_CACHE_FILE, 'w') as f:
-            cache_data = {
-                'artists': artists_serializable,
-                'details': details_serializable
-            }
-            json.dump(cache_data, f)
-        logger.info(f"Saved artist cache with {len(_artist_cache)} artists and {len(_artist_details_cache)} artist details")
-    except Exception as e:
-        logger.warning(f"Error saving artist cache: {str(e)}")
+def _get_cache_store():
+    global _cache_store
+    with _cache_lock:
+        if _cache_store is None:
+            is_new = not os.path.exists(ARTIST_CACHE_DB)
+            _cache_store = CacheStore(ARTIST_CACHE_DB)
+            if is_new:
+                _import_legacy_cache(_cache_store)
+        return _cache_store
+
+def purge_expired_cache():
+    """Delete the expired entries of the artist cache, which are otherwise only skipped on reads."""
+    purged = _get_cache_store().purge_expired()
+    if purged:
+        logger.info(f"Purged {purged} expired entries from {ARTIST_CACHE_DB}")
+    return purged
 
 def clear_cache():
-    """Clear the artist cache and delete the cache file."""
-    global _artist_cache, _artist_details_cache
-    _artist_cache = {}
-    _artist_details_cache = {}
+    """Clear the artist cache, including the old artist_cache.json file."""
+    _get_cache_store().clear()
     
     try:
-        import os
-        if os.path.exists(_CACHE_FILE):
-            os.remove(_CACHE_FILE)
-            logger.info(f"Cache file {_CACHE_FILE} deleted")
+        if os.path.exists(_LEGACY_CACHE_FILE):
+            os.remove(_LEGACY_CACHE_FILE)
+            logger.info(f"Cache file {_LEGACY_CACHE_FILE} deleted")
     except Exception as e:
         logger.warning(f"Error deleting cache file: {str(e)}")
     
     logger.info("Artist cache cleared")
 
-# Load cache at module initialization
-_load_cache()
+# Define mapping of countries to languages
+COUNTRY_TO_LANG = {
+    # English speaking countries
+    'GB': 'en-GB', 'US': 'en-US', 'CA': 'en-CA', 'AU': 'en-AU', 'NZ': 'en-NZ', 'IE': 'en-IE',
+    # European languages
+    'FR': 'fr', 'DE': 'de', 'IT': 'it', 'ES': 'es', 'PL': 'pl', 
+    'RU': 'ru', 'PT': 'pt', 'NL': 'nl', 'BE': 'nl', 'SE': 'sv',
+    'NO': 'no', 'DK': 'da', 'FI': 'fi', 'GR': 'el', 'CZ': 'cs',
+    # Asian languages
+    'JP': 'ja', 'CN': 'zh', 'KR': 'ko', 'TH': 'th', 'IN': 'hi',
+    # Latin American countries (mostly Spanish)
+    'MX': 'es', 'AR': 'es', 'CO': 'es', 'CL': 'es', 'PE': 'es', 
+    'VE': 'es', 'EC': 'es', 'GT': 'es', 'CU': 'es', 'BO': 'es',
+    'DO': 'es', 'HN': 'es', 'PY': 'es', 'SV': 'es', 'NI': 'es', 
+    'CR': 'es', 'PA': 'es', 'UY': 'es',
+    # Brazil (Portuguese)
+    'BR': 'pt'
+}
+
+# Map common countries/areas to language codes
+AREA_TO_LANG = {
+    # English-speaking areas
+    'United States': 'en-US', 'United Kingdom': 'en-GB', 'Australia': 'en-AU', 
+    'Canada': 'en-CA', 'New Zealand': 'en-NZ', 'Ireland': 'en-IE', 'England': 'en-GB',
+    'Scotland': 'en-GB', 'Wales': 'en-GB', 
+    
+    # European areas with distinct languages
+    'Germany': 'de', 'Austria': 'de', 'Switzerland': 'de',
+    'France': 'fr', 'Belgium': 'fr',  # Note: Belgium could be fr or nl
+    'Italy': 'it', 'Spain': 'es', 'Poland': 'pl', 'Russia': 'ru',
+    'Sweden': 'sv', 'Norway': 'no', 'Denmark': 'da', 'Finland': 'fi',
+    'Netherlands': 'nl', 'Greece': 'el', 'Czech Republic': 'cs',
+    'Hungary': 'hu', 'Portugal': 'pt', 'Romania': 'ro', 'Bulgaria': 'bg',
+    'Ukraine': 'uk', 'Croatia': 'hr', 'Serbia': 'sr', 'Slovakia': 'sk',
+    
+    # Asian areas
+    'Japan': 'ja', 'China': 'zh', 'Korea': 'ko', 'South Korea': 'ko',
+    'Thailand': 'th', 'India': 'hi', 'Turkey': 'tr', 'Indonesia': 'id',
+    'Malaysia': 'ms', 'Philippines': 'tl',
+    
+    # Latin American areas
+    'Mexico': 'es', 'Argentina': 'es', 'Colombia': 'es', 'Chile': 'es',
+    'Peru': 'es', 'Venezuela': 'es', 'Ecuador': 'es', 'Guatemala': 'es',
+    'Cuba': 'es', 'Bolivia': 'es', 'Dominican Republic': 'es',
+    'Honduras': 'es', 'Paraguay': 'es', 'El Salvador': 'es',
+    'Nicaragua': 'es', 'Costa Rica': 'es', 'Panama': 'es',
+    'Uruguay': 'es', 'Puerto Rico': 'es',
+    
+    # Brazil (Portuguese)
+    'Brazil': 'pt'
+}
+
+def _get_local_resolver():
+    global _local_resolver
+    with _cache_lock:
+        if _local_resolver is None:
+            _local_resolver = LocalResolver(MB_DUMP_DB) if os.path.exists(MB_DUMP_DB) else False
+        return _local_resolver or None
+
+def _get_default_client():
+    global _default_client
+    with _cache_lock:
+        if _default_client is None:
+            _default_client = MusicBrainzClient()
+        return _default_client
 
-def find_song_metadata(conn, song_id, artist, title):
-    """Try to find song metadata using MusicBrainz API."""
+def _cached_lookup(namespace, key, fetch):
+    """Return the cached value of key, calling fetch() to fill the cache if missing.
+    
+    If several threads ask for the same key at once, only the first one calls
+    fetch() and the others wait for its result. Failed lookups are not cached.
+    """
+    store = _get_cache_store()
+    in_flight_key = (namespace, key)
+    while True:
+        with _cache_lock:
+            in_flight = _lookups_in_flight.get(in_flight_key)
+            if in_flight is None:
+                found, value = store.get(namespace, key)
+                if found:
+                    return value
+                in_flight = _lookups_in_flight[in_flight_key] = threading.Event()
+                break
+        in_flight.wait()
+    
+    try:
+        value = fetch()
+        store.set(namespace, key, value)
+        return value
+    finally:
+        with _cache_lock:
+            del _lookups_in_flight[in_flight_key]
+        in_flight.set()
+
+def _candidate_score(key, candidate):
+    """Score a search result by how closely its name, sort name or aliases match the query key.
+    
+    Returns:
+        A (name similarity, MusicBrainz search score) tuple, comparable with max().
+    """
+    names = [candidate.get('name'), candidate.get('sort-name')]
+    names.extend(alias.get('alias') for alias in candidate.get('alias-list', []))
+    name_score = max((similarity(key, normalize_name(name)) for name in names if name), default=0.0)
+    return name_score, int(candidate.get('ext:score', 0))
+
+def _search_artist(client, key):
+    """Search MusicBrainz for an artist, returning the best scoring match or None."""
+    logger.info(f"Searching MusicBrainz for artist: '{key}'")
+    artist_result = client.search_artists(query=key, limit=5)
+    
+    if "artist-list" not in artist_result or not artist_result["artist-list"]:
+        logger.info(f"No artists found for query: {key}")
+        return None
+        
+    # Log found artists for debugging
+    logger.info(f"Found {len(artist_result['artist-list'])} artists matching '{key}'")
+    for idx, artist_item in enumerate(artist_result["artist-list"]):
+        logger.info(f"Artist {idx+1}: {artist_item.get('name', 'Unknown')} [{artist_item.get('id', 'No ID')}]")
+    
+    # Take the candidate whose name is closest to the query, not just the first one
+    best = max(artist_result["artist-list"], key=lambda candidate: _candidate_score(key, candidate))
+    if _candidate_score(key, best)[0] < MIN_CANDIDATE_SCORE:
+        logger.info(f"No artist close enough to '{key}' among the search results")
+        return None
+    return best
+
+def _find_artist(key, client, offline):
+    """Find an artist by normalised name in the local dump, the cache or the API.
+    
+    Returns:
+        An (artist_data, artist_details, source) tuple, where artist_details is
+        None if it still has to be looked up, or None if nothing was found.
+    """
+    local_resolver = _get_local_resolver()
+    local_match = local_resolver.lookup(key) if local_resolver else None
+    if local_match:
+        artist_data, artist_details = local_match
+        return artist_data, artist_details, 'musicbrainz-dump'
+    if offline:
+        return None
+    
+    # Only the exact key is reused: a similar name may be another act ("Alabama 3" and "Alabama")
+    client = client or _get_default_client()
+    artist_data = _cached_lookup('artists', key, lambda: _search_artist(client, key))
+    if artist_data is None:
+        return None
+    return artist_data, None, 'musicbrainz'
+
+def resolve_artist_metadata(artist, client=None, offline=False):
+    """Resolve the metadata shared by all songs of an artist.
+    
+    Language and genres only depend on the artist. The name is normalised (see
+    names.artist_lookup_keys), then the local MusicBrainz dump (see mb_dump) is
+    tried first if it was imported; on a miss the MusicBrainz API is used unless
+    offline is set. Artist searches and lookups are cached (including artists
+    that were not found), and nothing is written to the database. Safe to call
+    from several threads sharing one client.
+    
+    Returns:
+        A dict of update_song_metadata keyword arguments, or None if the artist
+        was not found or the search failed.
+    """
     try:
         # Extract metadata
         language = None
         genres = []
         publish_date = None
         
-        # Define mapping of countries to languages
-        country_to_lang = {
-            # English speaking countries
-            'GB': 'en-GB', 'US': 'en-US', 'CA': 'en-CA', 'AU': 'en-AU', 'NZ': 'en-NZ', 'IE': 'en-IE',
-            # European languages
-            'FR': 'fr', 'DE': 'de', 'IT': 'it', 'ES': 'es', 'PL': 'pl', 
-            'RU': 'ru', 'PT': 'pt', 'NL': 'nl', 'BE': 'nl', 'SE': 'sv',
-            'NO': 'no', 'DK': 'da', 'FI': 'fi', 'GR': 'el', 'CZ': 'cs',
-            # Asian languages
-            'JP': 'ja', 'CN': 'zh', 'KR': 'ko', 'TH': 'th', 'IN': 'hi',
-            # Latin American countries (mostly Spanish)
-            'MX': 'es', 'AR': 'es', 'CO': 'es', 'CL': 'es', 'PE': 'es', 
-            'VE': 'es', 'EC': 'es', 'GT': 'es', 'CU': 'es', 'BO': 'es',
-            'DO': 'es', 'HN': 'es', 'PY': 'es', 'SV': 'es', 'NI': 'es', 
-            'CR': 'es', 'PA': 'es', 'UY': 'es',
-            # Brazil (Portuguese)
-            'BR': 'pt'
-        }
-        
-        # Search directly for the artist
-        logger.info(f"Searching MusicBrainz for artist: '{artist}'")
-        
-        # Check if we have the artist in our cache
-        if artist in _artist_cache:
-            # Check if the artist was previously not found
-            if _artist_cache[artist] is None:
-                logger.info(f"Artist '{artist}' was previously not found in MusicBrainz")
-                return False
-                
-            logger.info(f"Using cached artist data for: '{artist}'")
-            artist_data = _artist_cache[artist]
+        # The full name without guest artists first, then the first credited artist
+        for key in artist_lookup_keys(artist):
+            match = _find_artist(key, client, offline)
+            if match:
+                break
         else:
-            # Search the MusicBrainz API
-            artist_result = musicbrainzngs.search_artists(query=artist, limit=5)
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.25)
-            
-            if "artist-list" not in artist_result or not artist_result["artist-list"]:
-                logger.info(f"No artists found for query: {artist}")
-                # Cache the fact that this artist wasn't found (using None)
-                _artist_cache[artist] = None
-                _save_cache()  # Save the cache immediately for not-found artists
-                return False
-                
-            # Log found artists for debugging
-            logger.info(f"Found {len(artist_result['artist-list'])} artists matching '{artist}'")
-            for idx, artist_item in enumerate(artist_result["artist-list"]):
-                logger.info(f"Artist {idx+1}: {artist_item.get('name', 'Unknown')} [{artist_item.get('id', 'No ID')}]")
-                
-            # Take the first artist match
-            artist_data = artist_result["artist-list"][0]
-            
-            # Cache the artist data for future use
-            _artist_cache[artist] = artist_data
+            logger.info(f"Artist '{artist}' was not found in MusicBrainz")
+            return None
+        artist_data, artist_details, source = match
             
         logger.info(f"Selected artist: {artist_data.get('name', 'Unknown')} [{artist_data.get('id', 'No ID')}]")
         
-        # Log the full artist data for debugging
-        # logger.info(f"Artist data: {json.dumps(artist_data, indent=2)}")
-        
         # First try to determine language from country code (direct and most reliable)
         if 'country' in artist_data:
             country = artist_data['country']
-            language = country_to_lang.get(country)
+            language = COUNTRY_TO_LANG.get(country)
             logger.info(f"Using artist country code '{country}' to determine language: {language}")
             
         # If no language found from country code, try the area name
         if not language and 'area' in artist_data:
             area_name = artist_data['area']['name']
             logger.info(f"Found artist area: {area_name}")
-            
-            # Map common countries/areas to language codes
-            area_to_lang = {
-                # English-speaking areas
-                'United States': 'en-US', 'United Kingdom': 'en-GB', 'Australia': 'en-AU', 
-                'Canada': 'en-CA', 'New Zealand': 'en-NZ', 'Ireland': 'en-IE', 'England': 'en-GB',
-                'Scotland': 'en-GB', 'Wales': 'en-GB', 
-                
-                # European areas with distinct languages
-                'Germany': 'de', 'Austria': 'de', 'Switzerland': 'de',
-                'France': 'fr', 'Belgium': 'fr',  # Note: Belgium could be fr or nl
-                'Italy': 'it', 'Spain': 'es', 'Poland': 'pl', 'Russia': 'ru',
-                'Sweden': 'sv', 'Norway': 'no', 'Denmark': 'da', 'Finland': 'fi',
-                'Netherlands': 'nl', 'Greece': 'el', 'Czech Republic': 'cs',
-                'Hungary': 'hu', 'Portugal': 'pt', 'Romania': 'ro', 'Bulgaria': 'bg',
-                'Ukraine': 'uk', 'Croatia': 'hr', 'Serbia': 'sr', 'Slovakia': 'sk',
-                
-                # Asian areas
-                'Japan': 'ja', 'China': 'zh', 'Korea': 'ko', 'South Korea': 'ko',
-                'Thailand': 'th', 'India': 'hi', 'Turkey': 'tr', 'Indonesia': 'id',
-                'Malaysia': 'ms', 'Philippines': 'tl',
-                
-                # Latin American areas
-                'Mexico': 'es', 'Argentina': 'es', 'Colombia': 'es', 'Chile': 'es',
-                'Peru': 'es', 'Venezuela': 'es', 'Ecuador': 'es', 'Guatemala': 'es',
-                'Cuba': 'es', 'Bolivia': 'es', 'Dominican Republic': 'es',
-                'Honduras': 'es', 'Paraguay': 'es', 'El Salvador': 'es',
-                'Nicaragua': 'es', 'Costa Rica': 'es', 'Panama': 'es',
-                'Uruguay': 'es', 'Puerto Rico': 'es',
-                
-                # Brazil (Portuguese)
-                'Brazil': 'pt'
-            }
-            language = area_to_lang.get(area_name)
+            language = AREA_TO_LANG.get(area_name)
             if language:
                 logger.info(f"Using artist area '{area_name}' to determine language: {language}")
         
-                # No need for the fallback to country code since we now check it first
-        
         # Try to get genre tags for the artist
         artist_id = artist_data.get('id')
         if artist_id:
             try:
-                # Check if we have the artist details in our cache
-                if artist_id in _artist_details_cache:
-                    logger.info(f"Using cached artist details for ID: {artist_id}")
-                    artist_details = _artist_details_cache[artist_id]
-                else:
-                    # Look up detailed artist info to get tags for potential genres
-                    logger.info(f"Fetching extended artist details for ID: {artist_id}")
-                    artist_details = musicbrainzngs.get_artist_by_id(artist_id, includes=['tags'])
-                    # Add a small delay to avoid rate limiting
-                    time.sleep(0.25)
-
-                    # Cache the artist details for future use
-                    _artist_details_cache[artist_id] = artist_details
+                # Look up detailed artist info to get tags for potential genres
+                if artist_details is None:
+                    client = client or _get_default_client()
+                    artist_details = _cached_lookup(
+                        'details', artist_id,
+                        lambda: client.get_artist_by_id(artist_id, includes=['tags'])
+                    )
                 
                 if 'artist' in artist_details and 'tag-list' in artist_details['artist']:
                     # Extract genres from tags
@@ -226,30 +298,35 @@ def find_song_metadata(conn, song_id, artist, title):
             except Exception as e:
                 logger.warning(f"Error getting extended artist details: {str(e)}")
         
-        # Convert genres to JSON string
-        genres_json = json.dumps(genres) if genres else None
-        
-        # Store the metadata
-        update_song_metadata(
-            conn=conn,
-            song_id=song_id,
-            language=language,
-            genre=genres_json,  # Use JSON string instead of list
-            publish_date=publish_date,
-            source='musicbrainz',
-            raw_data=json.dumps(artist_data)  # Convert dict to JSON string
-        )
-        
-        logger.info(f"Updated metadata for {artist} - {title}: lang={language}, genres={genres}")
-        return True
+        return {
+            'language': language,
+            'genre': json.dumps(genres) if genres else None,  # Use JSON string instead of list
+            'publish_date': publish_date,
+            'source': source,
+            'raw_data': json.dumps(artist_data)  # Convert dict to JSON string
+        }
             
     except Exception as e:
-        logger.error(f"Error searching MusicBrainz for {artist} - {title}: {str(e)}")
-        return False
-        
-        # If we get here, none of the search strategies worked
-        logger.warning(f"No MusicBrainz results for: {artist} - {title}")
+        logger.error(f"Error searching MusicBrainz for {artist}: {str(e)}")
+        return None
+
+def resolve_song_metadata(artist, title, client=None):
+    """Resolve song metadata with the MusicBrainz API, without touching the database."""
+    return resolve_artist_metadata(artist, client)
+
+def store_song_metadata(conn, song_id, metadata):
+    """Store metadata returned by resolve_song_metadata."""
+    update_song_metadata(conn=conn, song_id=song_id, **metadata)
+
+def find_song_metadata(conn, song_id, artist, title, client=None):
+    """Try to find song metadata using MusicBrainz API and store it."""
+    metadata = resolve_song_metadata(artist, title, client)
+    if metadata is None:
         return False
+    
+    store_song_metadata(conn, song_id, metadata)
+    logger.info(f"Updated metadata for {artist} - {title}: lang={metadata['language']}, genres={metadata['genre']}")
+    return True
 
 def detect_language_from_text(text):
     """Try to detect language from song title and artist."""
@@ -261,17 +338,213 @@ def detect_language_from_text(text):
         logger.warning(f"Could not detect language from '{text}': {str(e)}")
         return None
 
+def _init_language_detector():
+    """Seed langdetect and load its language profiles once per worker process."""
+    DetectorFactory.seed = LANGDETECT_SEED
+    init_factory()
+
+def _detect_language_batch(texts):
+    """Detect the language of each text, None where it is unknown or uncertain."""
+    languages = []
+    for text in texts:
+        try:
+            best = detect_langs(text)[0]
+        except LangDetectException:
+            languages.append(None)
+            continue
+        languages.append(best.lang if best.prob >= LANGDETECT_MIN_PROBABILITY else None)
+    return languages
+
+def song_language_text(artist, title):
+    """Text whose language is detected for a song."""
+    return f"{artist} {title}"
+
+def detect_song_languages(conn, songs, workers=None):
+    """Detect the language of songs from their artist and title and store it.
+    
+    Meant as a fallback for songs MusicBrainz couldn't give a language. Every
+    distinct text is detected once, in batches of LANGDETECT_BATCH spread over
+    a process pool whose workers load the langdetect profiles once and share a
+    fixed seed, so results are reproducible. Results are kept in the artist
+    cache, so texts left undetermined aren't detected again on the next run
+    until their cache entry expires. Songs without metadata get a
+    song_metadata row with source='langdetect', which leaves them pending for
+    MusicBrainz; songs with a metadata row only get their missing language.
+    
+    Args:
+        conn: Database connection
+        songs: List of dicts with 'id', 'artist' and 'title'
+        workers: Number of detection processes, defaults to the number of CPUs
+    
+    Returns:
+        The number of songs whose language was stored.
+    """
+    store = _get_cache_store()
+    detected = {}
+    texts = []
+    for text in sorted({song_language_text(song['artist'], song['title']) for song in songs}):
+        found, language = store.get('languages', text)
+        if found:
+            detected[text] = language
+        else:
+            texts.append(text)
+    logger.info(f"Detecting languages of {len(texts)} distinct texts for {len(songs)} songs "
+                f"({len(detected)} cached)")
+    
+    batches = [texts[i:i + LANGDETECT_BATCH] for i in range(0, len(texts), LANGDETECT_BATCH)]
+    if batches:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_language_detector) as executor:
+            for batch, languages in zip(batches, executor.map(_detect_language_batch, batches)):
+                detected.update(zip(batch, languages))
+                store.set_many('languages', zip(batch, languages))
+    
+    rows = []
+    for song in songs:
+        language = detected[song_language_text(song['artist'], song['title'])]
+        if language is not None:
+            rows.append((song['id'], language))
+    store_detected_languages(conn, rows)
+    return len(rows)
+
 def process_song_without_metadata(conn, song_id, artist, title):
     """Process a song that doesn't have metadata yet."""
     # Try MusicBrainz
     success = find_song_metadata(conn, song_id, artist, title)
     
-    # If MusicBrainz failed, record the song as not found
+    # If MusicBrainz failed, record the failure so the song is retried later
     if not success:
         logger.info(f"Could not find metadata for: {artist} - {title}")
-        record_not_found_song(artist, title)
-        # No need to save cache here as we now save it within find_song_metadata for not-found artists
+        record_lookup_failures(conn, [song_id])
     else:
-        # Save the artist cache after successful lookups
-        _save_cache()
+        clear_lookup_failures(conn, [song_id])
+        conn.commit()
+    
+
+def _metadata_row(song_id, metadata):
+    return (
+        song_id, metadata['language'], metadata['genre'], metadata['publish_date'],
+        metadata['source'], metadata['raw_data']
+    )
+
+class MetadataProgress:
+    """Metadata coverage counters kept in memory during a processing run.
+    
+    Coverage is counted once when the run starts and then updated from the
+    results of the run, so progress can be logged as often as needed without
+    querying the database. Pass an instance as on_progress to enrich_songs.
+    """
+    
+    def __init__(self, total_songs, songs_with_metadata, missing_ids, report_every=10):
+        self.total_songs = total_songs
+        self.songs_with_metadata = songs_with_metadata
+        self.processed = 0
+        self.found = 0
+        self.report_every = report_every
+        self._missing_ids = set(missing_ids)  # Songs of the run without metadata
+        self._next_report = report_every
+    
+    @classmethod
+    def start(cls, conn, songs, report_every=10):
+        """Count the current coverage for a run over songs."""
+        total_songs, songs_with_metadata, missing_ids = get_metadata_coverage(conn, [song['id'] for song in songs])
+        return cls(total_songs, songs_with_metadata, missing_ids, report_every)
+    
+    @property
+    def coverage_percent(self):
+        return round(self.songs_with_metadata / self.total_songs * 100 if self.total_songs > 0 else 0, 2)
+    
+    def __call__(self, processed, total, found_ids):
+        self.processed = processed
+        self.found += len(found_ids)
+        for song_id in found_ids:
+            if song_id in self._missing_ids:
+                self._missing_ids.discard(song_id)
+                self.songs_with_metadata += 1
+        
+        # Log every report_every songs (songs of one artist arrive together)
+        if processed >= self._next_report or processed == total:
+            self._next_report = processed - processed % self.report_every + self.report_every
+            logger.info(f"Progress: {processed}/{total} songs processed")
+            logger.info(f"Metadata coverage: {self.coverage_percent}%")
+
+def enrich_songs(conn, songs, workers=DEFAULT_METADATA_WORKERS, rate_limit=MUSICBRAINZ_RATE_LIMIT,
+                 on_progress=None, by_artist=True, offline=False):
+    """Resolve metadata for many songs concurrently.
+    
+    Worker threads resolve artists through one shared MusicBrainz client, whose
+    token-bucket limiter keeps the total request rate at rate_limit, so searches
+    and lookups of different artists are in flight at the same time. With
+    by_artist, songs are grouped by artist and every distinct artist is resolved
+    once, its result fanned out to all of its songs. The calling thread is the
+    only database writer: results are stored with bulk upserts of up to
+    METADATA_WRITE_BATCH songs.
+    
+    Args:
+        conn: Database connection, used from the calling thread only
+        songs: List of dicts with 'id', 'artist' and 'title'
+        workers: Number of worker threads
+        rate_limit: Maximum MusicBrainz requests per second
+        on_progress: Optional callable(processed, total, found_ids) called after each
+            artist, with the IDs of its songs that got metadata, e.g. a MetadataProgress
+        by_artist: Resolve each artist once instead of each song separately
+        offline: Only use the local MusicBrainz dump; misses are not recorded as
+            failed lookups
+    
+    Returns:
+        A (found, not_found) tuple with the number of songs in each group.
+    """
+    if by_artist:
+        # Spelling variants of an artist ("Björk", "Bjork", "Artist feat. Guest") share one lookup
+        songs_by_artist = {}
+        for song in songs:
+            songs_by_artist.setdefault(artist_lookup_keys(song['artist'])[0], []).append(song)
+        groups = [(artist_songs[0]['artist'], artist_songs) for artist_songs in songs_by_artist.values()]
+        logger.info(f"Resolving {len(groups)} distinct artists for {len(songs)} songs")
+    else:
+        groups = [(song['artist'], [song]) for song in songs]
+    
+    found = 0
+    processed = 0
+    total = len(songs)
+    pending_rows = []
+    not_found_songs = []
+    
+    def flush():
+        bulk_update_song_metadata(conn, pending_rows)
+        record_lookup_failures(conn, not_found_songs)
+        pending_rows.clear()
+        not_found_songs.clear()
+    
+    with MusicBrainzClient(rate_limit=rate_limit, pool_size=workers) as client:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                executor.submit(resolve_artist_metadata, artist, client, offline): (artist, artist_songs)
+                for artist, artist_songs in groups
+            }
+            for future in as_completed(futures):
+                artist, artist_songs = futures[future]
+                metadata = future.result()
+                found_ids = []
+                if metadata is None:
+                    logger.info(f"Could not find metadata for {len(artist_songs)} songs of {artist}")
+                    if not offline:
+                        not_found_songs.extend(song['id'] for song in artist_songs)
+                else:
+                    pending_rows.extend(_metadata_row(song['id'], metadata) for song in artist_songs)
+                    found_ids = [song['id'] for song in artist_songs]
+                    found += len(artist_songs)
+                    logger.info(f"Updated metadata for {len(artist_songs)} songs of {artist}: lang={metadata['language']}")
+                processed += len(artist_songs)
+                
+                if len(pending_rows) + len(not_found_songs) >= METADATA_WRITE_BATCH:
+                    flush()
+                if on_progress:
+                    on_progress(processed, total, found_ids)
+        finally:
+            # Don't start artists that are still queued if we stopped early,
+            # but keep everything resolved so far
+            executor.shutdown(cancel_futures=True)
+            flush()
     
+    return found, processed - found
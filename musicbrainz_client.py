@@ -0,0 +1,112 @@
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from musicbrainzngs import mbxml
+from requests.adapters import HTTPAdapter
+
+from logger_config import setup_logger
+from ratelimit import RateLimiter
+
+# Configure logging
+logger = setup_logger(__name__, 'metadata_processing.log')
+
+MUSICBRAINZ_URL = "https://musicbrainz.org/ws/2"
+USER_AGENT = "rns-stat/0.2 ( https://github.com/orestesgaolin/rns-statystyki )"
+MUSICBRAINZ_RATE_LIMIT = 1.0  # Requests per second allowed by MusicBrainz
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0  # Seconds before the first retry, doubled for each next one
+REQUEST_TIMEOUT = 30
+
+# Responses worth retrying: rate limiting and server overload
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _retry_after_seconds(response):
+    """Return the delay asked for by a Retry-After header (seconds or an HTTP date), or None."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class MusicBrainzClient:
+    """Thread-safe MusicBrainz web service client sharing one token-bucket limiter.
+
+    musicbrainzngs holds a global lock for the whole duration of every request,
+    so requests from several threads never overlap. This client sends requests
+    over a pooled session and only serialises on the rate limiter, so searches
+    and lookups of different workers are in flight at the same time while the
+    overall request rate stays within the MusicBrainz budget. Responses are
+    parsed with musicbrainzngs, so results have the same shape as
+    musicbrainzngs.search_artists and musicbrainzngs.get_artist_by_id.
+    """
+
+    def __init__(self, rate_limit=MUSICBRAINZ_RATE_LIMIT, pool_size=4,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, base_url=MUSICBRAINZ_URL):
+        self.limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, path, params):
+        """GET a web service path and parse the XML response, retrying with exponential backoff.
+
+        Every attempt waits for the rate limiter, so retries count against the limit too.
+        A throttled response (429 or 503) is retried no sooner than its Retry-After header asks.
+
+        Raises:
+            requests.exceptions.RequestException: If the last attempt failed.
+        """
+        url = f"{self.base_url}/{path}"
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+                response.raise_for_status()
+                return mbxml.parse_message(response.content)
+            except requests.exceptions.RequestException as e:
+                status_code = getattr(e.response, "status_code", None)
+                retryable = status_code is None or status_code in RETRY_STATUS_CODES
+                if attempt == self.retries or not retryable:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                retry_after = _retry_after_seconds(e.response)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                logger.warning(f"Error requesting {path} (attempt {attempt + 1}/{self.retries + 1}): {e}, retrying in {delay}s")
+                time.sleep(delay)
+
+    def search_artists(self, query, limit=5):
+        """Search artists by name; the result holds an 'artist-list'."""
+        return self._get("artist/", {"query": query, "limit": limit})
+
+    def get_artist_by_id(self, artist_id, includes=()):
+        """Look up an artist; the result holds an 'artist' dict."""
+        params = {"inc": "+".join(includes)} if includes else {}
+        return self._get(f"artist/{artist_id}", params)
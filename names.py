@@ -0,0 +1,80 @@
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+# Letters NFKD doesn't decompose into a base letter and a combining mark
+_EXTRA_FOLDS = str.maketrans({"ł": "l", "Ł": "l", "ø": "o", "Ø": "o", "đ": "d", "Đ": "d", "ı": "i"})
+# "Artist feat. Guest", "Artist (ft. Guest)", "Artist featuring Guest"
+_FEATURING = re.compile(r"\s*[(\[]?\s*\b(?:feat\.?|ft\.?|featuring)(?:\s|$).*$", re.IGNORECASE)
+# Separators between several credited artists
+_ARTIST_SEPARATORS = re.compile(r"\s*(?:,|&|\+|/|\s(?:x|and|with|vs\.?)\s)\s*", re.IGNORECASE)
+
+
+def normalize_name(name):
+    """Return the key used to match artist names.
+
+    The name is casefolded, stripped of diacritics (so "Björk" and "Bjork" or
+    "Młynarski" and "Mlynarski" share a key) and has its whitespace collapsed.
+    """
+    decomposed = unicodedata.normalize("NFKD", name.translate(_EXTRA_FOLDS)).casefold()
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _WHITESPACE.sub(" ", folded).strip()
+
+
+def canonical_spellings(plays_by_name, key=normalize_name):
+    """Map every name to the most played name sharing its key.
+
+    Ties go to the name that sorts first, so the result doesn't depend on the
+    order of plays_by_name.
+
+    Args:
+        plays_by_name: A dict of name -> plays
+        key: Function returning the key of a name, normalize_name by default
+    """
+    names_by_key = {}
+    for name in plays_by_name:
+        names_by_key.setdefault(key(name), []).append(name)
+    canonical = {}
+    for names in names_by_key.values():
+        most_played = min(names, key=lambda name: (-plays_by_name[name], name))
+        for name in names:
+            canonical[name] = most_played
+    return canonical
+
+
+def strip_featuring(name):
+    """Remove a "feat." suffix naming guest artists."""
+    return _FEATURING.sub("", name).strip() or name.strip()
+
+
+def primary_artist(name):
+    """Return the first of several credited artists, e.g. "A" for "A & B" or "A, B"."""
+    return _ARTIST_SEPARATORS.split(strip_featuring(name), maxsplit=1)[0].strip() or name.strip()
+
+
+def artist_lookup_keys(name):
+    """Return the keys to try, in order, when looking up metadata for an artist string.
+
+    Guest artists after "feat." never matter, so the first key is the full name
+    without them. If that isn't found, the first of several credited artists is
+    tried, as "&" or "," may also be part of a band name ("Kool & the Gang").
+    """
+    keys = [normalize_name(strip_featuring(name))]
+    primary_key = normalize_name(primary_artist(name))
+    if primary_key and primary_key not in keys:
+        keys.append(primary_key)
+    return keys
+
+
+def trigrams(key):
+    """Return the set of character trigrams of a normalised name, padded at the edges."""
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Dice coefficient of the trigrams of two normalised names, from 0 to 1."""
+    a_trigrams = trigrams(a)
+    b_trigrams = trigrams(b)
+    return 2 * len(a_trigrams & b_trigrams) / (len(a_trigrams) + len(b_trigrams))
+
@@ -0,0 +1,331 @@
+import heapq
+import json
+from datetime import date, timedelta
+from pathlib import Path
+
+from logger_config import setup_logger
+from names import canonical_spellings
+
+# Configure logging
+logger = setup_logger(__name__, 'rolling.log')
+
+ROLLING_STATE = Path("rolling_state.json")
+STATE_VERSION = 1
+WINDOWS = (7, 30, 90)  # Days in each chart, ending with the last day with plays
+TOP_K = 50  # Artists and songs in each chart
+
+
+def _shift_day(day, days):
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+def _add_counts(totals, counts, sign=1):
+    """Add (or with sign=-1 subtract) counts to totals in place, dropping zeroes."""
+    for key, count in counts.items():
+        total = totals.get(key, 0) + sign * count
+        if total:
+            totals[key] = total
+        else:
+            del totals[key]
+
+
+class SpaceSaving:
+    """Space-Saving summary of the most frequent keys, with at most capacity counters.
+
+    Counts are exact while there are fewer distinct keys than counters. After
+    that, a new key takes over the counter of the least frequent key and
+    inherits its count, so counts may be overestimated by up to the count of
+    the replaced key (kept in errors) but a key that occurs often enough is
+    never missed. Summaries of several days can be merged.
+    """
+
+    def __init__(self, capacity, counts=None, errors=None):
+        self.capacity = capacity
+        self.counts = counts or {}
+        self.errors = errors or {}
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+        else:
+            evicted = min(self.counts, key=self.counts.__getitem__)
+            error = self.counts.pop(evicted)
+            self.errors.pop(evicted, None)
+            self.counts[key] = error + count
+            self.errors[key] = error
+
+    @classmethod
+    def merged(cls, summaries, capacity):
+        """Sum several summaries, keeping the capacity largest counters."""
+        counts = {}
+        errors = {}
+        for summary in summaries:
+            _add_counts(counts, summary.counts)
+            _add_counts(errors, summary.errors)
+        if len(counts) > capacity:
+            kept = heapq.nlargest(capacity, counts.items(), key=lambda x: (x[1], x[0]))
+            counts = dict(kept)
+            errors = {key: error for key, error in errors.items() if key in counts}
+        return cls(capacity, counts, errors)
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'counts': self.counts, 'errors': self.errors}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['capacity'], data['counts'], data['errors'])
+
+
+class RollingCharts:
+    """Top artists and songs of the last 7, 30 and 90 days, kept up to date as plays arrive.
+
+    Plays are kept in one bucket per day (song and artist counts), only for
+    the days of the longest window. Updating a day replaces its bucket and
+    moves the totals of every window by the difference, and the days falling
+    out of a window are subtracted from it, so an update costs as much as the
+    days it touches, not the whole window. The top lists are recomputed after
+    each update, so reading the charts is a lookup.
+
+    With sketch_capacity, buckets and window totals are Space-Saving summaries
+    of at most that many songs and artists each, which bounds the memory, and
+    the counts of the charts become estimates.
+    """
+
+    def __init__(self, windows=WINDOWS, top_k=TOP_K, sketch_capacity=None):
+        self.windows = tuple(windows)
+        self.top_k = top_k
+        self.sketch_capacity = sketch_capacity
+        self.days = {}  # 'YYYY-MM-DD' -> {'songs': {song_id: plays}, 'artists': {artist: plays}}
+        self.songs = {}  # song_id -> (artist, title), for the songs in the buckets
+        self.last_day = None
+        self.charts = {}
+        # Window -> days included in its totals and the totals, see _rebuild_totals
+        self._window_days = {window: set() for window in self.windows}
+        self._totals = {window: {'songs': {}, 'artists': {}} for window in self.windows}
+
+    def _bucket(self, songs, artists):
+        if self.sketch_capacity is None:
+            return {'songs': songs, 'artists': artists}
+        bucket = {}
+        for kind, counts in (('songs', songs), ('artists', artists)):
+            summary = SpaceSaving(self.sketch_capacity)
+            for key, count in sorted(counts.items(), key=lambda x: -x[1]):
+                summary.add(key, count)
+            bucket[kind] = summary
+        return bucket
+
+    def update(self, day_counts, songs):
+        """Replace the buckets of some days and update the windows and charts.
+
+        Args:
+            day_counts: A dict of day ('YYYY-MM-DD') -> {song_id: plays}, with all
+                the plays of each day; days before the longest window are ignored
+            songs: A dict of song_id -> (artist, title) covering the songs in day_counts
+        """
+        if not day_counts:
+            return
+        self.last_day = max(self.last_day or "", *day_counts)
+        first_day = _shift_day(self.last_day, 1 - max(self.windows))
+
+        # Buckets the window totals may still include, by day
+        previous = {}
+        for day, song_counts in day_counts.items():
+            if day < first_day:
+                continue
+            artist_counts = {}
+            for song_id, plays in song_counts.items():
+                artist = songs[song_id][0]
+                artist_counts[artist] = artist_counts.get(artist, 0) + plays
+                self.songs[song_id] = tuple(songs[song_id])
+            previous.setdefault(day, self.days.get(day))
+            self.days[day] = self._bucket(dict(song_counts), artist_counts)
+        for day in [day for day in self.days if day < first_day]:
+            previous.setdefault(day, self.days.pop(day))
+
+        for window in self.windows:
+            window_first_day = _shift_day(self.last_day, 1 - window)
+            days = {day for day in self.days if day >= window_first_day}
+            if self.sketch_capacity is not None:
+                # Summaries can't be subtracted, merge the window's buckets again
+                for kind in ('songs', 'artists'):
+                    self._totals[window][kind] = SpaceSaving.merged(
+                        [self.days[day][kind] for day in sorted(days)], self.sketch_capacity
+                    )
+            else:
+                totals = self._totals[window]
+                for day in self._window_days[window]:
+                    if day not in days or day in previous:
+                        old_bucket = previous[day] if day in previous else self.days[day]
+                        for kind in ('songs', 'artists'):
+                            _add_counts(totals[kind], old_bucket[kind], sign=-1)
+                for day in days:
+                    if day not in self._window_days[window] or day in previous:
+                        for kind in ('songs', 'artists'):
+                            _add_counts(totals[kind], self.days[day][kind])
+            self._window_days[window] = days
+
+        in_buckets = {song_id for bucket in self.days.values() for song_id in self._counts(bucket['songs'])}
+        self.songs = {song_id: song for song_id, song in self.songs.items() if song_id in in_buckets}
+        self._update_charts()
+
+    def _rebuild_totals(self):
+        """Sum the window totals up from the buckets, e.g. after loading them."""
+        for window in self.windows:
+            window_first_day = _shift_day(self.last_day, 1 - window)
+            days = {day for day in self.days if day >= window_first_day}
+            if self.sketch_capacity is not None:
+                totals = {
+                    kind: SpaceSaving.merged([self.days[day][kind] for day in sorted(days)], self.sketch_capacity)
+                    for kind in ('songs', 'artists')
+                }
+            else:
+                totals = {'songs': {}, 'artists': {}}
+                for day in days:
+                    for kind in ('songs', 'artists'):
+                        _add_counts(totals[kind], self.days[day][kind])
+            self._window_days[window] = days
+            self._totals[window] = totals
+
+    def _counts(self, counts):
+        return counts.counts if isinstance(counts, SpaceSaving) else counts
+
+    def _update_charts(self):
+        for window in self.windows:
+            song_totals = self._counts(self._totals[window]['songs'])
+            artist_totals = self._counts(self._totals[window]['artists'])
+            # Spelling variants of an artist are charted as one, as in the rest of the statistics
+            canonical = canonical_spellings(artist_totals)
+            artists = {}
+            for artist, plays in artist_totals.items():
+                artists[canonical[artist]] = artists.get(canonical[artist], 0) + plays
+            top_artists = heapq.nsmallest(self.top_k, artists.items(), key=lambda x: (-x[1], x[0]))
+            top_songs = heapq.nsmallest(
+                self.top_k, song_totals.items(), key=lambda x: (-x[1], self.songs[x[0]])
+            )
+            self.charts[str(window)] = {
+                'first_day': _shift_day(self.last_day, 1 - window),
+                'last_day': self.last_day,
+                'estimated': self.sketch_capacity is not None,
+                'top_artists': [{'artist': artist, 'play_count': plays} for artist, plays in top_artists],
+                'top_songs': [
+                    {'artist': self.songs[song_id][0], 'title': self.songs[song_id][1], 'play_count': plays}
+                    for song_id, plays in top_songs
+                ],
+            }
+
+    def refresh(self, conn, days):
+        """Reload the buckets of the given days from the daily_song_plays rollup.
+
+        The rollup holds the plays as stored, so a day whose file was ingested
+        again isn't counted twice.
+        """
+        days = sorted(days)
+        if not days:
+            return
+        first_day = _shift_day(max(days[-1], self.last_day or ""), 1 - max(self.windows))
+        days = [day for day in days if day >= first_day]
+        day_counts = {day: {} for day in days}
+        songs = {}
+        cursor = conn.cursor()
+        for day in days:
+            cursor.execute("""
+                SELECT d.song_id, d.play_count, s.artist, s.title
+                FROM daily_song_plays d
+                JOIN songs s ON s.id = d.song_id
+                WHERE d.day = ?
+            """, (day,))
+            for song_id, play_count, artist, title in cursor.fetchall():
+                day_counts[day][song_id] = play_count
+                songs[song_id] = (artist, title)
+        self.update(day_counts, songs)
+
+    @classmethod
+    def from_database(cls, conn, **kwargs):
+        """Build the charts of the last days with plays from the daily_song_plays rollup."""
+        charts = cls(**kwargs)
+        last_day = conn.execute("SELECT MAX(day) FROM daily_song_plays").fetchone()[0]
+        if last_day is not None:
+            first_day = _shift_day(last_day, 1 - max(charts.windows))
+            days = [row[0] for row in conn.execute(
+                "SELECT DISTINCT day FROM daily_song_plays WHERE day >= ?", (first_day,)
+            )]
+            charts.refresh(conn, days)
+        return charts
+
+    def save(self, path=ROLLING_STATE):
+        """Write the buckets and charts to a JSON file."""
+        if self.sketch_capacity is None:
+            days = self.days
+        else:
+            days = {
+                day: {kind: summary.to_dict() for kind, summary in bucket.items()}
+                for day, bucket in self.days.items()
+            }
+        state = {
+            'version': STATE_VERSION,
+            'windows': self.windows,
+            'top_k': self.top_k,
+            'sketch_capacity': self.sketch_capacity,
+            'last_day': self.last_day,
+            'days': days,
+            'songs': self.songs,
+            'charts': self.charts,
+        }
+        path = Path(path)
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path=ROLLING_STATE):
+        """Read charts written by save.
+
+        Returns:
+            The charts, or None if the file doesn't exist or has an older format.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        state = json.loads(path.read_text(encoding="utf-8"))
+        if state.get('version') != STATE_VERSION:
+            return None
+        charts = cls(state['windows'], state['top_k'], state['sketch_capacity'])
+        charts.last_day = state['last_day']
+        charts.songs = {int(song_id): tuple(song) for song_id, song in state['songs'].items()}
+        for day, bucket in state['days'].items():
+            if charts.sketch_capacity is None:
+                # JSON object keys are strings
+                charts.days[day] = {'songs': {int(k): v for k, v in bucket['songs'].items()}, 'artists': bucket['artists']}
+            else:
+                songs = SpaceSaving.from_dict(bucket['songs'])
+                songs.counts = {int(k): v for k, v in songs.counts.items()}
+                songs.errors = {int(k): v for k, v in songs.errors.items()}
+                charts.days[day] = {'songs': songs, 'artists': SpaceSaving.from_dict(bucket['artists'])}
+        charts.charts = state['charts']
+        if charts.last_day is not None:
+            charts._rebuild_totals()
+        return charts
+
+
+def update_rolling_charts(conn, days, path=ROLLING_STATE, sketch_capacity=None):
+    """Update the saved rolling charts with the plays of the given days.
+
+    The charts are built from the database instead when there is no saved
+    state, or it was saved with another sketch_capacity.
+
+    Returns:
+        The updated RollingCharts.
+    """
+    charts = RollingCharts.load(path)
+    if charts is None or charts.sketch_capacity != sketch_capacity:
+        logger.info("Building the rolling charts from the database")
+        charts = RollingCharts.from_database(conn, sketch_capacity=sketch_capacity)
+    elif days:
+        charts.refresh(conn, days)
+    else:
+        return charts
+    charts.save(path)
+    logger.info(f"Rolling charts updated up to {charts.last_day}")
+    return charts
@@ -0,0 +1,126 @@
+import json
+
+import pytest
+
+from archive import (
+    ArchiveError, PlayColumns, YearArchive, _section_bytes, _write_sections, date_play_to_epoch, pack_data_dir,
+    parse_archive_file, read_section_table, unpack_archive,
+)
+from ingest import parse_day_file
+
+
+def _play(play_id, date_play, artist, title, img="https://example.com/img/cover.jpg"):
+    return {"id": play_id, "date_play": date_play, "artist": artist, "title": title, "img": img}
+
+
+DAYS = {
+    "2024-01-01": {
+        "playlist": [
+            _play(1, "2024-01-01 10:00:00", "Björk", "Jóga"),
+            _play(2, "2024-01-01 10:04:00", "Kult", "Arahja", img="cover.png"),
+            # The same play twice, and a play without an artist
+            _play(2, "2024-01-01 10:04:00", "Kult", "Arahja", img="cover.png"),
+            _play(3, "2024-01-01 10:08:00", "", "Jingle"),
+        ],
+        "current_page": 1,
+        "last_page": 1,
+        "perpage": 220,
+        "total_elements": 4,
+    },
+    "2024-01-02": {
+        "total_elements": 0,
+        "playlist": [],
+    },
+    # Doesn't fit the columns (an extra key and a numeric title), kept as JSON
+    "2024-01-03": {
+        "playlist": [
+            {**_play(4, "2024-01-03 23:59:59", "Kult", "Arahja"), "extra": True},
+            _play(5, "2024-01-03 12:00:00", "Kult", 42),
+        ],
+    },
+    "2024-12-31": {
+        "playlist": [_play(2 ** 40, "2024-12-31 23:59:59", "Młynarski", "Jeszcze w zielone gramy", img="")],
+    },
+}
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    year_dir = tmp_path / "data" / "2024"
+    year_dir.mkdir(parents=True)
+    for day, document in DAYS.items():
+        with open(year_dir / f"{day}.json", "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=4, ensure_ascii=False)
+    return tmp_path / "data"
+
+
+@pytest.fixture
+def archive_path(data_dir, tmp_path):
+    [(path, day_count)] = pack_data_dir(data_dir, tmp_path / "archive")
+    assert day_count == len(DAYS)
+    return path
+
+
+def test_archive_rows_match_day_files(data_dir, archive_path):
+    expected = []
+    for json_path in sorted((data_dir / "2024").glob("*.json")):
+        _, rows, error = parse_day_file(json_path)
+        assert error is None
+        expected.extend(rows)
+    _, rows, error = parse_archive_file(archive_path)
+    assert error is None
+    assert rows == expected
+
+
+def test_unpack_restores_documents(archive_path, tmp_path):
+    assert unpack_archive(archive_path, tmp_path / "unpacked") == len(DAYS)
+    for day, document in DAYS.items():
+        with open(tmp_path / "unpacked" / "2024" / f"{day}.json", encoding="utf-8") as f:
+            assert json.load(f) == document
+
+
+def test_play_columns(archive_path):
+    with PlayColumns(archive_path) as columns:
+        # Plays with an artist and title, repeated plays counted once
+        assert len(columns) == 5
+        assert list(columns.epochs) == sorted(columns.epochs)
+        start = date_play_to_epoch("2024-01-01 00:00:00")
+        end = date_play_to_epoch("2024-01-02 00:00:00")
+        assert columns.count_between(start, end) == 2
+        counts = {columns.song(song_id): count for song_id, count in columns.song_counts().items()}
+        assert counts == {
+            ("Björk", "Jóga"): 1, ("Kult", "Arahja"): 2, ("Kult", 42): 1, ("Młynarski", "Jeszcze w zielone gramy"): 1,
+        }
+
+
+@pytest.mark.parametrize("size", [0, 10, 100, -100, -1])
+def test_truncated_archive_raises(archive_path, size):
+    content = archive_path.read_bytes()
+    archive_path.write_bytes(content[:size % len(content)] if size else b"")
+    _, rows, error = parse_archive_file(archive_path)
+    assert rows is None and error
+    with pytest.raises(ArchiveError):
+        PlayColumns(archive_path).close()
+
+
+def test_corrupt_section_raises(archive_path):
+    content = bytearray(archive_path.read_bytes())
+    _, offset, length, _ = read_section_table(content)["artist"]
+    content[offset + length // 2] ^= 0xFF
+    archive_path.write_bytes(bytes(content))
+    _, rows, error = parse_archive_file(archive_path)
+    assert rows is None and error
+
+
+def test_days_not_matching_columns_raise(archive_path):
+    # A day claiming one more play than the columns hold
+    buffer = archive_path.read_bytes()
+    table = read_section_table(buffer)
+    days = json.loads(_section_bytes(buffer, table["days"]))
+    days[0]["fields"]["playlist"] += 1
+    sections = [
+        (name, entry[0], json.dumps(days).encode("utf-8") if name == "days" else _section_bytes(buffer, entry))
+        for name, entry in table.items()
+    ]
+    with pytest.raises(ArchiveError):
+        YearArchive(_write_sections(sections))
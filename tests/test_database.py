@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+import database
+from database import add_playlist_batch, close_connections, get_connection, migrate_database, setup_database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # NOT_FOUND_SONGS_FILE is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "playlist.db"))
+    yield tmp_path / "playlist.db"
+    close_connections()
+
+
+def test_not_found_songs_imported_once_songs_are_loaded(db_path):
+    with open(database.NOT_FOUND_SONGS_FILE, "w", encoding="utf-8") as f:
+        f.write("Artist A - Song 1\nArtist A - Song 1\nArtist B - Song 2\nUnknown - Song\n")
+
+    setup_database()
+    conn = get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM metadata_lookup_failures").fetchone()[0] == 0
+    assert conn.execute("PRAGMA user_version").fetchone()[0] < len(database.MIGRATIONS)
+
+    plays = [
+        ("Artist A", "Song 1", 1, "2024-01-01 10:00:00", ""),
+        ("Artist B", "Song 2", 2, "2024-01-01 11:00:00", ""),
+        ("Artist C", "Song 3", 3, "2024-01-01 12:00:00", ""),
+    ]
+    add_playlist_batch(conn, plays)
+    assert migrate_database(conn) == 1
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+
+    failures = dict(conn.execute("""
+        SELECT s.artist || ' - ' || s.title, f.attempts
+        FROM metadata_lookup_failures f
+        JOIN songs s ON s.id = f.song_id
+    """).fetchall())
+    assert failures == {"Artist A - Song 1": 2, "Artist B - Song 2": 1}
+
+    # Applied migrations aren't run again
+    assert migrate_database(conn) == 0
+
+
+def test_migrations_advance_without_not_found_songs(db_path):
+    assert not os.path.exists(database.NOT_FOUND_SONGS_FILE)
+    setup_database()
+    assert get_connection().execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
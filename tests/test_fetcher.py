@@ -0,0 +1,163 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+import fetcher
+from fetcher import create_session, fetch_day, fetch_days, fetch_page, load_failed_days
+from ratelimit import RateLimiter
+
+API_PAGE_SIZE = 220  # The API ignores the requested page size
+
+DAYS = {
+    "2024-05-01": 500,  # Three pages
+    "2024-05-02": 100,  # A single page
+    "2024-05-03": 440,  # Exactly two full pages
+}
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Playlist API stub serving DAYS, with scripted failures per (day, page)."""
+
+    # (day, page) -> list of status codes returned before the page is served
+    failures = {}
+    # Days whose pages don't report last_page
+    without_last_page = set()
+    # Day -> last_page reported instead of the real one
+    last_pages = {}
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        day = query["date"][0]
+        page = int(query["page"][0])
+        with self.lock:
+            self.requests.append((day, page))
+            scripted = self.failures.get((day, page))
+            status = scripted.pop(0) if scripted else 200
+        if day not in DAYS and status == 200:
+            status = 404
+        if status != 200:
+            self.send_response(status)
+            self.end_headers()
+            return
+
+        total = DAYS[day]
+        start = (page - 1) * API_PAGE_SIZE
+        body = {
+            "playlist": [
+                {"id": i, "date_play": f"{day} {i // 60 % 24:02d}:{i % 60:02d}:00", "artist": f"Artist {i}",
+                 "title": f"Title {i}", "img": ""}
+                for i in range(start, min(start + API_PAGE_SIZE, total))
+            ],
+            "current_page": page,
+            "perpage": API_PAGE_SIZE,
+            "total_elements": total,
+        }
+        if day not in self.without_last_page:
+            body["last_page"] = self.last_pages.get(day, max(1, -(-total // API_PAGE_SIZE)))
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_url(monkeypatch):
+    # Retries don't need to wait against a local server
+    monkeypatch.setattr(fetcher.time, "sleep", lambda seconds: None)
+    StubAPI.failures = {}
+    StubAPI.without_last_page = set()
+    StubAPI.last_pages = {}
+    StubAPI.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPI)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/playlist"
+    server.shutdown()
+    server.server_close()
+
+
+def _fetch_day(api_url, day):
+    with create_session("key") as session, ThreadPoolExecutor(2) as page_executor:
+        return fetch_day(session, api_url, date.fromisoformat(day), RateLimiter(0), page_executor)
+
+
+@pytest.mark.parametrize("day", sorted(DAYS))
+@pytest.mark.parametrize("last_page", [True, False])
+def test_fetch_day_fetches_every_page(api_url, day, last_page):
+    if not last_page:
+        StubAPI.without_last_page.add(day)
+    data = _fetch_day(api_url, day)
+    assert [song["id"] for song in data["playlist"]] == list(range(DAYS[day]))
+    assert sorted(page for _, page in StubAPI.requests) == list(range(1, -(-DAYS[day] // API_PAGE_SIZE) + 1))
+
+
+def test_server_error_is_retried(api_url):
+    StubAPI.failures = {("2024-05-01", 2): [503]}
+    data = _fetch_day(api_url, "2024-05-01")
+    assert len(data["playlist"]) == DAYS["2024-05-01"]
+    assert StubAPI.requests.count(("2024-05-01", 2)) == 2
+
+
+def test_client_error_is_not_retried(api_url):
+    with create_session("key") as session, pytest.raises(requests.exceptions.HTTPError):
+        fetch_page(session, api_url, date(2024, 5, 9), 1, RateLimiter(0))
+    assert StubAPI.requests == [("2024-05-09", 1)]
+
+
+def test_server_error_gives_up_after_retries(api_url):
+    StubAPI.failures = {("2024-05-02", 1): [503] * (fetcher.DEFAULT_RETRIES + 1)}
+    with create_session("key") as session, pytest.raises(requests.exceptions.HTTPError):
+        fetch_page(session, api_url, date(2024, 5, 2), 1, RateLimiter(0))
+    assert len(StubAPI.requests) == fetcher.DEFAULT_RETRIES + 1
+
+
+def test_fetch_days_queues_failing_days(api_url, tmp_path):
+    queue_file = tmp_path / "failed_days.txt"
+    days = [date.fromisoformat(day) for day in sorted(DAYS)]
+    # The first day keeps failing, the second one fails for this run only
+    StubAPI.failures = {
+        ("2024-05-01", 1): [503] * 100,
+        ("2024-05-02", 1): [503] * (fetcher.DEFAULT_RETRIES + 1),
+    }
+
+    fetched, failed = fetch_days(days, "key", api_url, tmp_path / "data", queue_file, rate_limit=0)
+    assert (fetched, failed) == (1, 2)
+    assert load_failed_days(queue_file) == {date(2024, 5, 1), date(2024, 5, 2)}
+    assert not (tmp_path / "data" / "2024" / "2024-05-01.json").exists()
+
+    fetched, failed = fetch_days(sorted(load_failed_days(queue_file)), "key", api_url, tmp_path / "data",
+                                 queue_file, rate_limit=0)
+    assert (fetched, failed) == (1, 1)
+    assert load_failed_days(queue_file) == {date(2024, 5, 1)}
+    with open(tmp_path / "data" / "2024" / "2024-05-02.json", encoding="utf-8") as f:
+        assert len(json.load(f)["playlist"]) == DAYS["2024-05-02"]
+
+
+def test_fetch_days_queues_incomplete_days(api_url, tmp_path):
+    queue_file = tmp_path / "failed_days.txt"
+    # The last of three pages is missing from the reported page count
+    StubAPI.last_pages = {"2024-05-01": 2}
+    fetched, failed = fetch_days([date(2024, 5, 1)], "key", api_url, tmp_path / "data", queue_file, rate_limit=0)
+    assert (fetched, failed) == (0, 1)
+    assert load_failed_days(queue_file) == {date(2024, 5, 1)}
+    # The plays it has are kept
+    with open(tmp_path / "data" / "2024" / "2024-05-01.json", encoding="utf-8") as f:
+        assert len(json.load(f)["playlist"]) == 2 * API_PAGE_SIZE
+
+    StubAPI.last_pages = {}
+    fetched, failed = fetch_days([date(2024, 5, 1)], "key", api_url, tmp_path / "data", queue_file, rate_limit=0)
+    assert (fetched, failed) == (1, 0)
+    assert not queue_file.exists()
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmark_import_time import DEFAULT_BUDGET_MS, DEFERRED_MODULES, import_times
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def test_main_defers_command_modules(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+    times = import_times("main")
+    assert sorted(name for name in times if name in DEFERRED_MODULES) == []
+
+
+def test_import_time_within_budget():
+    result = subprocess.run(
+        [sys.executable, "benchmark_import_time.py", "--runs", "3", "--budget-ms", str(DEFAULT_BUDGET_MS)],
+        cwd=REPO_DIR, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
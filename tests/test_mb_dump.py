@@ -0,0 +1,85 @@
+import gzip
+import io
+import json
+import tarfile
+
+import pytest
+
+from mb_dump import DUMP_ARTIST_MEMBER, LocalResolver, import_dump
+
+ARTISTS = [
+    {
+        "id": "a1", "name": "Björk", "country": "IS", "area": {"name": "Iceland"},
+        "aliases": [{"name": "Bjork Gudmundsdottir", "sort-name": "Gudmundsdottir, Bjork"}],
+        "tags": [{"name": "electronic", "count": 5}, {"name": "art pop", "count": 2}],
+    },
+    # Two artists sharing a name, the one with more tag votes wins
+    {"id": "a2", "name": "Nirvana", "country": "US", "tags": [{"name": "grunge", "count": 40}]},
+    {"id": "a3", "name": "Nirvana", "country": "GB", "tags": [{"name": "psychedelic", "count": 3}]},
+    # An artist whose alias is another artist's name loses to that artist
+    {"id": "a4", "name": "Kurt's Band", "aliases": [{"name": "Nirvana"}], "tags": [{"name": "rock", "count": 99}]},
+]
+
+
+def _dump_lines():
+    lines = [json.dumps(artist) for artist in ARTISTS]
+    lines.insert(1, "{not json")
+    lines.insert(2, "")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+@pytest.fixture(params=["plain", "gz", "tar"])
+def dump_path(request, tmp_path):
+    if request.param == "plain":
+        path = tmp_path / "artist.jsonl"
+        path.write_bytes(_dump_lines())
+    elif request.param == "gz":
+        path = tmp_path / "artist.jsonl.gz"
+        with gzip.open(path, "wb") as f:
+            f.write(_dump_lines())
+    else:
+        path = tmp_path / "artist.tar.gz"
+        content = _dump_lines()
+        with tarfile.open(path, "w:gz") as archive:
+            info = tarfile.TarInfo(DUMP_ARTIST_MEMBER)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return path
+
+
+@pytest.fixture
+def resolver(dump_path, tmp_path):
+    db_path = tmp_path / "musicbrainz.db"
+    assert import_dump(dump_path, db_path) == len(ARTISTS)
+    resolver = LocalResolver(db_path)
+    yield resolver
+    resolver.close()
+
+
+def test_lookup_by_normalised_name(resolver):
+    artist_data, artist_details = resolver.lookup("BJORK")
+    assert artist_data == {"id": "a1", "name": "Björk", "country": "IS", "area": {"name": "Iceland"}}
+    assert artist_details["artist"]["tag-list"] == [
+        {"name": "electronic", "count": "5"}, {"name": "art pop", "count": "2"}
+    ]
+
+
+def test_lookup_by_alias_and_sort_name(resolver):
+    assert resolver.lookup("Bjork Gudmundsdottir")[0]["id"] == "a1"
+    assert resolver.lookup("gudmundsdottir, bjork")[0]["id"] == "a1"
+
+
+def test_own_name_then_popularity_wins(resolver):
+    assert resolver.lookup("nirvana")[0]["id"] == "a2"
+
+
+def test_unknown_artist(resolver):
+    assert resolver.lookup("Alabama 3") is None
+
+
+def test_tar_without_artist_member(tmp_path):
+    path = tmp_path / "other.tar"
+    with tarfile.open(path, "w") as archive:
+        archive.addfile(tarfile.TarInfo("mbdump/label"), io.BytesIO(b""))
+    with pytest.raises(ValueError):
+        import_dump(path, tmp_path / "musicbrainz.db")
@@ -0,0 +1,70 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import musicbrainz_client
+from musicbrainz_client import MusicBrainzClient
+
+SEARCH_RESPONSE = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#" xmlns:ext="http://musicbrainz.org/ns/ext#-2.0">'
+    b'<artist-list count="1" offset="0"><artist id="a1" type="Group" ext:score="100">'
+    b'<name>Nirvana</name><sort-name>Nirvana</sort-name><country>US</country></artist></artist-list>'
+    b'</metadata>'
+)
+
+
+class StubMusicBrainz(BaseHTTPRequestHandler):
+    """Web service stub answering with the scripted (status, headers) responses, then the search result."""
+
+    responses = []
+    requests = 0
+
+    def do_GET(self):
+        StubMusicBrainz.requests += 1
+        status, headers = self.responses.pop(0) if self.responses else (200, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        content = SEARCH_RESPONSE if status == 200 else b""
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(musicbrainz_client.time, "sleep", sleeps.append)
+    StubMusicBrainz.responses = []
+    StubMusicBrainz.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubMusicBrainz)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    with MusicBrainzClient(rate_limit=0, base_url=f"http://127.0.0.1:{server.server_address[1]}/ws/2") as client:
+        client.sleeps = sleeps
+        yield client
+    server.shutdown()
+    server.server_close()
+
+
+def test_throttled_request_waits_for_retry_after(client):
+    StubMusicBrainz.responses = [(429, {"Retry-After": "7"}), (503, {})]
+    result = client.search_artists("nirvana")
+    assert result["artist-list"][0]["name"] == "Nirvana"
+    assert StubMusicBrainz.requests == 3
+    # Retry-After wins over a shorter backoff, the backoff applies without it
+    assert client.sleeps == [7.0, 2 * musicbrainz_client.DEFAULT_BACKOFF]
+
+
+def test_client_error_is_not_retried(client):
+    StubMusicBrainz.responses = [(400, {})]
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.search_artists("nirvana")
+    assert StubMusicBrainz.requests == 1
+    assert client.sleeps == []
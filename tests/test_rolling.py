@@ -0,0 +1,160 @@
+import heapq
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from names import canonical_spellings
+from rolling import RollingCharts, SpaceSaving
+
+# Spelling variants of one artist are charted together
+SONGS = {
+    1: ("Björk", "Jóga"),
+    2: ("Bjork", "Army of Me"),
+    3: ("Kult", "Arahja"),
+    4: ("Kult", "Polska"),
+    5: ("Myslovitz", "Długość dźwięku samotności"),
+    6: ("Republika", "Telefony"),
+    7: ("Lao Che", "Hydropiekłowstąpienie"),
+    8: ("Nirvana", "Lithium"),
+}
+TOP_K = 3
+
+
+def _day(offset):
+    return (date(2024, 1, 1) + timedelta(days=offset)).isoformat()
+
+
+def _expected_charts(history, windows, top_k):
+    """The charts recomputed from scratch from the latest counts of every day."""
+    last_day = max(history)
+    charts = {}
+    for window in windows:
+        first_day = (date.fromisoformat(last_day) - timedelta(days=window - 1)).isoformat()
+        song_totals = {}
+        artist_totals = {}
+        for day, counts in history.items():
+            if first_day <= day <= last_day:
+                for song_id, plays in counts.items():
+                    song_totals[song_id] = song_totals.get(song_id, 0) + plays
+                    artist = SONGS[song_id][0]
+                    artist_totals[artist] = artist_totals.get(artist, 0) + plays
+        canonical = canonical_spellings(artist_totals)
+        artists = {}
+        for artist, plays in artist_totals.items():
+            artists[canonical[artist]] = artists.get(canonical[artist], 0) + plays
+        top_artists = heapq.nsmallest(top_k, artists.items(), key=lambda x: (-x[1], x[0]))
+        top_songs = heapq.nsmallest(top_k, song_totals.items(), key=lambda x: (-x[1], SONGS[x[0]]))
+        charts[str(window)] = {
+            'first_day': first_day,
+            'last_day': last_day,
+            'top_artists': [{'artist': artist, 'play_count': plays} for artist, plays in top_artists],
+            'top_songs': [
+                {'artist': SONGS[song_id][0], 'title': SONGS[song_id][1], 'play_count': plays}
+                for song_id, plays in top_songs
+            ],
+        }
+    return charts
+
+
+def _charts_without_estimated(charts):
+    return {
+        window: {key: value for key, value in chart.items() if key != 'estimated'}
+        for window, chart in charts.items()
+    }
+
+
+def _counts(charts):
+    """The window totals of charts as plain dicts."""
+    return {
+        window: {kind: dict(charts._counts(counts)) for kind, counts in totals.items()}
+        for window, totals in charts._totals.items()
+    }
+
+
+def _random_day(rng):
+    song_ids = rng.sample(sorted(SONGS), rng.randint(1, len(SONGS)))
+    return {song_id: rng.randint(1, 9) for song_id in song_ids}
+
+
+def _updates(rng):
+    """Batches of days: new days, updates of existing days, gaps and a jump past the longest window."""
+    offset = 0
+    for step in range(40):
+        batch = {}
+        if step == 25:
+            offset += 120  # Everything falls out of every window
+        elif step % 7 == 3:
+            offset += rng.randint(5, 40)
+        else:
+            offset += rng.randint(0, 2)
+        batch[_day(offset)] = _random_day(rng)
+        # Re-update a recent day, or one already outside the longest window
+        if step % 3 == 0:
+            batch[_day(max(0, offset - rng.randint(1, 100)))] = _random_day(rng)
+        yield batch
+
+
+@pytest.mark.parametrize("sketch_capacity", [None, 100])
+def test_updates_match_recomputed_charts(tmp_path, sketch_capacity):
+    rng = random.Random(0)
+    charts = RollingCharts(top_k=TOP_K, sketch_capacity=sketch_capacity)
+    history = {}
+    for i, batch in enumerate(_updates(rng)):
+        charts.update(batch, SONGS)
+        last_day = max([*history, *batch])
+        first_day = (date.fromisoformat(last_day) - timedelta(days=max(charts.windows) - 1)).isoformat()
+        # Days before the longest window are ignored by the update
+        history.update({day: counts for day, counts in batch.items() if day >= first_day})
+        assert _charts_without_estimated(charts.charts) == _expected_charts(history, charts.windows, TOP_K)
+        assert all(chart['estimated'] == (sketch_capacity is not None) for chart in charts.charts.values())
+        assert min(charts.days) >= first_day
+
+        if i % 10 == 9:
+            # Continue from the saved state, as the next ingest would
+            path = tmp_path / "rolling_state.json"
+            charts.save(path)
+            loaded = RollingCharts.load(path)
+            assert loaded.charts == charts.charts
+            assert loaded._window_days == charts._window_days
+            assert _counts(loaded) == _counts(charts)
+            charts = loaded
+
+
+def test_load_missing_or_outdated_state(tmp_path):
+    path = tmp_path / "rolling_state.json"
+    assert RollingCharts.load(path) is None
+    path.write_text('{"version": 0}', encoding="utf-8")
+    assert RollingCharts.load(path) is None
+
+
+def test_space_saving_is_exact_below_capacity():
+    rng = random.Random(1)
+    summary = SpaceSaving(capacity=10)
+    exact = {}
+    for _ in range(500):
+        key = rng.randrange(10)
+        count = rng.randint(1, 5)
+        summary.add(key, count)
+        exact[key] = exact.get(key, 0) + count
+    assert summary.counts == exact
+    assert summary.errors == {}
+
+    merged = SpaceSaving.merged([summary, summary], capacity=10)
+    assert merged.counts == {key: 2 * count for key, count in exact.items()}
+
+
+def test_space_saving_keeps_frequent_keys_over_capacity():
+    rng = random.Random(2)
+    summary = SpaceSaving(capacity=5)
+    exact = {}
+    for _ in range(2000):
+        # Key 0 makes up about a third of the stream, the rest is spread over 50 keys
+        key = 0 if rng.random() < 0.3 else rng.randint(1, 50)
+        summary.add(key)
+        exact[key] = exact.get(key, 0) + 1
+    assert len(summary.counts) == 5
+    assert 0 in summary.counts
+    for key, count in summary.counts.items():
+        # Counts are overestimated by at most the count inherited from the evicted key
+        assert count - summary.errors.get(key, 0) <= exact[key] <= count
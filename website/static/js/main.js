@@ -1,19 +1,70 @@
 // Global variables
+let manifest = null;
 let statisticsData = null;
 let currentYearFilter = 'all';
+let searchIndex = null;
+const loadingShards = {};
+
+// Fetch a JSON file from the data directory
+async function fetchJSON(path, options = {}) {
+    const response = await fetch(`data/${path}`, options);
+    if (!response.ok) {
+        throw new Error('Network response was not ok');
+    }
+    return response.json();
+}
+
+// Fetch a shard once, later calls share the same request
+function fetchShard(path) {
+    if (!loadingShards[path]) {
+        loadingShards[path] = fetchJSON(path).catch(error => {
+            delete loadingShards[path];
+            throw error;
+        });
+    }
+    return loadingShards[path];
+}
 
-// Fetch the JSON data
+// Fetch the manifest and the summary, which is all the first render needs; other shards are fetched on demand
 async function fetchData() {
     try {
-        const response = await fetch('data/statistics.json');
-        if (!response.ok) {
-            throw new Error('Network response was not ok');
-        }
-        statisticsData = await response.json();
+        // Shard names change with their content, only the manifest must be revalidated
+        manifest = await fetchJSON('manifest.json', { cache: 'no-cache' });
+        statisticsData = await fetchShard(manifest.summary);
+        statisticsData.top_artists_by_year = {};
+        statisticsData.top_songs_by_year = {};
         initializeWebsite();
     } catch (error) {
         console.error('Error fetching data:', error);
         document.body.innerHTML = `<div class="error">Failed to load data. Please try again later.</div>`;
+        return;
+    }
+    loadArtistsTimeline();
+}
+
+// Fetch the top artists and songs of a year, unless already loaded
+async function loadYearData(year) {
+    if (year === 'all' || statisticsData.top_artists_by_year[year]) {
+        return;
+    }
+    const yearData = await fetchShard(manifest.years[year]);
+    statisticsData.top_artists_by_year[year] = yearData.top_artists;
+    statisticsData.top_songs_by_year[year] = yearData.top_songs;
+}
+
+// Fetch the rank timeline and render it
+async function loadArtistsTimeline() {
+    const chartElement = document.getElementById('artists-timeline-chart');
+    chartElement.innerHTML = '<div class="no-data">Ładowanie...</div>';
+    try {
+        const timeline = await fetchShard(manifest.timeline);
+        statisticsData.artist_rank_timeline = timeline.artist_rank_timeline;
+        statisticsData.years_timeline = timeline.years_timeline;
+        chartElement.innerHTML = '';
+        renderArtistsTimeline();
+    } catch (error) {
+        console.error('Error fetching timeline:', error);
+        chartElement.innerHTML = '<div class="no-data">Nie udało się załadować danych.</div>';
     }
 }
 
@@ -25,7 +76,6 @@ function initializeWebsite() {
     renderMonthlyData();
     renderTopArtistsData();
     renderTopSongsData();
-    renderArtistsTimeline();
     populateDataBrowser();
     setupEventListeners();
 }
@@ -33,8 +83,8 @@ function initializeWebsite() {
 // Populate the year selector dropdown
 function populateYearSelector() {
     const yearSelect = document.getElementById('year-select');
-    // Extract all years from the years_data array
-    const years = Object.keys(statisticsData.top_artists_by_year);
+    // Years with their own shard
+    const years = Object.keys(manifest.years);
 
     years.forEach(year => {
         const option = document.createElement('option');
@@ -636,8 +686,18 @@ function populateSongsList() {
 // Set up event listeners
 function setupEventListeners() {
     // Year filter change
-    document.getElementById('year-select').addEventListener('change', function (e) {
-        currentYearFilter = e.target.value;
+    document.getElementById('year-select').addEventListener('change', async function (e) {
+        const year = e.target.value;
+        try {
+            await loadYearData(year);
+        } catch (error) {
+            console.error('Error fetching year data:', error);
+        }
+        // Ignore years that were selected while this one was loading
+        if (e.target.value !== year) {
+            return;
+        }
+        currentYearFilter = year;
         updateAllVisualizations();
     });
 
@@ -681,12 +741,76 @@ function setupEventListeners() {
 
     // Search functionality
     document.getElementById('artist-search').addEventListener('input', function (e) {
-        filterList('artists-list', e.target.value);
+        searchList('artists', e.target.value);
     });
 
     document.getElementById('song-search').addEventListener('input', function (e) {
-        filterList('songs-list', e.target.value);
+        searchList('songs', e.target.value);
+    });
+}
+
+// Search the list of a tab: all years are searched in the search index, a single year in its list
+async function searchList(tab, searchTerm) {
+    const listId = `${tab}-list`;
+    if (currentYearFilter !== 'all') {
+        filterList(listId, searchTerm);
+        return;
+    }
+    if (!searchTerm) {
+        if (tab === 'artists') {
+            populateArtistsList();
+        } else {
+            populateSongsList();
+        }
+        return;
+    }
+
+    try {
+        searchIndex = await fetchShard(manifest.search_index);
+    } catch (error) {
+        console.error('Error fetching search index:', error);
+        filterList(listId, searchTerm);
+        return;
+    }
+    // Skip results of searches the user has typed past
+    if (document.getElementById(tab === 'artists' ? 'artist-search' : 'song-search').value !== searchTerm) {
+        return;
+    }
+
+    const lowerSearchTerm = searchTerm.toLowerCase();
+    const results = [];
+    if (tab === 'artists') {
+        for (const [artist, playCount] of searchIndex.artists) {
+            if (artist.toLowerCase().includes(lowerSearchTerm)) {
+                results.push({ name: artist, play_count: playCount });
+                if (results.length === 100) break;
+            }
+        }
+    } else {
+        for (const [artistPosition, title, playCount] of searchIndex.songs) {
+            const name = `${searchIndex.artists[artistPosition][0]} - ${title}`;
+            if (name.toLowerCase().includes(lowerSearchTerm)) {
+                results.push({ name, play_count: playCount });
+                if (results.length === 100) break;
+            }
+        }
+    }
+
+    const listElement = document.getElementById(listId);
+    listElement.innerHTML = '';
+    results.forEach(result => {
+        const itemElement = document.createElement('div');
+        itemElement.className = 'data-item';
+        itemElement.innerHTML = `
+            <span class="item-name">${result.name}</span>
+            <span class="item-count">${result.play_count} odtworzeń</span>
+        `;
+        listElement.appendChild(itemElement);
     });
+
+    if (results.length === 0) {
+        listElement.innerHTML = '<div class="no-data">Brak wyników</div>';
+    }
 }
 
 // Filter list items based on search input
@@ -712,6 +836,9 @@ function updateAllVisualizations() {
     renderTopSongsData();
     // Note: We don't update the timeline here as it always shows all years
     populateDataBrowser();
+    // Keep the search results of the new year
+    searchList('artists', document.getElementById('artist-search').value);
+    searchList('songs', document.getElementById('song-search').value);
 }
 
 // Start the application